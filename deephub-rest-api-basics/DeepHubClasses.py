@@ -1,5 +1,14 @@
+import math
+from operator import attrgetter
+
 import ujson as json
 
+# Meters per degree of latitude, and of longitude at the equator, on a sphere with the WGS84 semi-major axis.
+METERS_PER_DEGREE = 6378137.0 * math.pi / 180
+
+# The typical accuracy of the providers, as the standard deviation of the position noise in meters, by provider type.
+ACCURACY = {'gps': 2.5, 'uwb': 0.3}
+
 # The default value used for Points in WGS84 coordinates.
 default_point = [8.675234, 49.415941]
 
@@ -29,22 +38,42 @@ default_ground_control_points = [[8.675370, 49.416053], [3.166, 4.218],
                                  [8.675369, 49.415872], [3.138, 0.000]]
 
 
+# Used by the Json encoder to serialize nested objects, including those keeping their properties in __slots__.
+# Unset slots, as well as slots set to None, are omitted, and any other attributes are written out after them.
+def to_dict(obj) -> dict:
+    properties = getattr(obj, '_properties', None)
+    if properties is None:
+        return obj.__dict__
+    result = {name: getattr(obj, name) for name in properties if getattr(obj, name, None) is not None}
+    result.update(obj.__dict__)
+    return result
+
+
 class JsonSerializable(object):
+    __slots__ = ()
+
     def to_json(self) -> str:
-        return json.dumps(self, default=lambda x: x.__dict__)
+        return json.dumps(self, default=to_dict)
 
     def to_json_list(self) -> str:
         return '[' + self.to_json() + ']'
 
     def pretty(self) -> str:
-        return json.dumps(self, default=lambda x: x.__dict__, indent=2)
+        return json.dumps(self, default=to_dict, indent=2)
 
 
+# Points and Locations are created for every location update, so they keep their properties in __slots__.
+# They still have a __dict__, which is only created when other attributes are set, e.g. the bbox of a GeoJSON point,
+# the id of a stored location, or attributes added by the examples, and those are serialized as well.
 class Point(JsonSerializable):
+    __slots__ = ('type', 'coordinates', '__dict__')
+    _properties = __slots__[:-1]
+
     def __init__(self, other=None, objType='Point', coordinates=default_point):
         if type(other) is dict:
+            self.type = objType
             for key, value in other.items():
-                self.__dict__[key] = value
+                setattr(self, key, value)
         else:
             self.type, self.coordinates = objType, coordinates
 
@@ -110,12 +139,99 @@ class LocationProvider(JsonSerializable):
 
 
 class Location(JsonSerializable):
+    # All properties of an omlox location. Properties that are None are not serialized.
+    __slots__ = ('position', 'provider_id', 'provider_type', 'source', 'crs', 'timestamp_generated',
+                 'timestamp_sent', 'associated', 'accuracy', 'floor', 'true_heading', 'magnetic_heading',
+                 'heading_accuracy', 'elevation_ref', 'speed', 'course', 'properties', '__dict__')
+    _properties = __slots__[:-1]
+
     def __init__(self, other=None, provider_id='ProviderId', provider_type='uwb', position=Point()):
+        for name in self._properties:
+            setattr(self, name, None)
         if type(other) is dict:
             for key, value in other.items():
-                self.__dict__[key] = value
+                setattr(self, key, value)
+            if type(self.position) is dict:
+                self.position = Point(self.position)
         else:
             self.position = position
             self.provider_id = provider_id
             self.provider_type = provider_type
             self.source = provider_id
+
+
+#
+# Encodes Locations directly into a bytes buffer, for sending batches of location updates.
+#
+# Unlike to_json, this does not walk the location through the default hook. All properties but the position
+# rarely change between two updates of a provider, so their Json is cached and only the position is encoded
+# for every update.
+#
+class LocationEncoder(object):
+    _field_names = Location._properties[1:]
+    _fields = attrgetter(*_field_names)
+    _keys = [('"' + name + '":').encode() for name in _field_names]
+
+    def __init__(self, cache_size: int = 4096):
+        self.cache_size = cache_size
+        self._cache = {}
+
+    #
+    # Append the Json of the given location to the buffer.
+    #
+    def encode_into(self, location: Location, buffer: bytearray):
+        fields = self._fields(location)
+        if location.__dict__:
+            # Locations with other attributes are encoded without the cache.
+            prefix = self._encode_fields(fields, location.__dict__)
+        else:
+            try:
+                prefix = self._cache.get(fields)
+            except TypeError:
+                # Unhashable properties, e.g. a dict of custom properties, are encoded without the cache.
+                prefix = self._encode_fields(fields)
+            else:
+                if prefix is None:
+                    if len(self._cache) >= self.cache_size:
+                        self._cache.clear()
+                    prefix = self._cache[fields] = self._encode_fields(fields)
+        buffer += prefix
+        position = location.position
+        if position is None:
+            buffer += b'}'
+            return
+        if len(prefix) > 1:
+            buffer += b','
+        if type(position) is Point and getattr(position, 'type', None) == 'Point' and not position.__dict__ \
+                and getattr(position, 'coordinates', None) is not None:
+            buffer += b'"position":{"type":"Point","coordinates":'
+            buffer += json.dumps(position.coordinates).encode()
+            buffer += b'}}'
+        else:
+            buffer += b'"position":'
+            buffer += json.dumps(position, default=to_dict).encode()
+            buffer += b'}'
+
+    def _encode_fields(self, fields: tuple, attributes: dict = None) -> bytes:
+        encoded = [key + json.dumps(value, default=to_dict).encode()
+                   for key, value in zip(self._keys, fields) if value is not None]
+        if attributes:
+            encoded += [json.dumps(name).encode() + b':' + json.dumps(value, default=to_dict).encode()
+                        for name, value in attributes.items()]
+        return b'{' + b','.join(encoded)
+
+    #
+    # Encode the given locations as a Json list, reusing the given buffer if any.
+    #
+    def encode_list(self, locations, buffer: bytearray = None) -> bytearray:
+        if buffer is None:
+            buffer = bytearray()
+        else:
+            del buffer[:]
+        separator = b'['
+        for location in locations:
+            buffer += separator
+            separator = b','
+            self.encode_into(location, buffer)
+        buffer += b']' if separator == b',' else b'[]'
+        return buffer
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+import argparse
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests as rest
+
+from DeepHubRecorder import location_time
+
+
+#
+# Deletes the providers that have not sent a location for expiration_time seconds.
+#
+# The last-seen time of every provider is taken from the location_updates of a StreamConsumer, by adding the
+# sweeper as a sink, or from a bulk fetch of all locations with load(). Recording a location only updates a dict.
+# The providers are kept in a min-heap keyed by their expiry, with one entry per provider: when an entry comes
+# due, it is either pushed back with the provider's current expiry, if the provider has been seen since, or the
+# provider is deleted. A sweep therefore costs time proportional to the number of due entries, not the number of
+# providers.
+#
+# Expired providers are deleted in batches of up to batch_size concurrent requests. With a registry, the deletes
+# go through the EntityRegistry, so that its cache stays in sync. If provider_ids is given, only these providers
+# are tracked and deleted.
+#
+class ProviderSweeper(object):
+    def __init__(self, url: str, expiration_time: float = 60, registry=None, batch_size: int = 100,
+                 sweep_interval: float = 1.0, delete_workers: int = 8, provider_ids=None):
+        self.url = url
+        self.expiration_time = expiration_time
+        self.registry = registry
+        self.batch_size = batch_size
+        self.sweep_interval = sweep_interval
+        self.delete_workers = delete_workers
+        self.provider_ids = set(provider_ids) if provider_ids is not None else None
+        self.session = registry.session if registry is not None else rest.Session()
+        self.last_seen = {}
+        self._heap = []
+        # The providers with an entry in the heap.
+        self._scheduled = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.deleted = 0
+        self.failed = 0
+        self.dropped = 0
+
+    #
+    # Record that the provider has been seen at the given time, in seconds since the epoch, or now.
+    #
+    def seen(self, provider_id: str, timestamp: float = None):
+        if self.provider_ids is not None and provider_id not in self.provider_ids:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            previous = self.last_seen.get(provider_id)
+            if previous is not None and previous >= timestamp:
+                return
+            self.last_seen[provider_id] = timestamp
+            if provider_id not in self._scheduled:
+                self._scheduled.add(provider_id)
+                heapq.heappush(self._heap, (timestamp + self.expiration_time, provider_id))
+
+    def forget(self, provider_id: str):
+        with self._lock:
+            self.last_seen.pop(provider_id, None)
+
+    #
+    # Handle a batch of (topic, payload) events of a StreamConsumer.
+    #
+    def handle(self, batch: list):
+        for topic, payload in batch:
+            if topic == 'location_updates':
+                provider_id = payload.get('provider_id')
+                if provider_id is not None:
+                    self.seen(provider_id, location_time(payload))
+            elif topic == 'metadata_changes' and payload.get('operation') == 'delete' \
+                    and payload.get('type') in ('location_provider', 'provider'):
+                self.forget(payload.get('id'))
+
+    #
+    # Record the latest locations of all providers, with a single request.
+    #
+    def load(self):
+        for location in self.session.get(self.url + '/providers/locations').json():
+            self.seen(location['provider_id'], location_time(location))
+        return self
+
+    #
+    # Delete all providers that have expired by now, and return their ids.
+    #
+    def sweep(self, now: float = None) -> list:
+        if now is None:
+            now = time.time()
+        expired = []
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                _, provider_id = heapq.heappop(heap)
+                last_seen = self.last_seen.get(provider_id)
+                expiry = None if last_seen is None else last_seen + self.expiration_time
+                if expiry is not None and expiry > now:
+                    heapq.heappush(heap, (expiry, provider_id))
+                    continue
+                self._scheduled.discard(provider_id)
+                if last_seen is not None:
+                    del self.last_seen[provider_id]
+                    expired.append(provider_id)
+        for start in range(0, len(expired), self.batch_size):
+            self._delete(expired[start:start + self.batch_size])
+        return expired
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.sweep_interval):
+            expired = self.sweep()
+            if expired:
+                print('Deleted {} expired providers'.format(len(expired)))
+
+    def _delete(self, provider_ids: list):
+        def delete(provider_id):
+            try:
+                if self.registry is not None:
+                    self.registry.delete('providers', provider_id)
+                else:
+                    response = self.session.delete(self.url + '/providers/' + provider_id)
+                    if response.status_code != 404:
+                        response.raise_for_status()
+                return True
+            except rest.RequestException:
+                return False
+
+        with ThreadPoolExecutor(min(self.delete_workers, len(provider_ids))) as pool:
+            for deleted in pool.map(delete, provider_ids):
+                if deleted:
+                    self.deleted += 1
+                else:
+                    self.failed += 1
+
+
+#
+# Delete the expired providers of the DeepHub at the given url once, or keep deleting providers as they expire,
+# following their locations over the WebSocket API.
+#
+def run(url: str, expiration_time: float = 60, once: bool = False):
+    sweeper = ProviderSweeper(url, expiration_time).load()
+    if once:
+        print('Deleted', len(sweeper.sweep()), 'expired providers.')
+        return
+    from DeepHubStream import StreamConsumer
+    consumer = StreamConsumer(url.replace('http', 'ws', 1) + '/ws/socket',
+                              topics=['location_updates', 'metadata_changes'])
+    consumer.add_sink(sweeper)
+    sweeper.start()
+    try:
+        consumer.run_forever()
+    except KeyboardInterrupt:
+        pass
+    sweeper.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Delete the providers of a DeepHub that have not sent a location '
+                                                 'for a while.')
+    parser.add_argument('--url', default='http://localhost:8081/deephub/v1',
+                        help='the url of the DeepHub (default: http://localhost:8081/deephub/v1)')
+    parser.add_argument('--expiration', type=float, default=60,
+                        help='seconds after the last location until a provider expires (default: 60)')
+    parser.add_argument('--once', action='store_true', help='sweep once instead of following the WebSocket API')
+    args = parser.parse_args()
+    run(args.url, args.expiration, args.once)
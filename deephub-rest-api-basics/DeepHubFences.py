@@ -0,0 +1,162 @@
+import datetime
+import math
+from collections import defaultdict
+
+import numpy as np
+import ujson as json
+
+from DeepHubClasses import METERS_PER_DEGREE
+
+
+#
+# A fence prepared for local evaluation: a polygon, given as exterior ring and holes, or a point with a radius.
+#
+class LocalFence(object):
+    def __init__(self, fence):
+        if not isinstance(fence, dict):
+            fence = json.loads(fence.to_json())
+        self.id = fence['id']
+        self.name = fence.get('name')
+        self.foreign_id = fence.get('foreign_id')
+        region = fence['region']
+        if region['type'] == 'Polygon':
+            self.rings = [np.asarray(ring, dtype=float)[:, :2] for ring in region['coordinates']]
+            exterior = self.rings[0]
+            self.bounds = (exterior[:, 0].min(), exterior[:, 1].min(), exterior[:, 0].max(), exterior[:, 1].max())
+            self.center, self.radius = None, None
+        elif region['type'] == 'Point':
+            self.rings = None
+            self.center = np.asarray(region['coordinates'], dtype=float)[:2]
+            self.radius = float(fence.get('radius') or 0)
+            lat_degrees = self.radius / METERS_PER_DEGREE
+            lon_degrees = lat_degrees / max(math.cos(math.radians(self.center[1])), 1e-9)
+            self.bounds = (self.center[0] - lon_degrees, self.center[1] - lat_degrees,
+                           self.center[0] + lon_degrees, self.center[1] + lat_degrees)
+        else:
+            raise ValueError('Unsupported region type {} of fence {}'.format(region['type'], self.id))
+
+    #
+    # Return for each of the given WGS84 positions whether it is inside the fence.
+    #
+    def contains(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        if self.rings is None:
+            # Equirectangular distance, which is accurate to well below a meter at the size of fences.
+            dx = (lon - self.center[0]) * math.cos(math.radians(self.center[1])) * METERS_PER_DEGREE
+            dy = (lat - self.center[1]) * METERS_PER_DEGREE
+            return dx * dx + dy * dy <= self.radius * self.radius
+        inside = _ring_contains(self.rings[0], lon, lat)
+        for hole in self.rings[1:]:
+            inside &= ~_ring_contains(hole, lon, lat)
+        return inside
+
+
+# Even-odd ray casting, looping over the edges of the ring and vectorized over the points.
+def _ring_contains(ring: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    inside = np.zeros(x.shape, dtype=bool)
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        crosses = (y1 > y) != (y2 > y)
+        if crosses.any():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_intersection = (x2 - x1) * (y - y1) / (y2 - y1) + x1
+            inside ^= crosses & (x < x_intersection)
+        x1, y1 = x2, y2
+    return inside
+
+
+#
+# Evaluates fences locally, without a round-trip to the DeepHub.
+#
+# The fence set is loaded once into a uniform grid of cell_size degrees, so that every position is only tested
+# against the fences overlapping its grid cell. Positions are evaluated in batches, vectorized per fence, and
+# every change of whether an entity is inside a fence is returned as a fence event like those of the
+# fence_events topic, with event_type region_entry or region_exit.
+#
+# Only fences and positions in WGS84 coordinates are supported.
+#
+class FenceEngine(object):
+    def __init__(self, fences, cell_size: float = 0.0002, entity_type: str = 'provider'):
+        self.cell_size = cell_size
+        self.entity_type = entity_type
+        self.fences = [fence if isinstance(fence, LocalFence) else LocalFence(fence) for fence in fences]
+        self.grid = defaultdict(list)
+        for index, fence in enumerate(self.fences):
+            min_x, min_y, max_x, max_y = (math.floor(value / cell_size) for value in fence.bounds)
+            for cell_x in range(min_x, max_x + 1):
+                for cell_y in range(min_y, max_y + 1):
+                    self.grid[cell_x, cell_y].append(index)
+        # The fences each entity is currently inside of, by entity id.
+        self.inside = {}
+
+    #
+    # Load all fences of the DeepHub at the given url, with the given requests.Session if any.
+    #
+    @classmethod
+    def load(cls, url: str, session=None, **kwargs):
+        if session is None:
+            import requests as session
+        return cls(session.get(url + '/fences/summary').json(), **kwargs)
+
+    #
+    # Evaluate a batch of positions, an (n, 2) array of longitudes and latitudes, of the entities with the given ids.
+    # The ids must be unique within a batch. Returns the fence events for all entries and exits since the previous
+    # evaluation of the respective entity.
+    #
+    def evaluate(self, ids: list, positions, timestamp: str = None) -> list:
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        if timestamp is None:
+            timestamp = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+        # Collect, per fence, the positions in the grid cells that the fence overlaps.
+        cells = np.floor(positions / self.cell_size).astype(np.int64)
+        unique_cells, inverse = np.unique(cells, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind='stable')
+        splits = np.cumsum(np.bincount(inverse, minlength=len(unique_cells)))[:-1]
+        candidates = defaultdict(list)
+        for cell, members in zip(map(tuple, unique_cells.tolist()), np.split(order, splits)):
+            for fence_index in self.grid.get(cell, ()):
+                candidates[fence_index].append(members)
+
+        # Evaluate each fence once for all of its candidate positions.
+        now_inside = defaultdict(set)
+        for fence_index, members in candidates.items():
+            members = np.concatenate(members)
+            inside = self.fences[fence_index].contains(positions[members, 0], positions[members, 1])
+            for member in members[inside].tolist():
+                now_inside[ids[member]].add(fence_index)
+
+        events = []
+        for entity_id in dict.fromkeys(ids):
+            previous = self.inside.get(entity_id, set())
+            current = now_inside.get(entity_id, set())
+            for fence_index in current - previous:
+                events.append(self._event(entity_id, fence_index, 'region_entry', timestamp))
+            for fence_index in previous - current:
+                events.append(self._event(entity_id, fence_index, 'region_exit', timestamp))
+            if current:
+                self.inside[entity_id] = current
+            else:
+                self.inside.pop(entity_id, None)
+        return events
+
+    #
+    # Evaluate a batch of locations, given as dh.Location objects or as decoded location_updates payloads.
+    # If an entity has several locations in the batch, only its last one is evaluated.
+    #
+    def evaluate_locations(self, locations: list, timestamp: str = None) -> list:
+        latest = {}
+        for location in locations:
+            if isinstance(location, dict):
+                latest[location['provider_id']] = location['position']['coordinates'][:2]
+            else:
+                latest[location.provider_id] = location.position.coordinates[:2]
+        return self.evaluate(list(latest), list(latest.values()), timestamp)
+
+    def _event(self, entity_id: str, fence_index: int, event_type: str, timestamp: str) -> dict:
+        fence = self.fences[fence_index]
+        event = {'fence_id': fence.id, 'foreign_id': fence.foreign_id, 'entity_type': self.entity_type,
+                 'event_type': event_type}
+        event[self.entity_type + '_id'] = entity_id
+        event['entry_time' if event_type == 'region_entry' else 'exit_time'] = timestamp
+        return event
@@ -0,0 +1,124 @@
+import copy
+import math
+import threading
+import time
+
+from DeepHubClasses import METERS_PER_DEGREE
+
+
+#
+# A filter in front of a LocationPublisher, dropping location updates that carry no new information.
+#
+# An update of a provider is only forwarded if the provider moved at least distance meters since its last
+# forwarded update, or if max_silence seconds have passed since then, as a heartbeat of stationary providers.
+# Updates arriving less than min_interval seconds after the last forwarded one are coalesced: only the latest of
+# them is kept, and sent with the next update after the interval, or by flush().
+#
+# With a FenceEngine from DeepHubFences.py, every update that enters or exits a fence is forwarded right away,
+# so that dead-banding does not delay or hide fence events.
+#
+# With a PropagationMonitor from DeepHubVerification.py, the filter samples the updates it forwards, so that
+# suppressed and coalesced updates, which never reach the DeepHub, are not counted as lost.
+#
+# The filter has the same interface as the LocationPublisher, so it can be used in its place.
+#
+class DeadbandFilter(object):
+    def __init__(self, publisher, distance: float = 0.5, min_interval: float = 0.0, max_silence: float = 5.0,
+                 fences=None, monitor=None):
+        self.publisher = publisher
+        self.distance = distance
+        self.min_interval = min_interval
+        self.max_silence = max_silence
+        self.fences = fences
+        self.monitor = monitor
+        # Per provider: the coordinates and time of the last forwarded update, and the coalesced update or None.
+        self._providers = {}
+        self._lock = threading.Lock()
+        self.received = 0
+        self.forwarded = 0
+        self.suppressed = 0
+        self.coalesced = 0
+
+    def publish(self, location):
+        now = time.monotonic()
+        coordinates = location.position.coordinates
+        with self._lock:
+            self.received += 1
+            crossed = self.fences is not None and location.crs == 'EPSG:4326' and bool(
+                self.fences.evaluate([location.provider_id], [coordinates[:2]]))
+            state = self._providers.get(location.provider_id)
+            if state is not None:
+                moved = _distance(state[0], coordinates, location.crs == 'EPSG:4326') >= self.distance
+                if not (crossed or moved or now - state[1] >= self.max_silence):
+                    self.suppressed += 1
+                    return
+                if not crossed and now - state[1] < self.min_interval:
+                    if state[2] is not None:
+                        self.coalesced += 1
+                    state[2] = copy.copy(location)
+                    return
+                if state[2] is not None:
+                    self.coalesced += 1
+            self._providers[location.provider_id] = [coordinates, now, None]
+            self.forwarded += 1
+        self.publisher.publish(location)
+        if self.monitor is not None:
+            self.monitor.published(location)
+
+    #
+    # Forward the coalesced updates of all providers, and flush the publisher.
+    #
+    def flush(self):
+        now = time.monotonic()
+        pending = []
+        with self._lock:
+            for state in self._providers.values():
+                if state[2] is not None:
+                    pending.append(state[2])
+                    state[0], state[1], state[2] = state[2].position.coordinates, now, None
+            self.forwarded += len(pending)
+        for location in pending:
+            self.publisher.publish(location)
+            if self.monitor is not None:
+                self.monitor.published(location)
+        self.publisher.flush()
+
+    def close(self):
+        self.flush()
+        self.publisher.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    #
+    # Count the updates received, forwarded, dropped by the dead-bands and superseded by coalescing, and estimate
+    # the bytes and requests saved from the average size of the forwarded updates and the average number of updates
+    # per request of the publisher, as the saved updates would have been sent in batches like the forwarded ones.
+    #
+    def stats(self) -> dict:
+        published = self.publisher.stats()
+        saved = self.suppressed + self.coalesced
+        updates = published['updates']
+        per_request = published['updates_per_request'] or 1.0
+        return {'received': self.received, 'forwarded': self.forwarded, 'suppressed': self.suppressed,
+                'coalesced': self.coalesced, 'saved': saved,
+                'bytes_saved': int(saved * published['bytes'] / updates) if updates else 0,
+                'requests_saved': int(saved / per_request)}
+
+    def print_stats(self):
+        stats = self.stats()
+        print('Dead-band filter: {forwarded} of {received} updates forwarded, {suppressed} suppressed, '
+              '{coalesced} coalesced, about {requests_saved} requests and {bytes_saved} bytes saved'.format(**stats))
+        self.publisher.print_stats()
+
+
+# The distance in meters between two positions, either in WGS84 or in zone-local meters.
+def _distance(a, b, wgs84: bool) -> float:
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    if wgs84:
+        dx *= math.cos(math.radians(a[1])) * METERS_PER_DEGREE
+        dy *= METERS_PER_DEGREE
+    return math.sqrt(dx * dx + dy * dy)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+
+import DeepHubClasses as dh
+from DeepHubClasses import ACCURACY, METERS_PER_DEGREE
+from DeepHubFences import LocalFence
+from DeepHubTrajectory import TrajectoryWriter, chunk_file
+
+# The coordinate files followed by lane-following vehicles by default, all in WGS84.
+DEFAULT_LANES = ('truckGpsCoordinates.txt', 'forkliftGpsCoordinates.txt')
+
+
+#
+# A group of vehicles moving the same way. Positions are in meters east and north of the origin of the fleet.
+#
+class _Group(object):
+    def __init__(self, ids: list, provider_type: str, rng: np.random.Generator):
+        self.ids = ids
+        self.provider_type = provider_type
+        self.rng = rng
+        self.accuracy = ACCURACY.get(provider_type, 0.0)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def noisy(self, positions: np.ndarray) -> np.ndarray:
+        if not self.accuracy:
+            return positions
+        return positions + self.rng.normal(0.0, self.accuracy, positions.shape)
+
+
+class _Circles(_Group):
+    def __init__(self, ids, provider_type, rng, radius, speed, spread):
+        super().__init__(ids, provider_type, rng)
+        count = len(ids)
+        self.centers = rng.uniform(-spread, spread, (count, 2))
+        self.radius = rng.uniform(*radius, count)
+        # Clockwise, like calculate_coordinates, with an angular speed from the speed along the circle.
+        self.omega = -rng.uniform(*speed, count) / self.radius
+        self.phase = rng.uniform(0, 2 * math.pi, count)
+
+    def step(self, t: float, dt: float) -> np.ndarray:
+        angle = self.phase + self.omega * t
+        return self.centers + self.radius[:, np.newaxis] * np.stack([np.cos(angle), np.sin(angle)], axis=1)
+
+
+class _RandomWalks(_Group):
+    def __init__(self, ids, provider_type, rng, fence, to_meters, to_wgs84, speed, turn):
+        super().__init__(ids, provider_type, rng)
+        count = len(ids)
+        self.fence = fence
+        self.to_wgs84 = to_wgs84
+        self.turn = turn
+        self.speed = rng.uniform(*speed, count)
+        self.heading = rng.uniform(0, 2 * math.pi, count)
+        # Start at uniformly distributed points inside the polygon, by rejection sampling its bounding box.
+        min_x, min_y, max_x, max_y = fence.bounds
+        self.positions = np.empty((count, 2))
+        missing = np.arange(count)
+        while len(missing):
+            candidates = np.column_stack([rng.uniform(min_x, max_x, len(missing)),
+                                          rng.uniform(min_y, max_y, len(missing))])
+            inside = fence.contains(candidates[:, 0], candidates[:, 1])
+            self.positions[missing[inside]] = to_meters(candidates[inside])
+            missing = missing[~inside]
+
+    def step(self, t: float, dt: float) -> np.ndarray:
+        if dt:
+            self.heading += self.rng.normal(0.0, self.turn * math.sqrt(dt), len(self))
+            moved = self.positions + (self.speed * dt)[:, np.newaxis] * np.stack(
+                [np.cos(self.heading), np.sin(self.heading)], axis=1)
+            wgs84 = self.to_wgs84(moved)
+            inside = self.fence.contains(wgs84[:, 0], wgs84[:, 1])
+            # Vehicles that would leave the polygon stay in place and turn around instead.
+            self.positions[inside] = moved[inside]
+            self.heading[~inside] += math.pi
+        return self.positions
+
+
+class _Lanes(_Group):
+    def __init__(self, ids, provider_type, rng, lanes, speed):
+        super().__init__(ids, provider_type, rng)
+        count = len(ids)
+        if not lanes:
+            raise ValueError('No lanes given')
+        self.lanes = []
+        for index, lane in enumerate(lanes):
+            length = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(lane, axis=0), axis=1))])
+            # Vehicles follow a lane back and forth by the remainder of their distance and twice its length.
+            if not length[-1] > 0:
+                raise ValueError('Lane {} has no length'.format(index))
+            self.lanes.append((lane, length))
+        self.lane = np.arange(count) % len(lanes)
+        self.start = rng.uniform(0, 1, count) * np.array([self.lanes[lane][1][-1] for lane in self.lane])
+        self.speed = rng.uniform(*speed, count)
+
+    def step(self, t: float, dt: float) -> np.ndarray:
+        positions = np.empty((len(self), 2))
+        distance = self.start + self.speed * t
+        for index, (lane, length) in enumerate(self.lanes):
+            members = self.lane == index
+            # Follow the lane back and forth.
+            along = np.abs((distance[members] + length[-1]) % (2 * length[-1]) - length[-1])
+            positions[members, 0] = np.interp(along, length, lane[:, 0])
+            positions[members, 1] = np.interp(along, length, lane[:, 1])
+        return positions
+
+
+#
+# A reproducible synthetic fleet of vehicles, for stressing fences and collision detection at realistic density.
+#
+# The fleet is made of groups of vehicles driving circles, random walks inside a polygon, or back and forth along
+# lanes taken from coordinate files. All randomness is drawn from generators seeded with the seed of the fleet and
+# the index of the group, so that the same fleet produces the same trajectories. Every provider has position noise
+# according to the accuracy of its type, gps or uwb.
+#
+# ticks() samples the positions of the whole fleet lazily, one (count, 2) array of WGS84 coordinates per tick, so
+# that memory use only depends on the size of the fleet.
+#
+class Fleet(object):
+    def __init__(self, origin=dh.default_point, seed: int = 0):
+        self.origin = np.asarray(origin, dtype=float)[:2]
+        self.seed = seed
+        # Meters per degree of longitude and latitude at the origin.
+        self.scale = np.array([math.cos(math.radians(self.origin[1])) * METERS_PER_DEGREE, METERS_PER_DEGREE])
+        self.groups = []
+
+    @property
+    def ids(self) -> list:
+        return [provider_id for group in self.groups for provider_id in group.ids]
+
+    @property
+    def provider_types(self) -> list:
+        return [group.provider_type for group in self.groups for _ in group.ids]
+
+    def __len__(self):
+        return sum(len(group) for group in self.groups)
+
+    def to_meters(self, wgs84) -> np.ndarray:
+        return (np.asarray(wgs84, dtype=float)[..., :2] - self.origin) * self.scale
+
+    def to_wgs84(self, meters) -> np.ndarray:
+        return np.asarray(meters) / self.scale + self.origin
+
+    #
+    # Add count vehicles driving circles with a radius and speed, in meters and meters per second, drawn from the
+    # given ranges, around centers within spread meters of the origin.
+    #
+    def add_circles(self, count: int, radius=(5.0, 50.0), speed=(0.5, 3.0), spread: float = 200.0,
+                    provider_type: str = 'gps', prefix: str = 'FLEET_CIRCLE_'):
+        return self._add(_Circles, count, provider_type, prefix, radius, speed, spread)
+
+    #
+    # Add count vehicles walking randomly inside a WGS84 polygon, given as its rings like dh.default_polygon.
+    # turn is the standard deviation of the change of the heading per square root of a second, in radians.
+    #
+    def add_random_walks(self, count: int, polygon=dh.default_polygon, speed=(0.5, 2.0), turn: float = 0.5,
+                         provider_type: str = 'uwb', prefix: str = 'FLEET_WALK_'):
+        fence = LocalFence({'id': prefix, 'region': {'type': 'Polygon', 'coordinates': polygon}})
+        return self._add(_RandomWalks, count, provider_type, prefix, fence, self.to_meters, self.to_wgs84,
+                         speed, turn)
+
+    #
+    # Add count vehicles driving back and forth along the lanes given by WGS84 coordinate files, at speeds in
+    # meters per second drawn from the given range, starting at random points of their lanes.
+    #
+    def add_lanes(self, count: int, files=DEFAULT_LANES, speed=(1.0, 5.0), provider_type: str = 'gps',
+                  prefix: str = 'FLEET_LANE_'):
+        lanes = [self.to_meters(np.loadtxt(file, delimiter=',', ndmin=2)) for file in files]
+        return self._add(_Lanes, count, provider_type, prefix, lanes, speed)
+
+    def _add(self, group_class, count: int, provider_type: str, prefix: str, *args):
+        rng = np.random.default_rng([self.seed, len(self.groups)])
+        ids = [prefix + str(i) for i in range(count)]
+        self.groups.append(group_class(ids, provider_type, rng, *args))
+        return self
+
+    #
+    # Yield (seconds, positions) every interval seconds, for the given duration or forever, where positions is a
+    # (count, 2) array of the WGS84 coordinates of all vehicles, in the order of ids.
+    #
+    def ticks(self, interval: float, duration: float = None):
+        tick, previous = 0, 0.0
+        while True:
+            t = tick * interval
+            if duration is not None and t > duration:
+                return
+            meters = np.concatenate([group.noisy(group.step(t, t - previous)) for group in self.groups]) \
+                if self.groups else np.empty((0, 2))
+            yield t, self.to_wgs84(meters)
+            previous = t
+            tick += 1
+
+    #
+    # Yield the dh.Location of every vehicle for every tick. The same objects are updated and yielded again on
+    # every tick, so they must be published, e.g. with a LocationPublisher, before the next one is taken.
+    #
+    def locations(self, interval: float, duration: float = None):
+        locations = []
+        for provider_id, provider_type in zip(self.ids, self.provider_types):
+            location = dh.Location(provider_id=provider_id, provider_type=provider_type)
+            location.crs = 'EPSG:4326'
+            locations.append(location)
+        for t, positions in self.ticks(interval, duration):
+            for location, coordinates in zip(locations, positions.tolist()):
+                location.position = dh.Point(coordinates=coordinates)
+            yield t, locations
+
+
+#
+# Write the trajectories of the fleet into a directory of timestamped trajectory files, which replay like the
+# recordings of DeepHubRecorder.py.
+#
+# The ticks are buffered up to buffer_points points, and then appended to the file of each vehicle in turn, so that
+# only one file is open at a time, however large the fleet, and memory use does not depend on the duration.
+#
+def record(fleet: Fleet, directory: str, interval: float, duration: float, start: float = 0.0,
+           buffer_points: int = 1000000) -> int:
+    os.makedirs(directory, exist_ok=True)
+    files = [(chunk_file(directory, provider_id, 0), provider_type)
+             for provider_id, provider_type in zip(fleet.ids, fleet.provider_types)]
+    buffer_ticks = max(1, buffer_points // max(len(files), 1))
+    count = 0
+    times, buffered = [], []
+    for t, positions in fleet.ticks(interval, duration):
+        times.append(start + t)
+        buffered.append(positions)
+        if len(times) >= buffer_ticks:
+            count += _append(files, times, buffered)
+            times, buffered = [], []
+    if times:
+        count += _append(files, times, buffered)
+    return count
+
+
+# Append the buffered ticks to the trajectory files of the vehicles, one file at a time.
+def _append(files: list, times: list, buffered: list) -> int:
+    trajectories = np.stack(buffered, axis=1).tolist()
+    for (file, provider_type), trajectory in zip(files, trajectories):
+        writer = TrajectoryWriter(file, provider_type, 'EPSG:4326')
+        try:
+            for timestamp, coordinates in zip(times, trajectory):
+                writer.append(timestamp, coordinates)
+        finally:
+            writer.close()
+    return len(files) * len(times)
+
+
+#
+# Publish the locations of the fleet to the DeepHub at the given url in real time, and return the publisher.
+#
+def publish(fleet: Fleet, url: str, interval: float, duration: float = None):
+    from DeepHubPublisher import LocationPublisher
+    from DeepHubReplay import ReplayScheduler
+    scheduler = ReplayScheduler(rate=1.0 / interval)
+    with LocationPublisher(url, max_batch_size=1000) as publisher:
+        for locations in scheduler.pace('fleet', fleet.locations(interval, duration)):
+            for location in locations:
+                publisher.publish(location)
+    return publisher
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a reproducible synthetic fleet, and publish it to a '
+                                                 'DeepHub or record it into trajectory files.')
+    parser.add_argument('--circles', type=int, default=100, help='vehicles driving circles (default: 100)')
+    parser.add_argument('--walks', type=int, default=100,
+                        help='vehicles walking randomly inside the example fence (default: 100)')
+    parser.add_argument('--lanes', type=int, default=100,
+                        help='vehicles following the example coordinate files (default: 100)')
+    parser.add_argument('--seed', type=int, default=0, help='the seed of the fleet (default: 0)')
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between two updates (default: 0.5)')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to generate (default: 60)')
+    parser.add_argument('--url', help='publish the fleet to the DeepHub at this url, in real time')
+    parser.add_argument('--record', metavar='DIRECTORY', help='record the fleet into this directory')
+    args = parser.parse_args()
+
+    fleet = Fleet(seed=args.seed).add_circles(args.circles).add_random_walks(args.walks).add_lanes(args.lanes)
+    if args.record:
+        print('Recorded', record(fleet, args.record, args.interval, args.duration, time.time()), 'locations.')
+    if args.url:
+        publish(fleet, args.url, args.interval, args.duration).print_stats()
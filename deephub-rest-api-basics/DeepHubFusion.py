@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import math
+import threading
+import time
+
+import DeepHubClasses as dh
+from DeepHubClasses import ACCURACY, METERS_PER_DEGREE
+from DeepHubRecorder import location_time
+
+
+#
+# The state of one track: a constant-velocity Kalman filter per axis, in meters east and north of the first
+# position of the track. Both axes share the same model and are independent, so each one only keeps its position,
+# velocity and the three distinct entries of its 2x2 covariance.
+#
+class _Track(object):
+    __slots__ = ('trackable_id', 'origin', 'scale', 'time', 'x', 'y', 'updates', 'last_output')
+
+    def __init__(self, trackable_id: str, origin: tuple, timestamp: float, variance: float):
+        self.trackable_id = trackable_id
+        self.origin = origin
+        self.scale = math.cos(math.radians(origin[1])) * METERS_PER_DEGREE
+        self.time = timestamp
+        # Per axis: position, velocity, and the covariance entries pp, pv, vv. The velocity starts unknown.
+        self.x = [0.0, 0.0, variance, 0.0, 100.0]
+        self.y = [0.0, 0.0, variance, 0.0, 100.0]
+        self.updates = 1
+        self.last_output = None
+
+    def to_meters(self, coordinates) -> tuple:
+        return ((coordinates[0] - self.origin[0]) * self.scale,
+                (coordinates[1] - self.origin[1]) * METERS_PER_DEGREE)
+
+    def to_wgs84(self) -> list:
+        return [self.origin[0] + self.x[0] / self.scale, self.origin[1] + self.y[0] / METERS_PER_DEGREE]
+
+    def update(self, timestamp: float, meters: tuple, variance: float, acceleration_variance: float):
+        # Measurements arriving out of order, e.g. from providers publishing from parallel threads, are applied at
+        # the time of the track instead of moving it back.
+        dt = max(0.0, timestamp - self.time)
+        self.time = max(self.time, timestamp)
+        for axis, measurement in ((self.x, meters[0]), (self.y, meters[1])):
+            position, velocity, pp, pv, vv = axis
+            if dt:
+                # Predict with white noise acceleration.
+                position += velocity * dt
+                pp += dt * (2 * pv + dt * vv) + acceleration_variance * dt ** 4 / 4
+                pv += dt * vv + acceleration_variance * dt ** 3 / 2
+                vv += acceleration_variance * dt * dt
+            innovation = measurement - position
+            gain_p, gain_v = pp / (pp + variance), pv / (pp + variance)
+            axis[:] = (position + gain_p * innovation, velocity + gain_v * innovation,
+                       (1 - gain_p) * pp, (1 - gain_p) * pv, vv - gain_v * pv)
+        self.updates += 1
+
+
+#
+# Fuses the location_updates of the providers of each trackable into one smooth track per trackable.
+#
+# Every location of a provider updates the track of its trackable with a constant-velocity Kalman filter, weighted
+# by the accuracy of the location, or the default accuracy of its provider type, so that the accurate UWB and the
+# noisy GPS provider of the forklift are merged instead of being sent as two jittery streams. The tracks take
+# constant memory each, however long they run. At most output_rate locations per second are emitted per trackable,
+# as dh.Location objects of a virtual provider named output_prefix plus the trackable id, carrying the filtered
+# position, speed, course and accuracy.
+#
+# The providers of the trackables are given as tracks, a dict of provider ids by trackable id, or are looked up in
+# the location_providers of the trackables of an EntityRegistry. Zone-local locations are converted to WGS84 with
+# a TransformCache from DeepHubTransform.py; without one, they are dropped.
+#
+class TrackFusion(object):
+    def __init__(self, tracks: dict = None, output_rate: float = 2.0, acceleration: float = 1.0, registry=None,
+                 transforms=None, accuracy: dict = None, output_prefix: str = 'FUSED_', callback=None):
+        self.output_interval = 1.0 / output_rate
+        # The variance of the white noise acceleration of the model, from its standard deviation in m/s^2.
+        self.acceleration_variance = acceleration * acceleration
+        self.registry = registry
+        self.transforms = transforms
+        # The accuracy of locations without an accuracy of their own, in meters, by provider type.
+        self.accuracy = dict(ACCURACY, **(accuracy or {}))
+        self.output_prefix = output_prefix
+        # Called with the fused locations of every batch of a StreamConsumer that has any.
+        self.callback = callback
+        self._tracks = {}
+        self._fixed = {provider_id: trackable_id for trackable_id, provider_ids in (tracks or {}).items()
+                       for provider_id in provider_ids}
+        # The trackables of the providers, as found in the registry, or None for providers of no trackable.
+        self._found = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.received = 0
+        self.fused = 0
+        self.emitted = 0
+        self.unassigned = 0
+        self.unprojected = 0
+
+    #
+    # Update the track of the trackable of the provider of a location, given as a decoded location_updates payload.
+    # Returns the fused location of the trackable if one is due, or None.
+    #
+    def update(self, location: dict):
+        self.received += 1
+        if location.get('position') is None:
+            return None
+        trackable_id = self.trackable(location.get('provider_id'))
+        if trackable_id is None:
+            self.unassigned += 1
+            return None
+        coordinates = self._wgs84(location)
+        if coordinates is None:
+            self.unprojected += 1
+            return None
+        timestamp = location_time(location)
+        if timestamp is None:
+            timestamp = time.time()
+        accuracy = location.get('accuracy') or self.accuracy.get(location.get('provider_type'), 1.0)
+        with self._lock:
+            self.fused += 1
+            track = self._tracks.get(trackable_id)
+            if track is None:
+                track = self._tracks[trackable_id] = _Track(trackable_id, coordinates[:2], timestamp,
+                                                            accuracy * accuracy)
+            else:
+                track.update(timestamp, track.to_meters(coordinates), accuracy * accuracy,
+                             self.acceleration_variance)
+            if track.last_output is not None and track.time - track.last_output < self.output_interval:
+                return None
+            track.last_output = track.time
+            self.emitted += 1
+            return self._location(track)
+
+    #
+    # The id of the trackable located by the provider, or None.
+    #
+    def trackable(self, provider_id: str):
+        trackable_id = self._fixed.get(provider_id)
+        if trackable_id is not None or self.registry is None:
+            return trackable_id
+        if provider_id not in self._found:
+            self._found[provider_id] = next(
+                (trackable_id for trackable_id in self.registry.ids('trackables')
+                 if provider_id in (self.registry.get('trackables', trackable_id) or {}).get('location_providers', ())),
+                None)
+        return self._found[provider_id]
+
+    #
+    # Handle a batch of (topic, payload) events of a StreamConsumer, and pass the fused locations to the callback.
+    #
+    def handle(self, batch: list):
+        fused = []
+        for topic, payload in batch:
+            if topic == 'location_updates':
+                location = self.update(payload)
+                if location is not None:
+                    fused.append(location)
+            elif topic == 'metadata_changes' and payload.get('type') == 'trackable':
+                # The providers of the trackables may have changed.
+                self._found.clear()
+                if payload.get('operation') == 'delete':
+                    with self._lock:
+                        self._tracks.pop(payload.get('id'), None)
+        if fused and self.callback is not None:
+            self.callback(fused)
+
+    def stats(self) -> dict:
+        return {'received': self.received, 'fused': self.fused, 'emitted': self.emitted,
+                'unassigned': self.unassigned, 'unprojected': self.unprojected, 'tracks': len(self._tracks)}
+
+    def print_stats(self):
+        print('Track fusion: {fused} of {received} locations fused into {tracks} tracks, {emitted} emitted, '
+              '{unassigned} of no trackable, {unprojected} not projected'.format(**self.stats()))
+
+    def _wgs84(self, location: dict):
+        coordinates = location['position']['coordinates']
+        crs = location.get('crs')
+        if crs == 'EPSG:4326':
+            return coordinates
+        if self.transforms is None:
+            return None
+        zone_id = crs if crs not in (None, 'local') else location.get('source')
+        if zone_id is None:
+            return None
+        # Locations of unknown zones, or of zones without enough ground control points, are not projected.
+        try:
+            return self.transforms.to_wgs84(zone_id, coordinates).tolist()
+        except (KeyError, ValueError):
+            return None
+
+    def _location(self, track: _Track):
+        location = dh.Location(provider_id=self.output_prefix + track.trackable_id, provider_type='virtual')
+        location.crs = 'EPSG:4326'
+        location.position = dh.Point(coordinates=track.to_wgs84())
+        velocity_x, velocity_y = track.x[1], track.y[1]
+        location.speed = math.hypot(velocity_x, velocity_y)
+        location.course = math.degrees(math.atan2(velocity_x, velocity_y)) % 360
+        location.accuracy = math.sqrt(max(track.x[2], track.y[2]))
+        location.timestamp_generated = datetime.datetime.utcfromtimestamp(track.time).strftime(
+            '%Y-%m-%dT%H:%M:%S.%fZ')
+        return location
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fuse the location updates of the providers of each trackable '
+                                                 'into one track, and print or publish it.')
+    parser.add_argument('--url', default='http://localhost:8081/deephub/v1',
+                        help='the url of the DeepHub (default: http://localhost:8081/deephub/v1)')
+    parser.add_argument('--track', nargs='+', action='append', default=[], metavar=('TRACKABLE_ID', 'PROVIDER_ID'),
+                        help='fuse these providers into a track, instead of those of the trackables of the DeepHub')
+    parser.add_argument('--rate', type=float, default=2, help='fused locations per second and track (default: 2)')
+    parser.add_argument('--publish', action='store_true',
+                        help='publish the fused locations to the DeepHub instead of printing them')
+    args = parser.parse_args()
+
+    from DeepHubRegistry import EntityRegistry
+    from DeepHubStream import StreamConsumer
+    from DeepHubTransform import TransformCache
+    registry = EntityRegistry(args.url).load()
+    fusion = TrackFusion({track[0]: track[1:] for track in args.track}, args.rate, registry=registry,
+                         transforms=TransformCache(registry))
+    publisher = None
+    if args.publish:
+        from DeepHubPublisher import LocationPublisher
+        publisher = LocationPublisher(args.url, pool_size=1)
+        published = set()
+
+        def publish(locations):
+            for location in locations:
+                # The virtual provider of each track is created in the DeepHub before its first location.
+                if location.provider_id not in published:
+                    provider = dh.LocationProvider(id=location.provider_id)
+                    provider.name = 'Fused ' + location.provider_id[len(fusion.output_prefix):]
+                    provider.type = 'virtual'
+                    registry.ensure('providers', provider)
+                    published.add(location.provider_id)
+                publisher.publish(location)
+
+        fusion.callback = publish
+    else:
+        fusion.callback = lambda locations: [print(location.to_json()) for location in locations]
+    consumer = StreamConsumer(args.url.replace('http', 'ws', 1) + '/ws/socket',
+                              topics=['location_updates', 'metadata_changes'])
+    consumer.add_sink(registry)
+    consumer.add_sink(fusion)
+    try:
+        consumer.run_forever()
+    except KeyboardInterrupt:
+        pass
+    if publisher is not None:
+        publisher.close()
+    fusion.print_stats()
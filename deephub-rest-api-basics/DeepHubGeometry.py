@@ -0,0 +1,53 @@
+import math
+
+import numpy as np
+
+# WGS84 ellipsoid constants, computed once for all conversions.
+WGS84_A = 6378137.0  # semi-major axis in meters
+WGS84_F = 1.0 / 298.257223563  # flattening
+WGS84_B = WGS84_A - WGS84_F * WGS84_A  # semi-minor axis in meters
+WGS84_E2 = (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_A ** 2  # eccentricity squared
+
+
+#
+# Array version of convert_location_in_wgs in deephub-rest-api-basics.py.
+#
+# Offsets the WGS84 origin (lo, la) by (xm, ym) meters in ECEF coordinates and returns the resulting longitudes
+# and latitudes in degrees as an array of shape (..., 2). All arguments are broadcast against each other, so a
+# whole trajectory, or many trajectories with one origin each, can be converted in one call.
+#
+def convert_locations_in_wgs(lo, la, xm, ym) -> np.ndarray:
+    lo_rad = np.radians(lo)
+    la_rad = np.radians(la)
+    sin_la = np.sin(la_rad)
+
+    # Convert the origins to ECEF coordinates (x, y, z), assuming a height of zero.
+    n = WGS84_A / np.sqrt(1 - WGS84_E2 * sin_la ** 2)  # prime vertical radius of curvature
+    x = n * np.cos(la_rad) * np.cos(lo_rad)
+    y = n * np.cos(la_rad) * np.sin(lo_rad)
+    z = n * (1 - WGS84_E2) * sin_la
+
+    # Apply the offsets and convert back to geodetic coordinates.
+    xe = x + xm
+    ye = y + ym
+    p = np.sqrt(xe ** 2 + ye ** 2)  # distance from z-axis
+    theta = np.arctan2(z * WGS84_A, p * WGS84_B)  # auxiliary angle
+    lt_rad = np.arctan2(z + WGS84_E2 * WGS84_B * np.sin(theta) ** 3,
+                        p - WGS84_E2 * WGS84_A * np.cos(theta) ** 3)
+    ln_rad = np.arctan2(ye, xe)
+
+    return np.stack(np.broadcast_arrays(np.degrees(ln_rad), np.degrees(lt_rad)), axis=-1)
+
+
+#
+# Array version of calculate_coordinates in deephub-rest-api-basics.py.
+#
+# Returns the x and y offsets of the steps i of a clockwise circle with radius r divided into n steps.
+# If i is omitted, all n steps are returned. Passing r as a column, e.g. np.array([[5], [10]]), yields one
+# circle per row.
+#
+def calculate_coordinates_array(r, n: int, i=None):
+    if i is None:
+        i = np.arange(n)
+    angle = 2 * math.pi - np.asarray(i) * (2 * math.pi / n)
+    return r * np.cos(angle), r * np.sin(angle)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+import argparse
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+import DeepHubClasses as dh
+from DeepHubPublisher import LocationPublisher
+from DeepHubReplay import ReplayScheduler
+
+# The coordinate files replayed by default, all in WGS84.
+DEFAULT_FILES = ('truckGpsCoordinates.txt', 'forkliftGpsCoordinates.txt')
+
+
+#
+# A worker process, sending the location updates of its shard of the providers.
+#
+# Each worker has its own connection pool and replay scheduler. All providers of a worker send one update per
+# tick, at the rate set by the coordinator, each replaying one of the coordinate files from its own offset.
+# The worker reports its counters and the request latencies since its last report every report_interval seconds.
+#
+def _run_worker(index: int, provider_ids: list, files: list, url: str, rate: float, max_batch_size: int,
+                report_interval: float, control, reports):
+    traces = [np.loadtxt(file, delimiter=',', ndmin=2).tolist() for file in files]
+    providers = []
+    for number, provider_id in enumerate(provider_ids):
+        location = dh.Location(provider_id=provider_id, provider_type='gps')
+        location.crs = 'EPSG:4326'
+        points = traces[number % len(traces)]
+        providers.append((location, points, number * 7 % len(points)))
+
+    publisher = LocationPublisher(url, pool_size=4, max_batch_size=max_batch_size)
+    scheduler = ReplayScheduler(rate=rate)
+    name = 'worker-' + str(index)
+    reported_requests, last_report = 0, time.monotonic()
+
+    def report():
+        nonlocal reported_requests, last_report
+        stats = publisher.stats()
+        new_requests = stats['requests'] - reported_requests
+        latencies = list(publisher.latencies)[-new_requests:] if new_requests > 0 else []
+        reported_requests += max(new_requests, 0)
+        last_report = time.monotonic()
+        reports.put({'worker': index, 'updates': stats['updates'], 'requests': stats['requests'],
+                     'failed': stats['failed'], 'latencies': latencies, 'lag': scheduler.stats()[name]['lag']})
+
+    for tick in scheduler.pace(name, ((None, tick) for tick in itertools.count())):
+        try:
+            command, value = control.get_nowait()
+        except queue.Empty:
+            command = None
+        if command == 'stop':
+            break
+        if command == 'rate':
+            scheduler.rate = value
+        for location, points, offset in providers:
+            location.position = dh.Point(coordinates=points[(tick + offset) % len(points)])
+            publisher.publish(location)
+        if time.monotonic() - last_report >= report_interval:
+            report()
+    publisher.close()
+    report()
+
+
+#
+# Generates load from many providers, sharded across a pool of worker processes.
+#
+# Every worker process encodes and sends the updates of its shard of the providers, so that JSON encoding and
+# request handling are spread over all cores instead of sharing one interpreter. The coordinator changes the rate
+# of all workers at runtime, and aggregates their reports into the offered and achieved rates, the request latency
+# and the schedule lag of every report interval.
+#
+class LoadCoordinator(object):
+    def __init__(self, url: str, providers: int, workers: int = None, rate: float = 20.0, files=DEFAULT_FILES,
+                 max_batch_size: int = 500, report_interval: float = 1.0, prefix: str = 'LOAD_PROVIDER_'):
+        self.url = url
+        self.providers = providers
+        self.workers = min(workers or os.cpu_count() or 1, providers)
+        self.rate = rate
+        self.files = list(files)
+        self.max_batch_size = max_batch_size
+        self.report_interval = report_interval
+        self.prefix = prefix
+        self.intervals = []
+        self._processes = []
+        self._controls = []
+        self._reports = multiprocessing.Queue()
+        self._latest = {}
+        self._collector = None
+        self._running = threading.Event()
+
+    def start(self):
+        provider_ids = [self.prefix + str(i) for i in range(self.providers)]
+        self._running.set()
+        self.started = time.monotonic()
+        for index in range(self.workers):
+            control = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_run_worker, daemon=True,
+                args=(index, provider_ids[index::self.workers], self.files, self.url, self.rate,
+                      self.max_batch_size, self.report_interval, control, self._reports))
+            process.start()
+            self._controls.append(control)
+            self._processes.append(process)
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        return self
+
+    #
+    # Change the rate of every provider, in updates per second.
+    #
+    def set_rate(self, rate: float):
+        if rate <= 0:
+            raise ValueError('The rate must be positive')
+        self.rate = rate
+        for control in self._controls:
+            control.put(('rate', rate))
+
+    def stop(self):
+        for control in self._controls:
+            control.put(('stop', None))
+        for process in self._processes:
+            process.join()
+        self._running.clear()
+        self._collector.join()
+        self._drain()
+
+    #
+    # Run for the given number of seconds, changing the rate as given by the ramp, a list of (seconds, rate) steps.
+    #
+    def run(self, duration: float, ramp=()):
+        self.start()
+        try:
+            for at, rate in sorted(ramp):
+                if at >= duration:
+                    break
+                time.sleep(max(0.0, self.started + at - time.monotonic()))
+                print('Rate: {:g} updates/s per provider'.format(rate))
+                self.set_rate(rate)
+            time.sleep(max(0.0, self.started + duration - time.monotonic()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def totals(self) -> dict:
+        reports = list(self._latest.values())
+        elapsed = time.monotonic() - self.started
+        updates = sum(report['updates'] for report in reports)
+        return {'updates': updates, 'requests': sum(report['requests'] for report in reports),
+                'failed': sum(report['failed'] for report in reports), 'elapsed': elapsed,
+                'updates_per_second': updates / elapsed if elapsed > 0 else 0.0}
+
+    def print_totals(self):
+        totals = self.totals()
+        print('Total: {updates} updates in {elapsed:.1f} s, {updates_per_second:.1f} updates/s, '
+              '{requests} requests ({failed} failed)'.format(**totals))
+
+    def _collect(self):
+        previous = self.totals()
+        next_print = time.monotonic() + self.report_interval
+        latencies, lags = [], {}
+        while self._running.is_set():
+            try:
+                report = self._reports.get(timeout=0.1)
+            except queue.Empty:
+                report = None
+            if report is not None:
+                self._latest[report['worker']] = report
+                latencies.extend(report['latencies'])
+                lags[report['worker']] = report['lag']
+            if time.monotonic() < next_print:
+                continue
+            totals = self.totals()
+            interval = self._interval(previous, totals, latencies, lags)
+            self.intervals.append(interval)
+            print('{elapsed:6.1f} s: offered {offered:8.0f} updates/s, sent {sent:8.0f} updates/s, '
+                  '{requests:6.0f} requests/s, latency p50 {p50:6.1f} ms, p99 {p99:6.1f} ms, '
+                  'schedule lag {lag:6.1f} ms, {failed} failed'.format(**interval))
+            previous, latencies = totals, []
+            next_print += self.report_interval
+
+    def _interval(self, previous: dict, totals: dict, latencies: list, lags: dict) -> dict:
+        elapsed = totals['elapsed'] - previous['elapsed']
+        latencies = sorted(latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+        return {'elapsed': totals['elapsed'], 'offered': self.providers * self.rate,
+                'sent': (totals['updates'] - previous['updates']) / elapsed,
+                'requests': (totals['requests'] - previous['requests']) / elapsed,
+                'failed': totals['failed'] - previous['failed'],
+                'p50': percentile(0.5), 'p99': percentile(0.99), 'lag': max(lags.values(), default=0.0) * 1000}
+
+    # Take the final reports of the stopped workers.
+    def _drain(self):
+        while True:
+            try:
+                report = self._reports.get(timeout=0.5)
+            except queue.Empty:
+                return
+            self._latest[report['worker']] = report
+
+
+def parse_ramp(steps: list) -> list:
+    ramp = []
+    for step in steps:
+        rate, _, at = step.partition('@')
+        ramp.append((float(at), float(rate)))
+    return ramp
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate location updates of many providers from several '
+                                                 'processes.')
+    parser.add_argument('--url', default='http://localhost:8081/deephub/v1',
+                        help='the url of the DeepHub (default: http://localhost:8081/deephub/v1)')
+    parser.add_argument('--providers', type=int, default=1000, help='number of providers (default: 1000)')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: number of cores)')
+    parser.add_argument('--rate', type=float, default=1, help='updates per second per provider (default: 1)')
+    parser.add_argument('--ramp', nargs='*', default=[], metavar='RATE@SECONDS',
+                        help='change the rate after the given seconds, e.g. 2@10 5@20')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run (default: 30)')
+    parser.add_argument('--files', nargs='+', default=DEFAULT_FILES,
+                        help='WGS84 coordinate files to replay (default: {})'.format(' '.join(DEFAULT_FILES)))
+    args = parser.parse_args()
+
+    coordinator = LoadCoordinator(args.url, args.providers, args.workers, args.rate, args.files)
+    coordinator.run(args.duration, parse_ramp(args.ramp))
+    coordinator.print_totals()
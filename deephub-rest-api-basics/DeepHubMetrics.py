@@ -0,0 +1,215 @@
+import re
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from requests.adapters import BaseAdapter
+from requests.exceptions import RequestException
+
+# The upper bounds of the buckets of the request latency histograms, in seconds, as used by Prometheus clients.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+# The path segments kept when grouping requests by endpoint. All other segments are ids and replaced by {id}.
+ENDPOINT_SEGMENTS = {'zones', 'fences', 'providers', 'trackables', 'locations', 'location', 'summary', 'health',
+                     'ws', 'socket', 'motions'}
+
+_API_PREFIX = re.compile(r'^.*?/v\d+(?=/|$)')
+
+
+# The endpoint of a request url, e.g. /providers/{id}/location.
+def endpoint(url: str) -> str:
+    path = _API_PREFIX.sub('', urlsplit(url).path)
+    return '/' + '/'.join(segment if segment in ENDPOINT_SEGMENTS else '{id}'
+                          for segment in path.split('/') if segment)
+
+
+class _Endpoint(object):
+    __slots__ = ('buckets', 'sum', 'count', 'statuses', 'request_bytes', 'response_bytes', 'retries')
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.statuses = defaultdict(int)
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.retries = 0
+
+    # The latency below which the given fraction of the requests completed, as the upper bound of its bucket.
+    def percentile(self, p: float) -> float:
+        threshold, total = p * self.count, 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            total += count
+            if total >= threshold and count:
+                return bound
+        return 0.0
+
+
+#
+# Records the latency, status code, retries and payload sizes of every request to the DeepHub, per method and
+# endpoint.
+#
+# Sessions are instrumented with instrument(), which wraps their transport adapters, so that every request sent
+# through them is recorded, including those failing with a connection error, without changing the calling code.
+# The metrics are served in the Prometheus text format by serve(), and printed periodically by start_summary().
+#
+class Metrics(object):
+    def __init__(self):
+        self._endpoints = defaultdict(_Endpoint)
+        self._lock = threading.Lock()
+        self._server = None
+        self._stopped = threading.Event()
+
+    #
+    # Record all requests sent through the given requests.Session. Returns the session.
+    #
+    def instrument(self, session):
+        for prefix, adapter in list(session.adapters.items()):
+            if not isinstance(adapter, InstrumentedAdapter):
+                session.mount(prefix, InstrumentedAdapter(adapter, self))
+        return session
+
+    def record(self, method: str, url: str, status, latency: float, request_bytes: int = 0,
+               response_bytes: int = 0, retries: int = 0):
+        key = (method, endpoint(url))
+        with self._lock:
+            metrics = self._endpoints[key]
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    metrics.buckets[index] += 1
+                    break
+            metrics.sum += latency
+            metrics.count += 1
+            metrics.statuses[str(status)] += 1
+            metrics.request_bytes += request_bytes
+            metrics.response_bytes += response_bytes
+            metrics.retries += retries
+
+    #
+    # Count a retry made by the caller, e.g. of a failed batch of location updates.
+    #
+    def retry(self, method: str, url: str):
+        with self._lock:
+            self._endpoints[method, endpoint(url)].retries += 1
+
+    #
+    # The metrics in the Prometheus text exposition format.
+    #
+    def exposition(self) -> str:
+        lines = ['# HELP deephub_requests_total Requests to the DeepHub by status code, or error.',
+                 '# TYPE deephub_requests_total counter']
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            for (method, path), metrics in endpoints:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append('deephub_requests_total{{method="{}",endpoint="{}",status="{}"}} {}'.format(
+                        method, path, status, count))
+            lines += ['# HELP deephub_request_duration_seconds Latency of the requests to the DeepHub.',
+                      '# TYPE deephub_request_duration_seconds histogram']
+            for (method, path), metrics in endpoints:
+                labels = 'method="{}",endpoint="{}"'.format(method, path)
+                total = 0
+                for bound, count in zip(LATENCY_BUCKETS, metrics.buckets):
+                    total += count
+                    lines.append('deephub_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(
+                        labels, '+Inf' if bound == float('inf') else repr(bound), total))
+                lines.append('deephub_request_duration_seconds_sum{{{}}} {}'.format(labels, metrics.sum))
+                lines.append('deephub_request_duration_seconds_count{{{}}} {}'.format(labels, metrics.count))
+            for name, attribute, description in (
+                    ('deephub_request_bytes_total', 'request_bytes', 'Bytes sent to the DeepHub.'),
+                    ('deephub_response_bytes_total', 'response_bytes', 'Bytes received from the DeepHub.'),
+                    ('deephub_retries_total', 'retries', 'Retried requests to the DeepHub.')):
+                lines += ['# HELP {} {}'.format(name, description), '# TYPE {} counter'.format(name)]
+                for (method, path), metrics in endpoints:
+                    lines.append('{}{{method="{}",endpoint="{}"}} {}'.format(
+                        name, method, path, getattr(metrics, attribute)))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        lines = []
+        with self._lock:
+            for (method, path), metrics in sorted(self._endpoints.items()):
+                # The statuses are kept as strings for the labels, 'error' for requests without a response.
+                errors = sum(count for status, count in metrics.statuses.items()
+                             if not status.isdigit() or int(status) >= 400)
+                lines.append('{:<6} {:<28} {:>7} requests, {:>5} errors, {:>4} retries, p50 <= {:>5.0f} ms, '
+                             'p99 <= {:>5.0f} ms, mean {:6.1f} ms, {:>9} bytes sent'.format(
+                                 method, path, metrics.count, errors, metrics.retries,
+                                 metrics.percentile(0.5) * 1000, metrics.percentile(0.99) * 1000,
+                                 metrics.sum / metrics.count * 1000 if metrics.count else 0.0,
+                                 metrics.request_bytes))
+        return '\n'.join(lines)
+
+    #
+    # Serve the metrics at http://host:port/metrics from a background thread.
+    #
+    def serve(self, port: int = 9108, host: str = '127.0.0.1'):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                data = metrics.exposition().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    #
+    # Print the summary every interval seconds from a background thread.
+    #
+    def start_summary(self, interval: float = 60):
+        def run():
+            while not self._stopped.wait(interval):
+                print(self.summary())
+
+        self._stopped.clear()
+        threading.Thread(target=run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+#
+# A transport adapter recording every request sent through the adapter it wraps.
+#
+class InstrumentedAdapter(BaseAdapter):
+    def __init__(self, adapter, metrics: Metrics):
+        super().__init__()
+        self.adapter = adapter
+        self.metrics = metrics
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        body = request.body
+        request_bytes = len(body) if body else 0
+        try:
+            response = self.adapter.send(request, **kwargs)
+        except RequestException:
+            self.metrics.record(request.method, request.url, 'error', time.perf_counter() - start, request_bytes)
+            raise
+        retries = getattr(response.raw, 'retries', None)
+        self.metrics.record(request.method, request.url, response.status_code, time.perf_counter() - start,
+                            request_bytes, int(response.headers.get('Content-Length') or 0),
+                            len(retries.history) if retries is not None else 0)
+        return response
+
+    def close(self):
+        self.adapter.close()
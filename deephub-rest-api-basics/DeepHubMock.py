@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+import argparse
+import base64
+import datetime
+import hashlib
+import itertools
+import json
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# The path at which the DeepHub API is served, matching url in deephub-rest-api-basics.py.
+API_PATH = '/deephub/v1'
+
+# The entity types reported by metadata_changes, by collection.
+ENTITY_TYPES = {'zones': 'zone', 'fences': 'fence', 'providers': 'location_provider', 'trackables': 'trackable'}
+
+# The GUID used to compute the Sec-WebSocket-Accept header, see RFC 6455.
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+#
+# A minimal in-memory stand-in for the DeepHub, serving the REST and WebSocket APIs used by the examples.
+#
+# It implements /health, /zones, /fences, /providers, /providers/locations, /trackables and /ws/socket,
+# which is enough to run the examples and benchmarks without a real DeepHub or network. Location updates are
+# forwarded to WebSocket clients subscribed to location_updates, and changes of entities to those subscribed to
+# metadata_changes, before the request is answered. It is not meant to validate requests.
+#
+class MockDeepHub(object):
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, delay: float = 0.0):
+        self.delay = delay
+        # While False, every request, or only every WebSocket handshake, is answered with 503 Service Unavailable.
+        self.available = True
+        self.websocket_available = True
+        # The statuses to answer the next requests with, see fail().
+        self.failures = deque()
+        self.lock = threading.Lock()
+        self.collections = {'zones': {}, 'fences': {}, 'providers': {}, 'trackables': {}}
+        self.locations = {}
+        self.subscribers = []
+        self.requests = 0
+        self.location_updates = 0
+        self.server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}{}'.format(host, port, API_PATH)
+
+    @property
+    def ws_url(self) -> str:
+        return self.url.replace('http://', 'ws://', 1) + '/ws/socket'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.drop_connections()
+
+    #
+    # Kill all WebSocket connections without a close handshake, as if the network failed.
+    #
+    def drop_connections(self):
+        with self.lock:
+            subscribers, self.subscribers = self.subscribers, []
+        for subscriber in subscribers:
+            subscriber.close()
+
+    #
+    # Drop all WebSocket connections and refuse requests for the given number of seconds.
+    # With websocket_only=True, only WebSocket handshakes are refused, as if only the subscribers lost the network.
+    #
+    def outage(self, seconds: float, websocket_only: bool = False):
+        flag = 'websocket_available' if websocket_only else 'available'
+        setattr(self, flag, False)
+        self.drop_connections()
+        timer = threading.Timer(seconds, setattr, args=(self, flag, True))
+        timer.daemon = True
+        timer.start()
+
+    #
+    # Answer the next count requests, other than WebSocket handshakes, with the given status, e.g. 429 Too Many
+    # Requests or 500 Internal Server Error, instead of handling them, and the given Retry-After header, if any.
+    #
+    def fail(self, status: int, count: int = 1, retry_after=None):
+        with self.lock:
+            self.failures.extend([(status, retry_after)] * count)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def update_locations(self, locations: list):
+        now = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        with self.lock:
+            for location in locations:
+                location.setdefault('timestamp_generated', now)
+                location.setdefault('timestamp_sent', now)
+                self.locations[location.get('provider_id')] = location
+            self.location_updates += len(locations)
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.publish('location_updates', locations)
+
+    #
+    # Report the creation, update or deletion of an entity to the subscribers of metadata_changes.
+    #
+    def changed(self, collection: str, entity_id: str, operation: str):
+        self.publish('metadata_changes', [{'id': entity_id, 'type': ENTITY_TYPES[collection],
+                                           'operation': operation}])
+
+    def publish(self, topic: str, payload: list):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.publish(topic, payload)
+
+
+#
+# A WebSocket connection of a client. Frames are sent from the threads handling location updates,
+# so sending is serialized with a lock.
+#
+class _Subscriber(object):
+    _subscription_ids = itertools.count(1)
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.lock = threading.Lock()
+        self.topics = {}
+        self.closed = False
+
+    def subscribe(self, topic: str) -> int:
+        self.topics[topic] = next(self._subscription_ids)
+        return self.topics[topic]
+
+    def publish(self, topic: str, payload: list):
+        subscription_id = self.topics.get(topic)
+        if subscription_id is not None:
+            self.send(json.dumps({'event': 'message', 'topic': topic,
+                                  'subscription_id': subscription_id, 'payload': payload}))
+
+    def send(self, text: str, opcode: int = 0x1):
+        data = text.encode()
+        if len(data) < 126:
+            header = struct.pack('!BB', 0x80 | opcode, len(data))
+        elif len(data) < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, len(data))
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, len(data))
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.handler.wfile.write(header + data)
+                self.handler.wfile.flush()
+            except OSError:
+                self.closed = True
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        try:
+            self.handler.connection.shutdown(2)
+        except OSError:
+            pass
+
+    def receive(self):
+        rfile = self.handler.rfile
+        head = rfile.read(2)
+        if len(head) < 2:
+            return None, None
+        opcode, length = head[0] & 0x0F, head[1] & 0x7F
+        if length == 126:
+            length, = struct.unpack('!H', rfile.read(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', rfile.read(8))
+        mask = rfile.read(4) if head[1] & 0x80 else None
+        data = rfile.read(length)
+        if mask:
+            data = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+        return opcode, data
+
+
+def _make_handler(hub: MockDeepHub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _path(self):
+            parts = urlsplit(self.path)
+            path = parts.path
+            if not path.startswith(API_PATH):
+                return None, {}
+            return [p for p in path[len(API_PATH):].split('/') if p], parse_qs(parts.query)
+
+        def _body(self):
+            length = int(self.headers.get('Content-Length', 0))
+            return json.loads(self.rfile.read(length)) if length else None
+
+        def _reply(self, status: int, body=None):
+            if hub.delay:
+                time.sleep(hub.delay)
+            data = b'' if body is None else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _unavailable(self, websocket: bool = False) -> bool:
+            status, retry_after = 503, None
+            if hub.available and (hub.websocket_available or not websocket):
+                with hub.lock:
+                    if websocket or not hub.failures:
+                        return False
+                    status, retry_after = hub.failures.popleft()
+            self.close_connection = True
+            self.send_response(status)
+            if retry_after is not None:
+                self.send_header('Retry-After', str(retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return True
+
+        def do_GET(self):
+            with hub.lock:
+                hub.requests += 1
+            path, query = self._path()
+            websocket = path == ['ws', 'socket'] and self.headers.get('Upgrade', '').lower() == 'websocket'
+            if self._unavailable(websocket):
+                return
+            if websocket:
+                return self._websocket()
+            if path == ['health']:
+                return self._reply(200)
+            status, body = 404, None
+            if path and path[0] in hub.collections:
+                collection = hub.collections[path[0]]
+                with hub.lock:
+                    if len(path) == 1 or path[1:] == ['summary']:
+                        items = collection.values()
+                        for key, values in query.items():
+                            items = [item for item in items if item.get(key) in values]
+                        # The summary lists the entities themselves instead of their ids.
+                        status, body = 200, list(items) if len(path) == 2 else [item['id'] for item in items]
+                    elif path == ['providers', 'locations']:
+                        status, body = 200, list(hub.locations.values())
+                    elif path[0] == 'providers' and path[2:] == ['location']:
+                        body = hub.locations.get(path[1])
+                    elif len(path) == 2:
+                        body = collection.get(path[1])
+                if body is not None:
+                    status = 200
+            self._reply(status, body)
+
+        def do_POST(self):
+            with hub.lock:
+                hub.requests += 1
+            if self._unavailable():
+                return
+            path, _ = self._path()
+            if path and len(path) == 1 and path[0] in hub.collections:
+                item = self._body()
+                if path[0] != 'providers' or not item.get('id'):
+                    item['id'] = str(uuid.uuid4())
+                with hub.lock:
+                    hub.collections[path[0]][item['id']] = item
+                hub.changed(path[0], item['id'], 'create')
+                return self._reply(201, item)
+            self._reply(404)
+
+        def do_PUT(self):
+            with hub.lock:
+                hub.requests += 1
+            if self._unavailable():
+                return
+            path, _ = self._path()
+            body = self._body()
+            if path == ['providers', 'locations']:
+                hub.update_locations(body)
+                return self._reply(200)
+            if path and len(path) == 2 and path[0] in hub.collections:
+                with hub.lock:
+                    hub.collections[path[0]][path[1]] = body
+                hub.changed(path[0], path[1], 'update')
+                return self._reply(200)
+            self._reply(404)
+
+        def do_DELETE(self):
+            with hub.lock:
+                hub.requests += 1
+            if self._unavailable():
+                return
+            path, _ = self._path()
+            if path and len(path) == 2 and path[0] in hub.collections:
+                with hub.lock:
+                    found = hub.collections[path[0]].pop(path[1], None) is not None
+                    if path[0] == 'providers':
+                        hub.locations.pop(path[1], None)
+                if found:
+                    hub.changed(path[0], path[1], 'delete')
+                return self._reply(204 if found else 404)
+            self._reply(404)
+
+        def _websocket(self):
+            key = self.headers['Sec-WebSocket-Key'].encode()
+            accept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest()).decode()
+            self.send_response(101)
+            self.send_header('Upgrade', 'websocket')
+            self.send_header('Connection', 'Upgrade')
+            self.send_header('Sec-WebSocket-Accept', accept)
+            self.end_headers()
+            self.wfile.flush()
+            self.close_connection = True
+
+            subscriber = _Subscriber(self)
+            with hub.lock:
+                hub.subscribers.append(subscriber)
+            try:
+                while not subscriber.closed:
+                    opcode, data = subscriber.receive()
+                    if opcode is None or opcode == 0x8:
+                        break
+                    if opcode == 0x9:
+                        subscriber.send(data.decode(), opcode=0xA)
+                    elif opcode == 0x1:
+                        message = json.loads(data)
+                        if message.get('event') == 'subscribe':
+                            subscription_id = subscriber.subscribe(message.get('topic'))
+                            subscriber.send(json.dumps({'event': 'subscribed', 'topic': message.get('topic'),
+                                                        'subscription_id': subscription_id}))
+            except OSError:
+                pass
+            finally:
+                subscriber.closed = True
+                with hub.lock:
+                    if subscriber in hub.subscribers:
+                        hub.subscribers.remove(subscriber)
+
+    return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run an in-memory stand-in for the DeepHub.')
+    parser.add_argument('--port', type=int, default=8081, help='the port to listen on (default: 8081)')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to delay every response (default: 0)')
+    args = parser.parse_args()
+    hub = MockDeepHub(port=args.port, delay=args.delay)
+    print('Serving a mock DeepHub at', hub.url)
+    try:
+        hub.server.serve_forever()
+    except KeyboardInterrupt:
+        print('\nStopped')
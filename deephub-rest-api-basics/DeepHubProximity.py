@@ -0,0 +1,255 @@
+import datetime
+import math
+import threading
+from collections import defaultdict
+
+from DeepHubClasses import METERS_PER_DEGREE
+
+
+#
+# The radius in meters of the circle around the center of a WGS84 polygon, given as its rings, enclosing it.
+#
+def geometry_radius(rings) -> float:
+    exterior = [point[:2] for point in rings[0]]
+    center_x = sum(point[0] for point in exterior) / len(exterior)
+    center_y = sum(point[1] for point in exterior) / len(exterior)
+    scale_x = math.cos(math.radians(center_y)) * METERS_PER_DEGREE
+    return max(math.hypot((x - center_x) * scale_x, (y - center_y) * METERS_PER_DEGREE) for x, y in exterior)
+
+
+#
+# Detects collisions and near misses between trackables locally, from their trackable_motions.
+#
+# Every trackable is a circle around its latest position, with the radius of the trackable, or of the circle
+# enclosing its geometry, or default_radius. Two trackables collide while their circles overlap, and have a near
+# miss while less than near_distance meters separate them. With hysteresis, a collision or near miss only ends
+# once the trackables are hysteresis meters further apart than needed to start it, so that position noise around
+# a threshold does not start and end it on every tick.
+#
+# The positions are kept in a uniform spatial hash of cell_size meters, which is updated incrementally when a
+# trackable moves to another cell. On every tick, only the trackables that moved since the previous tick are
+# checked, and only against the trackables in the cells within reach, so that a tick takes time linear in the
+# number of moved trackables at a given density instead of quadratic in the number of all trackables.
+# Every start and end of a collision or near miss is returned as an event with collision_type collision_start,
+# collision_end, near_miss_start or near_miss_end.
+#
+# WGS84 positions are projected onto a plane at the first position seen, which is accurate to well below a meter
+# within a few kilometers. Positions in any other crs are taken as zone-local meters, so the positions of all
+# trackables must be either in WGS84 or in the same zone.
+#
+class ProximityEngine(object):
+    def __init__(self, near_distance: float = 2.0, default_radius: float = 0.5, cell_size: float = None,
+                 radii: dict = None, registry=None, callback=None, hysteresis: float = 0.0):
+        self.near_distance = near_distance
+        self.default_radius = default_radius
+        self.hysteresis = hysteresis
+        self.cell_size = cell_size or 2 * default_radius + near_distance
+        # The radii of trackables by id, taking precedence over those of the trackables themselves.
+        self.radii = dict(radii or {})
+        # An EntityRegistry to look up the radius and geometry of trackables whose motions do not carry them.
+        self.registry = registry
+        # Called with the events of every batch of a StreamConsumer that has any.
+        self.callback = callback
+        self.grid = defaultdict(set)
+        # Per trackable: its position in meters and its grid cell, and its radius.
+        self.positions = {}
+        self._radius = {}
+        self._max_radius = 0.0
+        # The state of every pair of trackables with a collision or near miss, and the partners of every trackable.
+        self.pairs = {}
+        self._partners = defaultdict(set)
+        self._moved = set()
+        self._origin = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.updates = 0
+        self.checks = 0
+
+    #
+    # Record the position of a trackable, given as coordinates in WGS84 or in zone-local meters. The trackable, a
+    # dict like those of /trackables, is used to find its radius when it is first seen.
+    #
+    def update(self, trackable_id: str, coordinates, crs: str = None, trackable: dict = None):
+        x, y = self._project(coordinates, crs)
+        cell = (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+        with self._lock:
+            self.updates += 1
+            if trackable_id not in self._radius:
+                self._set_radius(trackable_id, trackable)
+            previous = self.positions.get(trackable_id)
+            if previous is None or previous[2] != cell:
+                if previous is not None:
+                    self._leave(trackable_id, previous[2])
+                self.grid[cell].add(trackable_id)
+            self.positions[trackable_id] = (x, y, cell)
+            self._moved.add(trackable_id)
+
+    #
+    # Check the trackables that moved since the previous tick, and return the events of all collisions and near
+    # misses that started or ended since then.
+    #
+    def evaluate(self, timestamp: str = None) -> list:
+        if timestamp is None:
+            timestamp = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        events = []
+        with self._lock:
+            moved, self._moved = self._moved, set()
+            for trackable_id in moved:
+                if trackable_id in self.positions:
+                    self._check(trackable_id, timestamp, events)
+        return events
+
+    #
+    # Stop tracking a trackable, and return the events ending its collisions and near misses.
+    #
+    def forget(self, trackable_id: str, timestamp: str = None) -> list:
+        if timestamp is None:
+            timestamp = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        events = []
+        with self._lock:
+            position = self.positions.pop(trackable_id, None)
+            if position is not None:
+                self._leave(trackable_id, position[2])
+            for partner in list(self._partners.get(trackable_id, ())):
+                self._end(trackable_id, partner, timestamp, events)
+            self._partners.pop(trackable_id, None)
+            self._radius.pop(trackable_id, None)
+            self._moved.discard(trackable_id)
+        return events
+
+    #
+    # The radius of a trackable in meters.
+    #
+    def radius(self, trackable_id: str, trackable: dict = None) -> float:
+        if trackable_id in self.radii:
+            return self.radii[trackable_id]
+        candidates = [trackable]
+        if self.registry is not None:
+            candidates.append(self.registry.get('trackables', trackable_id))
+        for candidate in candidates:
+            if not candidate:
+                continue
+            if candidate.get('radius'):
+                return float(candidate['radius'])
+            geometry = candidate.get('geometry')
+            if geometry and geometry.get('type') == 'Polygon' and geometry.get('coordinates'):
+                return geometry_radius(geometry['coordinates'])
+        return self.default_radius
+
+    #
+    # Handle a batch of (topic, payload) events of a StreamConsumer: record the trackable_motions, forget deleted
+    # trackables, and evaluate the batch as one tick.
+    #
+    def handle(self, batch: list):
+        events = []
+        for topic, payload in batch:
+            if topic == 'trackable_motions':
+                location = payload.get('location') or {}
+                position = location.get('position')
+                if payload.get('id') is not None and position is not None:
+                    self.update(payload['id'], position['coordinates'], location.get('crs'), payload)
+            elif topic == 'metadata_changes' and payload.get('type') == 'trackable':
+                if payload.get('operation') == 'delete':
+                    events += self.forget(payload.get('id'))
+                else:
+                    # The radius or geometry may have changed, so it is looked up again on the next check.
+                    with self._lock:
+                        self._radius.pop(payload.get('id'), None)
+                        if payload.get('id') in self.positions:
+                            self._moved.add(payload.get('id'))
+        events += self.evaluate()
+        if events and self.callback is not None:
+            self.callback(events)
+
+    def stats(self) -> dict:
+        with self._lock:
+            states = list(self.pairs.values())
+            return {'trackables': len(self.positions), 'cells': len(self.grid), 'updates': self.updates,
+                    'checks': self.checks, 'collisions': states.count('collision'),
+                    'near_misses': states.count('near_miss')}
+
+    def _project(self, coordinates, crs: str) -> tuple:
+        if crs not in (None, 'EPSG:4326'):
+            return coordinates[0], coordinates[1]
+        if self._origin is None:
+            self._origin = (coordinates[0], coordinates[1],
+                            math.cos(math.radians(coordinates[1])) * METERS_PER_DEGREE)
+        origin_x, origin_y, scale_x = self._origin
+        return (coordinates[0] - origin_x) * scale_x, (coordinates[1] - origin_y) * METERS_PER_DEGREE
+
+    # Must be called while holding self._lock.
+    def _set_radius(self, trackable_id: str, trackable: dict = None) -> float:
+        radius = self._radius[trackable_id] = self.radius(trackable_id, trackable)
+        self._max_radius = max(self._max_radius, radius)
+        return radius
+
+    # Must be called while holding self._lock. The radius of a changed trackable is looked up again.
+    def _radius_of(self, trackable_id: str) -> float:
+        radius = self._radius.get(trackable_id)
+        return self._set_radius(trackable_id) if radius is None else radius
+
+    # Must be called while holding self._lock.
+    def _leave(self, trackable_id: str, cell: tuple):
+        members = self.grid[cell]
+        members.discard(trackable_id)
+        if not members:
+            del self.grid[cell]
+
+    # Must be called while holding self._lock.
+    def _check(self, trackable_id: str, timestamp: str, events: list):
+        x, y, (cell_x, cell_y) = self.positions[trackable_id]
+        radius = self._radius_of(trackable_id)
+        reach = self.near_distance + self.hysteresis
+        span = math.ceil((radius + self._max_radius + reach) / self.cell_size)
+        found = {}
+        for grid_x in range(cell_x - span, cell_x + span + 1):
+            for grid_y in range(cell_y - span, cell_y + span + 1):
+                for other in self.grid.get((grid_x, grid_y), ()):
+                    if other == trackable_id:
+                        continue
+                    other_x, other_y, _ = self.positions[other]
+                    clearance = math.hypot(other_x - x, other_y - y) - radius - self._radius_of(other)
+                    self.checks += 1
+                    if clearance <= reach:
+                        found[other] = clearance
+
+        ended = self._partners.get(trackable_id, set()) - found.keys()
+        for other, clearance in found.items():
+            pair = (trackable_id, other) if trackable_id < other else (other, trackable_id)
+            previous = self.pairs.get(pair)
+            state = self._state(clearance, previous)
+            if previous == state:
+                continue
+            if state is None:
+                ended.add(other)
+                continue
+            if previous is not None:
+                events.append(self._event(pair, previous + '_end', clearance, timestamp))
+            events.append(self._event(pair, state + '_start', clearance, timestamp))
+            self.pairs[pair] = state
+            self._partners[trackable_id].add(other)
+            self._partners[other].add(trackable_id)
+        for other in ended:
+            self._end(trackable_id, other, timestamp, events)
+
+    # The state of a pair at the given clearance, 'collision', 'near_miss' or None, given its previous state.
+    def _state(self, clearance: float, previous: str):
+        if clearance <= (self.hysteresis if previous == 'collision' else 0.0):
+            return 'collision'
+        if clearance <= self.near_distance + (self.hysteresis if previous is not None else 0.0):
+            return 'near_miss'
+        return None
+
+    # Must be called while holding self._lock.
+    def _end(self, trackable_id: str, other: str, timestamp: str, events: list):
+        pair = (trackable_id, other) if trackable_id < other else (other, trackable_id)
+        state = self.pairs.pop(pair, None)
+        self._partners[trackable_id].discard(other)
+        self._partners[other].discard(trackable_id)
+        if state is not None:
+            events.append(self._event(pair, state + '_end', None, timestamp))
+
+    def _event(self, pair: tuple, collision_type: str, clearance, timestamp: str) -> dict:
+        return {'collision_type': collision_type, 'timestamp': timestamp, 'distance': clearance,
+                'collisions': [{'trackable_id': trackable_id, 'radius': self._radius.get(trackable_id)}
+                               for trackable_id in pair]}
@@ -0,0 +1,391 @@
+import email.utils
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+import requests as rest
+from requests.adapters import HTTPAdapter
+
+from DeepHubClasses import LocationEncoder
+
+
+#
+# Publishes location updates to the DeepHub in batches over a pooled, keep-alive HTTP session.
+#
+# Locations published from any number of provider threads are merged into a single array PUT to
+# /providers/locations. A batch is sent once it reaches max_batch_size locations, or once the oldest pending
+# location has waited for max_delay seconds, whichever comes first.
+#
+# Full batches are sent by the publishing threads and the others by a background flusher, concurrently over the
+# pool, so batches are not guaranteed to arrive in the order they were taken. A location may thus arrive after a
+# later one of the same provider and briefly become its latest location in the DeepHub. Where the order matters,
+# use a WriteBehindPublisher, which sends its batches one at a time.
+#
+class LocationPublisher(object):
+    def __init__(self, url: str, pool_size: int = 4, max_batch_size: int = 100, max_delay: float = 0.05,
+                 latency_samples: int = 10000):
+        self.url = url + '/providers/locations'
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+
+        # One connection per provider thread, plus one for the background flusher.
+        self.session = rest.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size + 1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Content-Type'] = 'application/json'
+
+        self._encoder = LocationEncoder()
+        self._pending = bytearray(b'[')
+        self._pending_count = 0
+        self._pending_since = None
+        self._condition = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._closed = False
+
+        self.started = time.monotonic()
+        self.updates_sent = 0
+        self.bytes_sent = 0
+        self.requests_sent = 0
+        self.requests_failed = 0
+        self.latencies = deque(maxlen=latency_samples)
+
+        self._flusher = threading.Thread(target=self._run, daemon=True)
+        self._flusher.start()
+
+    #
+    # Queue a location for the next batch. The location is encoded into the pending request body right away,
+    # so callers may keep modifying and re-publishing the same dh.Location object.
+    #
+    def publish(self, location):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('LocationPublisher is closed')
+            if self._pending_count:
+                self._pending += b','
+            self._encoder.encode_into(location, self._pending)
+            self._pending_count += 1
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+                self._condition.notify()
+            if self._pending_count < self.max_batch_size:
+                return
+            batch = self._take_batch()
+        # A full batch is sent from the publishing thread, so that several providers can use the pool concurrently.
+        self._send(batch)
+
+    #
+    # Send all pending locations immediately.
+    #
+    def flush(self):
+        with self._condition:
+            batch = self._take_batch()
+        if batch:
+            self._send(batch)
+
+    #
+    # Flush the remaining locations and release the connection pool.
+    #
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._flusher.join()
+        self.flush()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    #
+    # Summarize the achieved throughput and the per-request latency in seconds.
+    #
+    def stats(self) -> dict:
+        with self._stats_lock:
+            latencies = sorted(self.latencies)
+            elapsed = time.monotonic() - self.started
+            result = {
+                'updates': self.updates_sent,
+                'bytes': self.bytes_sent,
+                'requests': self.requests_sent,
+                'failed': self.requests_failed,
+                'updates_per_second': self.updates_sent / elapsed if elapsed > 0 else 0.0,
+                'updates_per_request': self.updates_sent / self.requests_sent if self.requests_sent else 0.0,
+            }
+        if latencies:
+            result['latency_mean'] = sum(latencies) / len(latencies)
+            result['latency_p50'] = latencies[len(latencies) // 2]
+            result['latency_p99'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            result['latency_max'] = latencies[-1]
+        return result
+
+    def print_stats(self):
+        stats = self.stats()
+        print('Published {updates} updates in {requests} requests ({failed} failed), '
+              '{updates_per_second:.1f} updates/s, {updates_per_request:.1f} updates/request'.format(**stats))
+        if 'latency_mean' in stats:
+            print('Request latency: mean {:.1f} ms, p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms'.format(
+                stats['latency_mean'] * 1000, stats['latency_p50'] * 1000,
+                stats['latency_p99'] * 1000, stats['latency_max'] * 1000))
+
+    # Must be called while holding self._condition. Returns the request body and the number of locations in it.
+    def _take_batch(self):
+        if not self._pending_count:
+            return None
+        self._pending += b']'
+        batch = (bytes(self._pending), self._pending_count)
+        del self._pending[1:]
+        self._pending_count, self._pending_since = 0, None
+        return batch
+
+    def _send(self, batch):
+        body, count = batch
+        start = time.monotonic()
+        try:
+            response = self.session.put(self.url, body)
+            failed = response.status_code >= 400
+        except rest.RequestException:
+            failed = True
+        latency = time.monotonic() - start
+        with self._stats_lock:
+            self.requests_sent += 1
+            self.bytes_sent += len(body)
+            self.latencies.append(latency)
+            if failed:
+                self.requests_failed += 1
+            else:
+                self.updates_sent += count
+
+    # The background flusher sends batches that did not fill up within max_delay.
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if self._pending_since is None:
+                        self._condition.wait()
+                        continue
+                    remaining = self._pending_since + self.max_delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._closed:
+                    return
+                batch = self._take_batch()
+            self._send(batch)
+
+
+#
+# Limits a rate, e.g. of location updates per second, allowing bursts of up to burst at once.
+#
+class TokenBucket(object):
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    #
+    # Wait until count tokens are available and take them. Counts above the burst size are taken once the bucket
+    # is full, leaving it in debt.
+    #
+    def acquire(self, count: float = 1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self.tokens >= min(count, self.capacity):
+                    self.tokens -= count
+                    return
+                wait = (min(count, self.capacity) - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+#
+# A LocationPublisher that never blocks the publishing threads on the DeepHub.
+#
+# Published locations are encoded into a bounded write-behind queue and sent in batches by a background sender.
+# When the queue is full, the oldest location is dropped, or, with policy 'latest', each provider only keeps its
+# latest location in the queue, so that a stalled DeepHub costs at most max_queue pending locations of memory.
+# The sender is limited to rate location updates per second by a token bucket, if given, and retries batches
+# failing with a connection error, 429 or 5xx, which is safe as the location updates are idempotent, with jittered
+# exponential backoff between min_backoff and max_backoff seconds, or after the Retry-After of the response, at most
+# max_backoff seconds. As there is a single sender, batches are sent in the order they were queued.
+#
+class WriteBehindPublisher(LocationPublisher):
+    def __init__(self, url: str, max_queue: int = 10000, policy: str = 'oldest', rate: float = None,
+                 burst: float = None, max_retries: int = 5, min_backoff: float = 0.1, max_backoff: float = 5.0,
+                 max_batch_size: int = 100, max_delay: float = 0.05, metrics=None, latency_samples: int = 10000):
+        if policy not in ('oldest', 'latest'):
+            raise ValueError('Unknown drop policy ' + policy)
+        self.max_queue = max_queue
+        self.policy = policy
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_retries = max_retries
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.metrics = metrics
+        self._queue = OrderedDict() if policy == 'latest' else deque()
+        self._in_flight = 0
+        # The number of threads waiting in flush(), while which batches are sent without waiting for max_delay.
+        self._flushing = 0
+        self.dropped = 0
+        self.superseded = 0
+        self.retries = 0
+        self.max_queue_depth = 0
+        super().__init__(url, pool_size=1, max_batch_size=max_batch_size, max_delay=max_delay,
+                         latency_samples=latency_samples)
+
+    def publish(self, location):
+        # Encoded outside of the lock, so that publishing threads only contend for the queue itself.
+        buffer = bytearray()
+        self._encoder.encode_into(location, buffer)
+        data = bytes(buffer)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('WriteBehindPublisher is closed')
+            queue = self._queue
+            if self.policy == 'latest':
+                if location.provider_id in queue:
+                    self.superseded += 1
+                elif len(queue) >= self.max_queue:
+                    queue.popitem(last=False)
+                    self.dropped += 1
+                queue[location.provider_id] = data
+            else:
+                if len(queue) >= self.max_queue:
+                    queue.popleft()
+                    self.dropped += 1
+                queue.append(data)
+            self.max_queue_depth = max(self.max_queue_depth, len(queue))
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+                self._condition.notify_all()
+
+    #
+    # Send the queued locations without waiting for max_delay, and wait until all of them have been sent.
+    #
+    def flush(self):
+        with self._condition:
+            self._flushing += 1
+            self._condition.notify_all()
+            try:
+                while self._queue or self._in_flight:
+                    self._condition.wait()
+            finally:
+                self._flushing -= 1
+
+    #
+    # Send the remaining queued locations and release the connection pool.
+    #
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._flusher.join()
+        self.session.close()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> dict:
+        result = super().stats()
+        with self._condition:
+            result.update({'queue_depth': len(self._queue), 'max_queue_depth': self.max_queue_depth,
+                           'dropped': self.dropped, 'superseded': self.superseded, 'retries': self.retries})
+        return result
+
+    def print_stats(self):
+        super().print_stats()
+        print('Write-behind queue: depth {queue_depth} (max {max_queue_depth}), {dropped} dropped, '
+              '{superseded} superseded, {retries} retries'.format(**self.stats()))
+
+    # Must be called while holding self._condition.
+    def _take_batch(self):
+        queue = self._queue
+        count = min(len(queue), self.max_batch_size)
+        if self.policy == 'latest':
+            batch = [queue.popitem(last=False)[1] for _ in range(count)]
+        else:
+            batch = [queue.popleft() for _ in range(count)]
+        self._pending_since = time.monotonic() if queue else None
+        self._in_flight += 1
+        return batch
+
+    # The sender. Batches are sent once they are full, max_delay has passed, or until the queue is drained on flush
+    # and close.
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._queue:
+                        if self._closed:
+                            return
+                        self._condition.wait()
+                        continue
+                    remaining = self._pending_since + self.max_delay - time.monotonic()
+                    if len(self._queue) >= self.max_batch_size or remaining <= 0 or self._closed or self._flushing:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._take_batch()
+            try:
+                if self.bucket is not None:
+                    self.bucket.acquire(len(batch))
+                self._send_with_retry(b'[' + b','.join(batch) + b']', len(batch))
+            finally:
+                with self._condition:
+                    self._in_flight -= 1
+                    self._condition.notify_all()
+
+    def _send_with_retry(self, body: bytes, count: int):
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            try:
+                response = self.session.put(self.url, body)
+                status, retry_after = response.status_code, _retry_after(response)
+            except rest.RequestException:
+                status, retry_after = None, None
+            latency = time.monotonic() - start
+            retry = (status is None or status == 429 or status >= 500) and attempt < self.max_retries
+            with self._stats_lock:
+                self.requests_sent += 1
+                self.bytes_sent += len(body)
+                self.latencies.append(latency)
+                if status is not None and status < 400:
+                    self.updates_sent += count
+                    return
+                if not retry:
+                    self.requests_failed += 1
+                    return
+                self.retries += 1
+            if self.metrics is not None:
+                self.metrics.retry('PUT', self.url)
+            if retry_after is not None:
+                time.sleep(min(self.max_backoff, retry_after))
+            else:
+                time.sleep(random.uniform(self.min_backoff,
+                                          min(self.max_backoff, self.min_backoff * 2 ** (attempt + 1))))
+
+
+#
+# The seconds to wait before retrying, from the Retry-After header of a response, either in seconds or as an HTTP
+# date, or None.
+#
+def _retry_after(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from DeepHubTrajectory import LOCAL_CRS, TrajectoryWriter, chunk_file, chunk_files
+
+
+#
+# The time of a location in seconds since the epoch, from its timestamp_generated or timestamp_sent, or None.
+#
+def location_time(location: dict):
+    for key in ('timestamp_generated', 'timestamp_sent'):
+        value = location.get(key)
+        if value:
+            try:
+                timestamp = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+            except ValueError:
+                continue
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+            return timestamp.timestamp()
+    return None
+
+
+#
+# Records the location_updates of a StreamConsumer into timestamped trajectory files, one series per provider.
+#
+# Every provider is written to append-only chunk files named <provider id>.<chunk>.dhtr in the given directory,
+# starting a new chunk every chunk_points points. All open chunks are synced to disk every sync_interval seconds by
+# a background thread, so that buffered points are also synced while no locations arrive, and at most
+# max_open_files chunks are kept open, closing the least recently written ones first. Memory use therefore does not
+# grow with the length of the recording or the number of providers.
+#
+# Points are stored with the time they were generated, so that a recording replays with its original timing.
+# Locations without a timestamp are stored with the time they were received. Locations that do not fit the
+# trajectory of their provider, e.g. with another number of coordinates, or with a provider type or crs too long
+# for the header, are counted as dropped.
+#
+class TrajectoryRecorder(object):
+    def __init__(self, directory: str, chunk_points: int = 100000, sync_interval: float = 1.0,
+                 max_open_files: int = 256):
+        self.directory = directory
+        self.chunk_points = chunk_points
+        self.sync_interval = sync_interval
+        self.max_open_files = max_open_files
+        os.makedirs(directory, exist_ok=True)
+        self._writers = OrderedDict()
+        self._chunks = {}
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.dropped = 0
+        self._stopped = threading.Event()
+        self._syncer = threading.Thread(target=self._run, daemon=True)
+        self._syncer.start()
+
+    #
+    # Handle a batch of (topic, payload) events of a StreamConsumer.
+    #
+    def handle(self, batch: list):
+        received = time.time()
+        with self._lock:
+            for topic, location in batch:
+                if topic != 'location_updates':
+                    continue
+                try:
+                    provider_id = location['provider_id']
+                    coordinates = location['position']['coordinates']
+                except (KeyError, TypeError):
+                    self.dropped += 1
+                    continue
+                timestamp = location_time(location)
+                try:
+                    self._writer(provider_id, location, len(coordinates)).append(
+                        received if timestamp is None else timestamp, coordinates)
+                except ValueError:
+                    self.dropped += 1
+                    continue
+                self.recorded += 1
+
+    def sync(self):
+        with self._lock:
+            for writer in self._writers.values():
+                writer.sync()
+
+    def close(self):
+        self._stopped.set()
+        self._syncer.join()
+        with self._lock:
+            for writer in self._writers.values():
+                writer.close()
+            self._writers.clear()
+
+    def _run(self):
+        while not self._stopped.wait(self.sync_interval):
+            self.sync()
+
+    # Must be called while holding self._lock.
+    def _writer(self, provider_id: str, location: dict, dimensions: int) -> TrajectoryWriter:
+        writer = self._writers.get(provider_id)
+        if writer is not None:
+            if writer.count + writer.pending < self.chunk_points:
+                self._writers.move_to_end(provider_id)
+                return writer
+            writer.close()
+            del self._writers[provider_id]
+            self._chunks[provider_id] += 1
+        elif provider_id not in self._chunks:
+            # Continue the last chunk of an earlier recording into the same directory.
+            self._chunks[provider_id] = max(len(chunk_files(self.directory, provider_id)) - 1, 0)
+        while len(self._writers) >= self.max_open_files:
+            self._writers.popitem(last=False)[1].close()
+        crs = location.get('crs') or LOCAL_CRS
+        while True:
+            writer = TrajectoryWriter(chunk_file(self.directory, provider_id, self._chunks[provider_id]),
+                                      location.get('provider_type') or 'unknown', crs, dimensions)
+            # A chunk closed earlier, e.g. to stay within max_open_files, may be full already.
+            if writer.count < self.chunk_points:
+                break
+            writer.close()
+            self._chunks[provider_id] += 1
+        self._writers[provider_id] = writer
+        return writer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == '__main__':
+    from DeepHubStream import StreamConsumer
+
+    parser = argparse.ArgumentParser(description='Record the location updates of a DeepHub into trajectory files '
+                                                 'for replay.')
+    parser.add_argument('directory', help='directory to write the trajectory files to')
+    parser.add_argument('--url', default='ws://localhost:8081/deephub/v1/ws/socket',
+                        help='the WebSocket URL of the DeepHub (default: ws://localhost:8081/deephub/v1/ws/socket)')
+    parser.add_argument('--chunk-points', type=int, default=100000,
+                        help='points per trajectory file (default: 100000)')
+    parser.add_argument('--sync-interval', type=float, default=1.0,
+                        help='seconds between two syncs to disk (default: 1)')
+    args = parser.parse_args()
+
+    with TrajectoryRecorder(args.directory, args.chunk_points, args.sync_interval) as recorder:
+        consumer = StreamConsumer(args.url, topics=['location_updates'])
+        consumer.add_sink(recorder)
+        try:
+            consumer.run_forever()
+        except KeyboardInterrupt:
+            pass
+        print('Recorded', recorder.recorded, 'locations.')
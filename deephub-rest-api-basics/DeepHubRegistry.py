@@ -0,0 +1,229 @@
+import copy
+import threading
+import time
+
+import requests as rest
+import ujson as json
+
+# The collections of the DeepHub cached by the registry.
+COLLECTIONS = ('zones', 'fences', 'providers', 'trackables')
+
+# The entity types of metadata_changes events, and the collections they belong to.
+ENTITY_TYPES = {'zone': 'zones', 'fence': 'fences', 'location_provider': 'providers', 'provider': 'providers',
+                'trackable': 'trackables'}
+
+
+#
+# An in-memory cache of the zones, fences, providers and trackables of a DeepHub.
+#
+# All entities are bulk-loaded once with one request per collection. Afterwards, lookups are served from the
+# cache, and updates are only sent if they actually change an entity. This makes idempotent setups and repeated
+# updates, like attaching a trackable to another provider, cost no reads in the common case.
+#
+# To stay in sync with changes made by other clients, the registry can be added as a sink to a StreamConsumer
+# subscribed to metadata_changes. Changed entities are then reloaded on their next access. As many changes of an
+# entity as the registry itself wrote to it, reported within echo_timeout seconds of the last of those writes, are
+# taken as their echoes, and not reloaded. A change by another client in the meantime is still followed by an echo,
+# which reloads the entity.
+#
+class EntityRegistry(object):
+    def __init__(self, url: str, session: rest.Session = None, echo_timeout: float = 10.0):
+        self.url = url
+        self.session = session or rest.Session()
+        self.entities = {collection: {} for collection in COLLECTIONS}
+        self.locations = {}
+        self._stale = {collection: set() for collection in COLLECTIONS}
+        # The stale entities being reloaded. An entity deleted meanwhile is removed, so its reload is discarded.
+        self._reloading = {collection: set() for collection in COLLECTIONS}
+        # The number and the time of the last of the writes of the registry whose echoes are pending, by collection
+        # and entity id.
+        self.echo_timeout = echo_timeout
+        self._written = {collection: {} for collection in COLLECTIONS}
+        self._lock = threading.RLock()
+        self.reads = 0
+        self.writes = 0
+        # As a sink of a StreamConsumer, the registry never drops events.
+        self.dropped = 0
+
+    #
+    # Load all entities of all collections, with one request per collection.
+    #
+    def load(self):
+        for collection in COLLECTIONS:
+            entities = self._request('get', '/' + collection + '/summary').json()
+            with self._lock:
+                self.entities[collection] = {entity['id']: entity for entity in entities}
+                self._stale[collection].clear()
+        return self
+
+    #
+    # Return the entity with the given id, or None.
+    #
+    def get(self, collection: str, entity_id: str):
+        self._refresh(collection)
+        with self._lock:
+            return self.entities[collection].get(entity_id)
+
+    def ids(self, collection: str) -> list:
+        self._refresh(collection)
+        with self._lock:
+            return list(self.entities[collection])
+
+    #
+    # Return all entities of the collection whose properties equal the given values, e.g. foreign_id='...'.
+    #
+    def find(self, collection: str, **properties) -> list:
+        self._refresh(collection)
+        with self._lock:
+            return [entity for entity in self.entities[collection].values()
+                    if all(entity.get(key) == value for key, value in properties.items())]
+
+    #
+    # Create an entity, given as a DeepHubClasses object or as a dict, and return it as created by the DeepHub.
+    #
+    def create(self, collection: str, entity) -> dict:
+        body = entity if isinstance(entity, str) else json.dumps(entity) if isinstance(entity, dict) \
+            else entity.to_json()
+        created = self._request('post', '/' + collection, body).json()
+        with self._lock:
+            self.entities[collection][created['id']] = created
+            # The id is only known now, so the echo may have arrived before the response, marking the entity stale.
+            if created['id'] in self._stale[collection]:
+                self._stale[collection].discard(created['id'])
+            else:
+                self._wrote(collection, created['id'])
+        return created
+
+    #
+    # Create the entity unless an entity with the same value of the key property exists already.
+    # Returns the existing or the created entity.
+    #
+    def ensure(self, collection: str, entity, key: str = 'id') -> dict:
+        properties = entity if isinstance(entity, dict) else json.loads(entity.to_json())
+        existing = self.find(collection, **{key: properties[key]})
+        if existing:
+            return self.update(collection, existing[0]['id'], **{k: v for k, v in properties.items() if k != 'id'})
+        return self.create(collection, properties)
+
+    #
+    # Apply the given property changes to an entity. The DeepHub is only updated if a value actually changes.
+    #
+    def update(self, collection: str, entity_id: str, **changes) -> dict:
+        entity = self.get(collection, entity_id)
+        with self._lock:
+            if entity is None:
+                raise KeyError('No entity {} in {}'.format(entity_id, collection))
+            if all(entity.get(key) == value for key, value in changes.items()):
+                return entity
+            updated = copy.deepcopy(entity)
+            updated.update(changes)
+            self._wrote(collection, entity_id)
+        self._request('put', '/' + collection + '/' + entity_id, json.dumps(updated))
+        with self._lock:
+            self.entities[collection][entity_id] = updated
+        return updated
+
+    #
+    # Delete an entity. An entity that is already gone counts as deleted.
+    #
+    def delete(self, collection: str, entity_id: str):
+        self._request('delete', '/' + collection + '/' + entity_id, allow_missing=True)
+        with self._lock:
+            self.entities[collection].pop(entity_id, None)
+            self._stale[collection].discard(entity_id)
+            self._reloading[collection].discard(entity_id)
+            self._written[collection].pop(entity_id, None)
+            if collection == 'providers':
+                self.locations.pop(entity_id, None)
+
+    #
+    # Update the trackable such that it is attached to the provider with the given id.
+    #
+    def attach_trackable(self, trackable_id: str, provider_id: str) -> dict:
+        return self.update('trackables', trackable_id, location_providers=[provider_id])
+
+    #
+    # Handle a batch of (topic, payload) events of a StreamConsumer.
+    #
+    # Entities reported by metadata_changes are reloaded on their next access, unless the change is the echo of a
+    # write of the registry, and deleted entities are removed. The latest location of every provider is kept from
+    # location_updates.
+    #
+    def handle(self, batch: list):
+        now = time.monotonic()
+        with self._lock:
+            for topic, payload in batch:
+                if topic == 'location_updates':
+                    self.locations[payload.get('provider_id')] = payload
+                elif topic == 'metadata_changes':
+                    collection = ENTITY_TYPES.get(payload.get('type'))
+                    if collection is None:
+                        continue
+                    if payload.get('operation') == 'delete':
+                        self.entities[collection].pop(payload.get('id'), None)
+                        self._stale[collection].discard(payload.get('id'))
+                        self._reloading[collection].discard(payload.get('id'))
+                        self._written[collection].pop(payload.get('id'), None)
+                    elif not self._echo(collection, payload.get('id'), now):
+                        self._stale[collection].add(payload.get('id'))
+
+    # Must be called while holding self._lock. Record a write of the registry, whose echo is expected.
+    def _wrote(self, collection: str, entity_id: str):
+        count, _ = self._written[collection].get(entity_id, (0, None))
+        self._written[collection][entity_id] = (count + 1, time.monotonic())
+
+    # Must be called while holding self._lock. Whether a change of the entity is the echo of a write of the registry.
+    def _echo(self, collection: str, entity_id: str, now: float) -> bool:
+        count, written = self._written[collection].pop(entity_id, (0, None))
+        if not count or now - written >= self.echo_timeout:
+            return False
+        if count > 1:
+            self._written[collection][entity_id] = (count - 1, written)
+        return True
+
+    # Reload the stale entities of the collection. The requests are made without holding self._lock, so that a slow
+    # DeepHub does not block the readers of the cache, which see the previous entities until the reload completes.
+    def _refresh(self, collection: str):
+        with self._lock:
+            stale, reloading = self._stale[collection], self._reloading[collection]
+            if not stale:
+                return
+            entity_ids = list(stale)
+            stale.clear()
+            reloading.update(entity_ids)
+        responses = []
+        try:
+            for entity_id in entity_ids:
+                responses.append((entity_id, self._request('get', '/' + collection + '/' + entity_id,
+                                                           allow_missing=True)))
+        except rest.RequestException:
+            with self._lock:
+                for entity_id in entity_ids[len(responses):]:
+                    if entity_id in reloading:
+                        reloading.discard(entity_id)
+                        stale.add(entity_id)
+            raise
+        finally:
+            with self._lock:
+                for entity_id, response in responses:
+                    # Skip entities deleted meanwhile, and those changed again, which are reloaded next time.
+                    if entity_id not in reloading:
+                        continue
+                    reloading.discard(entity_id)
+                    if entity_id in stale:
+                        continue
+                    if response.status_code == 404:
+                        self.entities[collection].pop(entity_id, None)
+                    else:
+                        self.entities[collection][entity_id] = response.json()
+
+    def _request(self, method: str, path: str, body: str = None, allow_missing: bool = False) -> rest.Response:
+        if method == 'get':
+            self.reads += 1
+        else:
+            self.writes += 1
+        response = self.session.request(method, self.url + path, data=body,
+                                        headers={'Content-Type': 'application/json'} if body else None)
+        if not (allow_missing and response.status_code == 404):
+            response.raise_for_status()
+        return response
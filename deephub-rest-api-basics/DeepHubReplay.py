@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from itertools import chain
+
+from DeepHubTrajectory import TRAJECTORY_SUFFIX, Trajectory, chunk_files
+
+# The number of points of a trajectory converted to Python lists at once.
+READ_CHUNK = 4096
+
+
+#
+# Paces the location updates of many providers to a known, reproducible schedule.
+#
+# Every update is due at an absolute deadline: after the time between the timestamps of two consecutive points,
+# if they have timestamps, or after 1 / rate seconds otherwise, both divided by speed. As the deadlines do not
+# depend on how long publishing took, the offered load does not drift with the latency of the DeepHub. With
+# max_throughput=True, updates are not paced at all.
+#
+# The schedule lag, how late an update was taken from its deadline, is tracked per provider, over all of its
+# replays.
+#
+class ReplayScheduler(object):
+    def __init__(self, rate: float = 20.0, speed: float = 1.0, max_throughput: bool = False):
+        if rate <= 0:
+            raise ValueError('The rate must be positive, not {}'.format(rate))
+        if speed <= 0:
+            raise ValueError('The speed must be positive, not {}'.format(speed))
+        self.rate = rate
+        self.speed = speed
+        self.max_throughput = max_throughput
+        self.providers = {}
+        self._lock = threading.Lock()
+
+    #
+    # Yield the given (timestamp, item) pairs, each at its deadline. The timestamp may be None.
+    #
+    def pace(self, provider_id: str, items):
+        with self._lock:
+            lag = self.providers.get(provider_id)
+            if lag is None:
+                lag = self.providers[provider_id] = ProviderLag()
+        deadline, previous = None, None
+        for timestamp, item in items:
+            now = time.monotonic()
+            if self.max_throughput or deadline is None:
+                deadline = now
+            elif timestamp is not None and previous is not None:
+                deadline += abs(timestamp - previous) / self.speed
+            else:
+                deadline += 1.0 / (self.rate * self.speed)
+            previous = timestamp
+            if deadline > now:
+                time.sleep(deadline - now)
+                now = time.monotonic()
+            lag.add(now - deadline)
+            yield item
+
+    #
+    # The schedule lag of all providers, by provider id.
+    #
+    def stats(self) -> dict:
+        with self._lock:
+            return {provider_id: lag.stats() for provider_id, lag in self.providers.items()}
+
+    def print_stats(self):
+        for provider_id, stats in sorted(self.stats().items()):
+            print('{}: {} updates, schedule lag mean {:.1f} ms, max {:.1f} ms'.format(
+                provider_id, stats['updates'], stats['mean_lag'] * 1000, stats['max_lag'] * 1000))
+
+
+class ProviderLag(object):
+    __slots__ = ('updates', 'total', 'last', 'max')
+
+    def __init__(self):
+        self.updates = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+
+    def add(self, lag: float):
+        self.updates += 1
+        self.total += lag
+        self.last = lag
+        if lag > self.max:
+            self.max = lag
+
+    def stats(self) -> dict:
+        return {'updates': self.updates, 'lag': self.last, 'max_lag': self.max,
+                'mean_lag': self.total / self.updates if self.updates else 0.0}
+
+
+#
+# Read (timestamp, coordinates) pairs from a comma separated coordinate file, a trajectory file, or a directory of
+# chunk files recorded by DeepHubRecorder.py for the given provider. The timestamps are None if the source has none.
+# Trajectories are memory-mapped and coordinate files streamed, so memory use does not depend on their length.
+#
+def read_points(file: str, provider_id: str = None, reverse: bool = False):
+    if os.path.isdir(file):
+        files = chunk_files(file, provider_id)
+        if not files:
+            raise FileNotFoundError('No chunk files of provider {} in {}'.format(provider_id, file))
+    else:
+        files = [file]
+    if files and files[0].endswith(TRAJECTORY_SUFFIX):
+        return chain.from_iterable(_read_trajectory(trajectory_file, reverse)
+                                   for trajectory_file in (reversed(files) if reverse else files))
+    return _read_coordinates(file, reverse)
+
+
+# The memory-mapped points are converted to lists a chunk at a time, so that only one chunk is in memory.
+def _read_trajectory(trajectory_file: str, reverse: bool):
+    with Trajectory(trajectory_file) as trajectory:
+        points = trajectory.points[::-1] if reverse else trajectory.points
+        timestamps = trajectory.timestamps
+        if timestamps is not None and reverse:
+            timestamps = timestamps[::-1]
+        for start in range(0, len(points), READ_CHUNK):
+            chunk = points[start:start + READ_CHUNK].tolist()
+            if timestamps is None:
+                for coordinates in chunk:
+                    yield None, coordinates
+            else:
+                yield from zip(timestamps[start:start + READ_CHUNK].tolist(), chunk)
+
+
+def _read_coordinates(file: str, reverse: bool):
+    with open(file) as input:
+        if reverse:
+            input = reversed(list(input))
+        for line in input:
+            if line.strip():
+                yield None, list(map(float, line.split(sep=',')))
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import time
+
+import aiohttp
+import DeepHubClasses as dh
+
+# The URL at which the DeepHub is running. Adjust this accordingly if running the DeepHub at some other URL.
+url = 'http://localhost:8081/deephub/v1'
+
+# The zone and provider ids of deephub-rest-api-basics.py, which are reused by the example scenario.
+zone_foreign_id = 'mathematikon.example1.zone'
+provider_id_truck = 'TRUCK_GPS_HARDWARE_ID'
+provider_id_forklift_gps = 'FORKLIFT_GPS_HARDWARE_ID'
+provider_id_forklift_uwb = 'FORKLIFT_UWB_TAG_ID'
+
+
+#
+# Read the coordinates of a replay file. Files are parsed only once and shared by all providers replaying them.
+#
+_coordinate_cache = {}
+
+
+def read_coordinates(file: str) -> list:
+    if file not in _coordinate_cache:
+        with open(file) as input:
+            _coordinate_cache[file] = [list(map(float, line.split(sep=','))) for line in input if line.strip()]
+    return _coordinate_cache[file]
+
+
+#
+# A simulated location provider replaying a sequence of coordinates.
+#
+class Provider(object):
+    def __init__(self, provider_id: str, provider_type: str, coordinates, name: str = None):
+        self.id = provider_id
+        self.type = provider_type
+        self.name = name or provider_id
+        self.coordinates = coordinates
+        self.location = dh.Location(provider_id=provider_id, provider_type=provider_type)
+        if provider_type == 'gps':
+            self.location.crs = 'EPSG:4326'
+        else:
+            self.location.source = zone_foreign_id
+        self.updates = 0
+        self.max_lag = 0.0
+
+    def to_location_provider(self) -> dh.LocationProvider:
+        provider = dh.LocationProvider(id=self.id)
+        provider.name = self.name
+        provider.type = self.type
+        return provider
+
+
+#
+# Batches the location updates of all providers into array PUTs to /providers/locations on a shared
+# aiohttp connection pool. Batches are sent when max_batch_size locations are pending or after max_delay seconds.
+#
+class AsyncLocationPublisher(object):
+    def __init__(self, session: aiohttp.ClientSession, url: str, max_batch_size: int = 500,
+                 max_delay: float = 0.05, max_in_flight: int = 32):
+        self.session = session
+        self.url = url + '/providers/locations'
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._encoder = dh.LocationEncoder()
+        self._pending = bytearray(b'[')
+        self._pending_count = 0
+        self._timer = None
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._tasks = set()
+        self.updates_sent = 0
+        self.requests_sent = 0
+        self.requests_failed = 0
+        self.latency_total = 0.0
+
+    def publish(self, location):
+        if self._pending_count:
+            self._pending += b','
+        self._encoder.encode_into(location, self._pending)
+        self._pending_count += 1
+        if self._pending_count >= self.max_batch_size:
+            self._send_pending()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._send_pending)
+
+    async def flush(self):
+        self._send_pending()
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+    def _send_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending_count:
+            return
+        self._pending += b']'
+        task = asyncio.ensure_future(self._send(bytes(self._pending), self._pending_count))
+        del self._pending[1:]
+        self._pending_count = 0
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, body: bytes, count: int):
+        async with self._in_flight:
+            start = time.monotonic()
+            try:
+                async with self.session.put(self.url, data=body,
+                                            headers={'Content-Type': 'application/json'}) as response:
+                    await response.read()
+                    failed = response.status >= 400
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                # Requests exceeding the timeout of the session fail like those that get no response.
+                failed = True
+            self.latency_total += time.monotonic() - start
+            self.requests_sent += 1
+            if failed:
+                self.requests_failed += 1
+            else:
+                self.updates_sent += count
+
+
+#
+# Runs replay scenarios for many providers on a single event loop.
+#
+# Each phase of a scenario is a coroutine, e.g. drive() replays the coordinates of a set of providers
+# concurrently and returns once all of them have finished.
+#
+class ScenarioRunner(object):
+    def __init__(self, url: str, pool_size: int = 64, max_batch_size: int = 500, max_delay: float = 0.05):
+        self.url = url
+        self.pool_size = pool_size
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.session = None
+        self.publisher = None
+        self.started = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        self.session = aiohttp.ClientSession(connector=connector)
+        self.publisher = AsyncLocationPublisher(self.session, self.url, self.max_batch_size, self.max_delay,
+                                                max_in_flight=self.pool_size)
+        self.started = time.monotonic()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.publisher.flush()
+        await self.session.close()
+
+    async def get(self, path: str):
+        async with self.session.get(self.url + path) as response:
+            return await response.json()
+
+    async def post(self, path: str, body: str) -> int:
+        async with self.session.post(self.url + path, data=body,
+                                     headers={'Content-Type': 'application/json'}) as response:
+            await response.read()
+            return response.status
+
+    async def put(self, path: str, body: str) -> int:
+        async with self.session.put(self.url + path, data=body,
+                                    headers={'Content-Type': 'application/json'}) as response:
+            await response.read()
+            return response.status
+
+    #
+    # Create the given providers in the DeepHub, with at most pool_size requests in flight.
+    # Providers that exist already are left untouched.
+    #
+    async def create_providers(self, providers: list):
+        existing = set(await self.get('/providers'))
+        semaphore = asyncio.Semaphore(self.pool_size)
+
+        async def create(provider):
+            async with semaphore:
+                await self.post('/providers', provider.to_location_provider().to_json())
+
+        await asyncio.gather(*[create(p) for p in providers if p.id not in existing])
+
+    #
+    # Update the trackable at the given path such that it is attached to the provider with the given id.
+    #
+    async def attach_trackable(self, trackable_path: str, provider_id: str):
+        trackable = dh.Trackable(await self.get(trackable_path))
+        trackable.location_providers = [provider_id]
+        await self.put(trackable_path, trackable.to_json())
+
+    #
+    # Replay the coordinates of all given providers concurrently, one location every interval seconds.
+    #
+    async def drive(self, providers: list, interval: float = 0.05, reverse: bool = False):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        # Spread the providers evenly over one interval, so that their updates do not all fall on the same tick.
+        await asyncio.gather(*[self._replay(provider, start + interval * i / len(providers), interval, reverse)
+                               for i, provider in enumerate(providers)])
+        await self.publisher.flush()
+
+    async def _replay(self, provider: Provider, start: float, interval: float, reverse: bool):
+        loop = asyncio.get_running_loop()
+        location = provider.location
+        coordinates = provider.coordinates
+        if reverse:
+            coordinates = reversed(coordinates)
+        # Deadlines are derived from the start time and tick count, so that delays do not accumulate.
+        for tick, point in enumerate(coordinates):
+            deadline = start + tick * interval
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                provider.max_lag = max(provider.max_lag, -delay)
+            location.position = dh.Point(coordinates=point)
+            self.publisher.publish(location)
+            provider.updates += 1
+
+    def print_stats(self, providers: list = ()):
+        publisher = self.publisher
+        elapsed = time.monotonic() - self.started
+        print('Published {} updates in {} requests ({} failed), {:.1f} updates/s'.format(
+            publisher.updates_sent, publisher.requests_sent, publisher.requests_failed,
+            publisher.updates_sent / elapsed if elapsed > 0 else 0.0))
+        if publisher.requests_sent:
+            print('Mean request latency: {:.1f} ms'.format(publisher.latency_total / publisher.requests_sent * 1000))
+        if providers:
+            print('Max schedule lag: {:.1f} ms'.format(max(p.max_lag for p in providers) * 1000))
+
+
+#
+# Create copies of the example's truck and forklift providers. The first copy keeps the original provider ids.
+#
+def example_providers(copies: int):
+    truck, forklift_gps, forklift_uwb = [], [], []
+    for i in range(copies):
+        suffix = '' if i == 0 else '_' + str(i)
+        truck.append(Provider(provider_id_truck + suffix, 'gps', read_coordinates('truckGpsCoordinates.txt'),
+                              'Truck GPS' + suffix))
+        forklift_gps.append(Provider(provider_id_forklift_gps + suffix, 'gps',
+                                     read_coordinates('forkliftGpsCoordinates.txt'), 'Forklift GPS' + suffix))
+        forklift_uwb.append(Provider(provider_id_forklift_uwb + suffix, 'uwb',
+                                     read_coordinates('forkliftUwbCoordinates.txt'), 'Forklift UWB' + suffix))
+    return truck, forklift_gps, forklift_uwb
+
+
+#
+# The phases of the example: the pallet is loaded onto the truck, the vehicles drive,
+# the pallet is unloaded onto the forklift, and the vehicles drive back.
+#
+async def load(runner: ScenarioRunner, trackable_path: str):
+    await runner.attach_trackable(trackable_path, provider_id_truck)
+    await asyncio.sleep(1)
+
+
+async def unload(runner: ScenarioRunner, trackable_path: str):
+    await runner.attach_trackable(trackable_path, provider_id_forklift_uwb)
+    await asyncio.sleep(1)
+
+
+async def run_example(copies: int, interval: float, loops: int):
+    async with ScenarioRunner(url) as runner:
+        if len(await runner.get('/zones?foreign_id=' + zone_foreign_id)) == 0:
+            print('Could not find the example zone. Run deephub-rest-api-basics.py once to set up the example.')
+            return
+        trackable_path = '/trackables/' + (await runner.get('/trackables'))[0]
+
+        truck, forklift_gps, forklift_uwb = example_providers(copies)
+        providers = truck + forklift_gps + forklift_uwb
+        await runner.create_providers(providers)
+
+        print('Running the example scenario with', len(providers), 'providers.')
+        for _ in range(loops):
+            await load(runner, trackable_path)
+            await runner.drive(providers, interval)
+            await unload(runner, trackable_path)
+            await runner.drive(providers, interval, reverse=True)
+            runner.print_stats(providers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay the example scenario for many providers using asyncio.')
+    parser.add_argument('--copies', type=int, default=1,
+                        help='number of copies of the truck and forklift providers (default: 1)')
+    parser.add_argument('--interval', type=float, default=0.05,
+                        help='seconds between two location updates of a provider (default: 0.05)')
+    parser.add_argument('--loops', type=int, default=1, help='number of times to run the scenario (default: 1)')
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_example(args.copies, args.interval, args.loops))
+    except KeyboardInterrupt:
+        print('\nStopped')
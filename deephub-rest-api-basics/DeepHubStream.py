@@ -0,0 +1,365 @@
+import datetime
+import queue
+import random
+import threading
+import time
+import traceback
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import websocket
+
+try:
+    from orjson import loads
+except ImportError:
+    from ujson import loads
+
+# The topics subscribed to by default, as in websocket_client.py.
+DEFAULT_TOPICS = ('location_updates', 'fence_events', 'trackable_motions', 'collision_events')
+
+
+#
+# Decode a batch of raw WebSocket messages into (topic, payload) events.
+#
+# Each message of the DeepHub carries a list of payloads, e.g. several locations, which are flattened into one
+# event each. Control messages, like the confirmation of a subscription, are returned with topic None. Messages
+# that are no valid Json objects are counted as errors. This is a module-level function, so that it can be run in
+# a process pool.
+#
+def decode_messages(messages: list):
+    events, errors = [], 0
+    for message in messages:
+        try:
+            message = loads(message)
+        except ValueError:
+            errors += 1
+            continue
+        if type(message) is not dict:
+            errors += 1
+            continue
+        if message.get('event') != 'message':
+            events.append((None, message))
+            continue
+        topic = message.get('topic')
+        payload = message.get('payload')
+        if type(payload) is list:
+            events.extend((topic, item) for item in payload)
+        else:
+            events.append((topic, payload))
+    return events, errors
+
+
+#
+# A sink calling the given function with every batch of events.
+#
+class CallbackSink(object):
+    def __init__(self, callback):
+        self.callback = callback
+        self.dropped = 0
+
+    def handle(self, batch: list):
+        self.callback(batch)
+
+
+#
+# A sink handing batches of events to another thread through a bounded queue.
+# If the consumer of the queue falls behind, new batches are dropped and counted instead of blocking the stream.
+#
+class QueueSink(object):
+    def __init__(self, maxsize: int = 1000):
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def handle(self, batch: list):
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            self.dropped += len(batch)
+
+    def get(self, timeout: float = None) -> list:
+        return self.queue.get(timeout=timeout)
+
+
+#
+# A sink appending every event as a line of Json to a file.
+#
+class FileSink(object):
+    def __init__(self, file: str, topics=None):
+        from ujson import dumps
+        self._dumps = dumps
+        self.output = open(file, 'a')
+        self.topics = set(topics) if topics else None
+        self.dropped = 0
+
+    def handle(self, batch: list):
+        dumps, topics = self._dumps, self.topics
+        self.output.write(''.join(dumps({'topic': topic, 'payload': payload}) + '\n'
+                                  for topic, payload in batch if topics is None or topic in topics))
+
+    def close(self):
+        self.output.close()
+
+
+#
+# Consumes the WebSocket API of the DeepHub at a high rate.
+#
+# A dedicated I/O thread only reads raw messages from the socket into a bounded buffer. A dispatch thread takes
+# them out in batches, decodes them with a fast Json decoder, optionally in a process pool, and hands each batch
+# of (topic, payload) events to all registered sinks.
+#
+# When the buffer is full, the I/O thread stops reading, so that the backpressure reaches the DeepHub through the
+# socket. With drop_when_full=True, new messages are dropped and counted instead.
+#
+# When the connection drops, the consumer reconnects with jittered exponential backoff between min_backoff and
+# max_backoff seconds and subscribes to all topics again. Every outage is recorded with its duration and an
+# estimate of the events missed, based on the event rate before the outage.
+#
+class StreamConsumer(object):
+    def __init__(self, ws_url: str, topics=DEFAULT_TOPICS, batch_size: int = 256, batch_delay: float = 0.05,
+                 buffer_size: int = 10000, drop_when_full: bool = False, parse_workers: int = 0,
+                 ping_interval: float = 30, min_backoff: float = 0.5, max_backoff: float = 30,
+                 outage_history: int = 100):
+        self.ws_url = ws_url
+        self.topics = list(topics)
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.drop_when_full = drop_when_full
+        self.parse_workers = parse_workers
+        self.ping_interval = ping_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.sinks = []
+
+        self._buffer = queue.Queue(buffer_size)
+        self._running = threading.Event()
+        self._stopped = threading.Event()
+        self._ws = None
+        self._threads = []
+
+        # Counters, readable at any time. lag is the time the last delivered batch waited in the buffer.
+        self.received = 0
+        self.dropped = 0
+        self.events = 0
+        self.errors = 0
+        # Control messages other than subscription confirmations, e.g. the errors of rejected subscriptions.
+        self.hub_errors = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        # The exceptions raised by each sink, by sink. A failing sink does not stop the delivery to the others.
+        self.sink_errors = defaultdict(int)
+
+        # Connection metrics. Each outage is a dict with its start and end (UTC), duration and missed estimate.
+        self.connected = False
+        self.connects = 0
+        self.disconnects = 0
+        self.downtime = 0.0
+        self.missed_estimate = 0.0
+        self.outages = deque(maxlen=outage_history)
+        self._disconnected_at = None
+        self._rate = 0.0
+
+    #
+    # Register a sink. Either an object with a handle(batch) method, or a function taking the batch.
+    # Sinks may count the events they drop in a dropped attribute, which is added to the dropped counter.
+    #
+    def add_sink(self, sink):
+        if not hasattr(sink, 'handle'):
+            sink = CallbackSink(sink)
+        self.sinks.append(sink)
+        return sink
+
+    def counters(self) -> dict:
+        return {
+            'received': self.received,
+            'dropped': self.dropped + sum(getattr(sink, 'dropped', 0) for sink in self.sinks),
+            'events': self.events,
+            'errors': self.errors,
+            'hub_errors': self.hub_errors,
+            'sink_errors': sum(self.sink_errors.values()),
+            'buffered': self._buffer.qsize(),
+            'lag': self.lag,
+            'max_lag': self.max_lag,
+            'connected': self.connected,
+            'reconnects': max(0, self.connects - 1),
+            'downtime': self.downtime + self._current_downtime(),
+            'missed_estimate': self.missed_estimate + self._current_downtime() * self._rate,
+        }
+
+    def start(self):
+        self._running.set()
+        self._stopped.clear()
+        self._threads = [threading.Thread(target=self._read, daemon=True),
+                         threading.Thread(target=self._dispatch, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._running.clear()
+        self._stopped.set()
+        if self._ws is not None:
+            self._ws.abort()
+        for thread in self._threads:
+            thread.join()
+
+    def run_forever(self):
+        self.start()
+        try:
+            while self._threads[0].is_alive():
+                self._threads[0].join(1)
+        finally:
+            self.stop()
+
+    def _connect(self):
+        ws = websocket.create_connection(self.ws_url, enable_multithread=True)
+        for topic in self.topics:
+            ws.send('{"event": "subscribe", "topic": "' + topic + '"}')
+        return ws
+
+    def _read(self):
+        attempt = 0
+        while self._running.is_set():
+            try:
+                ws = self._connect()
+            except (websocket.WebSocketException, OSError) as error:
+                attempt += 1
+                delay = self._backoff(attempt)
+                print('Could not connect to {} ({}), retrying in {:.1f} s'.format(
+                    self.ws_url, type(error).__name__, delay))
+                self._stopped.wait(delay)
+                continue
+            attempt = 0
+            self._on_connected(ws)
+            try:
+                self._read_messages(ws)
+            except (websocket.WebSocketException, OSError):
+                pass
+            finally:
+                ws.close()
+            if self._running.is_set():
+                print('### Connection to ' + self.ws_url + ' was closed.')
+                self._on_disconnected()
+
+    # The delay before the given reconnect attempt, doubling with every attempt, with full jitter.
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(self.min_backoff, min(self.max_backoff, self.min_backoff * 2 ** attempt))
+
+    def _read_messages(self, ws):
+        connected = time.monotonic()
+        events = self.events
+        last_ping = connected
+        ws.settimeout(self.ping_interval or None)
+        while self._running.is_set():
+            try:
+                message = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                message = None
+            now = time.monotonic()
+            if self.ping_interval and now - last_ping >= self.ping_interval:
+                ws.ping()
+                last_ping = now
+            if not ws.connected:
+                raise websocket.WebSocketConnectionClosedException('Connection closed by the DeepHub')
+            if now > connected:
+                self._rate = (self.events - events) / (now - connected)
+            if not message:
+                continue
+            self.received += 1
+            self._buffer_message(message)
+
+    def _on_connected(self, ws):
+        self._ws = ws
+        self.connected = True
+        self.connects += 1
+        if self._disconnected_at is None:
+            return
+        duration = self._current_downtime()
+        missed = duration * self._rate
+        end = datetime.datetime.utcnow()
+        self.outages.append({'start': end - datetime.timedelta(seconds=duration), 'end': end,
+                             'duration': duration, 'missed_estimate': missed})
+        self.downtime += duration
+        self.missed_estimate += missed
+        self._disconnected_at = None
+        print('Reconnected to {} after {:.1f} s, about {:.0f} events missed'.format(self.ws_url, duration, missed))
+
+    def _on_disconnected(self):
+        self.connected = False
+        self.disconnects += 1
+        self._disconnected_at = time.monotonic()
+
+    def _current_downtime(self) -> float:
+        disconnected_at = self._disconnected_at
+        return 0.0 if disconnected_at is None else time.monotonic() - disconnected_at
+
+    def _buffer_message(self, message):
+        item = (time.monotonic(), message)
+        if self.drop_when_full:
+            try:
+                self._buffer.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+            return
+        while self._running.is_set():
+            try:
+                self._buffer.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    # Collect up to batch_size messages, waiting at most batch_delay after the first one.
+    def _next_batch(self) -> list:
+        try:
+            batch = [self._buffer.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._buffer.get(timeout=remaining) if remaining > 0 else self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch(self):
+        pool = ProcessPoolExecutor(self.parse_workers) if self.parse_workers else None
+        # Batches decoded in the pool are delivered in the order they were received.
+        pending = deque()
+        try:
+            while self._running.is_set() or pending:
+                batch = self._next_batch() if self._running.is_set() else []
+                if batch:
+                    received = batch[0][0]
+                    messages = [message for _, message in batch]
+                    if pool is None:
+                        self._deliver(received, *decode_messages(messages))
+                        continue
+                    pending.append((received, pool.submit(decode_messages, messages)))
+                while pending and (pending[0][1].done() or len(pending) > self.parse_workers * 2 or not batch):
+                    received, future = pending.popleft()
+                    self._deliver(received, *future.result())
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    def _deliver(self, received: float, events: list, errors: int):
+        self.errors += errors
+        for topic, message in events:
+            if topic is None and message.get('event') != 'subscribed':
+                self.hub_errors += 1
+                print('DeepHub:', message)
+        events = [event for event in events if event[0] is not None]
+        if events:
+            for sink in self.sinks:
+                try:
+                    sink.handle(events)
+                except Exception:
+                    # Only the first failure of each sink is printed, the others are counted.
+                    if not self.sink_errors[sink]:
+                        print('Sink {!r} failed, counting further failures:'.format(sink))
+                        traceback.print_exc()
+                    self.sink_errors[sink] += 1
+            self.events += len(events)
+        self.lag = time.monotonic() - received
+        self.max_lag = max(self.max_lag, self.lag)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import struct
+
+# The file suffix of binary trajectory files.
+TRAJECTORY_SUFFIX = '.dhtr'
+
+# The binary trajectory format is a fixed size header followed by the points as little-endian float64 values,
+# one row of `dimensions` values per point. The header holds:
+# magic, format version, flags, dimensions, point count, provider type and coordinate reference system.
+# With the TIMESTAMPED flag, every row starts with one more value, the time of the point in seconds since the
+# epoch. Data beyond the point count of the header is ignored, so that files can be appended to safely.
+MAGIC = b'DHTR'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIQ8s36s')
+HEADER_SIZE = HEADER.size  # 64 bytes, which keeps the float64 data aligned.
+
+# The crs stored for trajectories of providers that report zone-local coordinates.
+LOCAL_CRS = 'local'
+
+# The header flags.
+TIMESTAMPED = 0x1
+
+
+#
+# Convert a comma separated coordinate file, like truckGpsCoordinates.txt, into a binary trajectory file.
+# The input is streamed, so memory use does not depend on the length of the trace.
+#
+def convert(csv_file: str, trajectory_file: str, provider_type: str, crs: str = None) -> int:
+    if crs is None:
+        crs = 'EPSG:4326' if provider_type == 'gps' else LOCAL_CRS
+    # Fail before writing anything if the provider type or crs do not fit into the header.
+    _pack_header(0, 0, provider_type, crs)
+    count, dimensions = 0, 0
+    with open(csv_file) as input, open(trajectory_file, 'wb') as output:
+        output.write(bytes(HEADER_SIZE))
+        for line in input:
+            if not line.strip():
+                continue
+            coordinates = [float(value) for value in line.split(sep=',')]
+            if dimensions == 0:
+                dimensions = len(coordinates)
+            elif len(coordinates) != dimensions:
+                raise ValueError('{}: line {} has {} coordinates, expected {}'.format(
+                    csv_file, count + 1, len(coordinates), dimensions))
+            output.write(struct.pack('<%dd' % dimensions, *coordinates))
+            count += 1
+        # The point count is only known at the end, so the header is written last.
+        output.seek(0)
+        output.write(_pack_header(dimensions or 2, count, provider_type, crs))
+    return count
+
+
+def _pack_header(dimensions: int, count: int, provider_type: str, crs: str, flags: int = 0) -> bytes:
+    return HEADER.pack(MAGIC, VERSION, flags, dimensions, count,
+                       _header_field('provider type', provider_type, 8), _header_field('crs', crs, 36))
+
+
+# The provider type and crs are stored as fixed size ASCII fields, which struct would silently truncate.
+def _header_field(name: str, value: str, size: int) -> bytes:
+    data = value.encode('ascii')
+    if len(data) > size:
+        raise ValueError('The {} {!r} is longer than {} bytes'.format(name, value, size))
+    return data
+
+
+def _unpack_header(trajectory_file: str, data: bytes) -> tuple:
+    magic, version, flags, dimensions, count, provider_type, crs = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError(trajectory_file + ' is not a trajectory file')
+    if version != VERSION:
+        raise ValueError('{}: unsupported trajectory format version {}'.format(trajectory_file, version))
+    return flags, dimensions, count, provider_type.rstrip(b'\0').decode('ascii'), crs.rstrip(b'\0').decode('ascii')
+
+
+#
+# Appends timestamped points to a trajectory file.
+#
+# Points are written as they are appended, but only become part of the trajectory when sync() updates the point
+# count in the header, after the points themselves have been flushed to disk. A crash therefore loses at most the
+# points since the last sync, and never leaves partially written points in the trajectory. An existing file is
+# continued after its last synced point.
+#
+class TrajectoryWriter(object):
+    def __init__(self, trajectory_file: str, provider_type: str, crs: str, dimensions: int = 2):
+        self.file = trajectory_file
+        if os.path.exists(trajectory_file) and os.path.getsize(trajectory_file) >= HEADER_SIZE:
+            self.output = open(trajectory_file, 'r+b')
+            try:
+                flags, self.dimensions, self.count, self.provider_type, self.crs = \
+                    _unpack_header(trajectory_file, self.output.read(HEADER_SIZE))
+                if not flags & TIMESTAMPED:
+                    raise ValueError(trajectory_file + ' is not a timestamped trajectory file')
+                self.output.seek(HEADER_SIZE + self.count * (self.dimensions + 1) * 8)
+                self.output.truncate()
+            except BaseException:
+                self.output.close()
+                raise
+        else:
+            self.dimensions, self.count, self.provider_type, self.crs = dimensions, 0, provider_type, crs
+            header = self._header()
+            self.output = open(trajectory_file, 'w+b')
+            # Readers of a live recording see an empty trajectory until the first sync, instead of a partial header.
+            self.output.write(header)
+            self.output.flush()
+        self._row = struct.Struct('<%dd' % (self.dimensions + 1))
+        self.pending = 0
+
+    def append(self, timestamp: float, coordinates):
+        if len(coordinates) != self.dimensions:
+            raise ValueError('{}: {} coordinates given, expected {}'.format(
+                self.file, len(coordinates), self.dimensions))
+        self.output.write(self._row.pack(timestamp, *coordinates))
+        self.pending += 1
+
+    def sync(self):
+        if not self.pending:
+            return
+        self.output.flush()
+        os.fsync(self.output.fileno())
+        self.count += self.pending
+        self.pending = 0
+        end = self.output.tell()
+        self.output.seek(0)
+        self.output.write(self._header())
+        self.output.flush()
+        os.fsync(self.output.fileno())
+        self.output.seek(end)
+
+    def close(self):
+        self.sync()
+        self.output.close()
+
+    def _header(self) -> bytes:
+        return _pack_header(self.dimensions, self.count, self.provider_type, self.crs, TIMESTAMPED)
+
+
+#
+# A memory-mapped binary trajectory file.
+#
+# The points are exposed as a read-only (count, dimensions) NumPy array backed by the mapped file, so opening
+# a trajectory and iterating over it in either direction does not copy the data. The timestamps of a timestamped
+# trajectory are exposed the same way, and are None otherwise.
+#
+class Trajectory(object):
+    def __init__(self, trajectory_file: str):
+        # NumPy is only needed for reading, so that the tools writing trajectories start without it.
+        import numpy as np
+        self.file = trajectory_file
+        with open(trajectory_file, 'rb') as input:
+            self.flags, self.dimensions, self.count, self.provider_type, self.crs = \
+                _unpack_header(trajectory_file, input.read(HEADER_SIZE))
+        timestamped = bool(self.flags & TIMESTAMPED)
+        columns = self.dimensions + timestamped
+        if self.count:
+            rows = np.memmap(trajectory_file, dtype='<f8', mode='r', offset=HEADER_SIZE, shape=(self.count, columns))
+        else:
+            rows = np.empty((0, columns))
+        self.points = rows[:, timestamped:]
+        self.timestamps = rows[:, 0] if timestamped else None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.points)
+
+    def __reversed__(self):
+        return iter(self.points[::-1])
+
+    # The mapping is released once neither the trajectory nor any point taken from it is referenced anymore.
+    def close(self):
+        self.points = self.timestamps = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+#
+# The chunk files of a provider recorded into the given directory, in the order they were written.
+#
+def chunk_files(directory: str, provider_id: str) -> list:
+    prefix = provider_id + '.'
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.startswith(prefix) and name.endswith(TRAJECTORY_SUFFIX)
+                  and name[len(prefix):-len(TRAJECTORY_SUFFIX)].isdigit())
+
+
+def chunk_file(directory: str, provider_id: str, index: int) -> str:
+    return os.path.join(directory, '{}.{:04d}{}'.format(provider_id, index, TRAJECTORY_SUFFIX))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a comma separated coordinate file into a binary '
+                                                 'trajectory file for replay.')
+    parser.add_argument('input', help='comma separated coordinate file, e.g. truckGpsCoordinates.txt')
+    parser.add_argument('output', help='binary trajectory file, e.g. truckGpsCoordinates' + TRAJECTORY_SUFFIX)
+    parser.add_argument('--type', default='gps', choices=['gps', 'uwb'],
+                        help='the type of the provider the coordinates belong to (default: gps)')
+    parser.add_argument('--crs', help='the coordinate reference system (default: EPSG:4326 for gps, '
+                                      + LOCAL_CRS + ' otherwise)')
+    args = parser.parse_args()
+    print('Converted', convert(args.input, args.output, args.type, args.crs), 'points.')
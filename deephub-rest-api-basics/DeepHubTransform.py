@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+import argparse
+import math
+import threading
+
+import numpy as np
+
+from DeepHubClasses import METERS_PER_DEGREE
+
+
+#
+# Split ground control points into arrays of WGS84 and zone-local coordinates.
+#
+# Accepts the flat list of alternating WGS84 and local coordinates of DeepHubClasses.default_ground_control_points,
+# as well as a list of dicts with 'wgs84' and 'local' entries, where 'wgs84' may also be a Point.
+#
+def split_ground_control_points(ground_control_points) -> tuple:
+    if ground_control_points and isinstance(ground_control_points[0], dict):
+        wgs84 = [point['wgs84']['coordinates'] if isinstance(point['wgs84'], dict) else point['wgs84']
+                 for point in ground_control_points]
+        local = [point['local'] for point in ground_control_points]
+    else:
+        wgs84, local = ground_control_points[0::2], ground_control_points[1::2]
+    return np.asarray(wgs84, dtype=float)[:, :2], np.asarray(local, dtype=float)[:, :2]
+
+
+#
+# A transform between the local coordinates of a zone, in meters, and WGS84, fitted to the zone's ground control
+# points.
+#
+# WGS84 coordinates are first mapped to a plane tangent at the center of the ground control points, in meters,
+# which is accurate at the size of a zone. An affine (at least 3 points) or projective (at least 4 points) transform
+# is then fitted by least squares between the local coordinates and this plane. All conversions take and return
+# arrays of shape (..., 2), so that whole trajectories are converted in one call.
+#
+class ZoneTransform(object):
+    def __init__(self, ground_control_points, model: str = 'affine'):
+        wgs84, local = split_ground_control_points(ground_control_points)
+        minimum = {'affine': 3, 'projective': 4}.get(model)
+        if minimum is None:
+            raise ValueError('Unknown transform model ' + model)
+        if len(local) < minimum:
+            raise ValueError('A {} transform requires at least {} ground control points'.format(model, minimum))
+        self.model = model
+        self.origin = wgs84.mean(axis=0)
+        # Meters per degree of longitude and latitude at the origin.
+        self.scale = np.array([math.cos(math.radians(self.origin[1])) * METERS_PER_DEGREE, METERS_PER_DEGREE])
+        plane = self._to_plane(wgs84)
+        self.matrix = _fit_affine(local, plane) if model == 'affine' else _fit_projective(local, plane)
+        self.inverse = np.linalg.inv(self.matrix)
+        # The root mean square error at the ground control points, in meters.
+        self.residual = float(np.sqrt(np.mean(np.sum((_apply(self.matrix, local) - plane) ** 2, axis=-1))))
+
+    def to_wgs84(self, local) -> np.ndarray:
+        return self._from_plane(_apply(self.matrix, np.asarray(local, dtype=float)[..., :2]))
+
+    def to_local(self, wgs84) -> np.ndarray:
+        return _apply(self.inverse, self._to_plane(np.asarray(wgs84, dtype=float)[..., :2]))
+
+    def _to_plane(self, wgs84: np.ndarray) -> np.ndarray:
+        return (wgs84 - self.origin) * self.scale
+
+    def _from_plane(self, plane: np.ndarray) -> np.ndarray:
+        return plane / self.scale + self.origin
+
+
+# Apply a 3x3 homogeneous transform to points of shape (..., 2).
+def _apply(matrix: np.ndarray, points: np.ndarray) -> np.ndarray:
+    result = points @ matrix[:2, :2].T + matrix[:2, 2]
+    if matrix[2, 0] or matrix[2, 1]:
+        result /= (points @ matrix[2, :2] + matrix[2, 2])[..., np.newaxis]
+    return result
+
+
+def _fit_affine(source: np.ndarray, target: np.ndarray) -> np.ndarray:
+    design = np.column_stack([source, np.ones(len(source))])
+    solution = np.linalg.lstsq(design, target, rcond=None)[0]
+    return np.vstack([solution.T, [0.0, 0.0, 1.0]])
+
+
+# Direct linear transform, with both point sets normalized for numerical stability.
+def _fit_projective(source: np.ndarray, target: np.ndarray) -> np.ndarray:
+    def normalization(points):
+        center = points.mean(axis=0)
+        scale = math.sqrt(2) / max(np.mean(np.linalg.norm(points - center, axis=1)), 1e-12)
+        return np.array([[scale, 0, -scale * center[0]], [0, scale, -scale * center[1]], [0, 0, 1]])
+
+    source_norm, target_norm = normalization(source), normalization(target)
+    s = _apply(source_norm, source)
+    t = _apply(target_norm, target)
+    rows = []
+    for (x, y), (u, v) in zip(s, t):
+        rows.append([-x, -y, -1, 0, 0, 0, u * x, u * y, u])
+        rows.append([0, 0, 0, -x, -y, -1, v * x, v * y, v])
+    matrix = np.linalg.svd(np.asarray(rows))[2][-1].reshape(3, 3)
+    matrix = np.linalg.inv(target_norm) @ matrix @ source_norm
+    return matrix / matrix[2, 2]
+
+
+#
+# Fits the transform of each zone once and caches it by zone id.
+#
+# Zones are taken from an EntityRegistry, if given, and are identified by id or foreign_id. A cached transform is
+# fitted again if the ground control points of its zone change.
+#
+class TransformCache(object):
+    def __init__(self, registry=None, model: str = 'affine'):
+        self.registry = registry
+        self.model = model
+        self._transforms = {}
+        self._lock = threading.Lock()
+
+    def get(self, zone_id: str, ground_control_points=None) -> ZoneTransform:
+        if ground_control_points is None:
+            ground_control_points = self._zone(zone_id)['ground_control_points']
+        key = repr(ground_control_points)
+        with self._lock:
+            cached = self._transforms.get(zone_id)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        transform = ZoneTransform(ground_control_points, self.model)
+        with self._lock:
+            self._transforms[zone_id] = (key, transform)
+        return transform
+
+    def to_wgs84(self, zone_id: str, local) -> np.ndarray:
+        return self.get(zone_id).to_wgs84(local)
+
+    def to_local(self, zone_id: str, wgs84) -> np.ndarray:
+        return self.get(zone_id).to_local(wgs84)
+
+    def _zone(self, zone_id: str) -> dict:
+        if self.registry is None:
+            raise KeyError('No ground control points given for zone ' + zone_id)
+        zone = self.registry.get('zones', zone_id)
+        if zone is None:
+            zones = self.registry.find('zones', foreign_id=zone_id)
+            if not zones:
+                raise KeyError('No zone ' + zone_id)
+            zone = zones[0]
+        return zone
+
+
+def read_coordinates(file: str) -> np.ndarray:
+    return np.loadtxt(file, delimiter=',', ndmin=2)
+
+
+if __name__ == '__main__':
+    import DeepHubClasses as dh
+
+    parser = argparse.ArgumentParser(description="Project a zone-local trajectory to WGS84 using the example zone's "
+                                                 'ground control points.')
+    parser.add_argument('input', help='comma separated zone-local coordinates, e.g. forkliftUwbCoordinates.txt')
+    parser.add_argument('--output', help='write the WGS84 coordinates to this file')
+    parser.add_argument('--compare', help='WGS84 trajectory of the same movement to compare with, '
+                                          'e.g. forkliftGpsCoordinates.txt')
+    parser.add_argument('--model', default='affine', choices=['affine', 'projective'],
+                        help='the transform model (default: affine)')
+    args = parser.parse_args()
+
+    transform = ZoneTransform(dh.default_ground_control_points, args.model)
+    print('Fitted {} transform, residual at the ground control points: {:.3f} m'.format(
+        args.model, transform.residual))
+    projected = transform.to_wgs84(read_coordinates(args.input))
+    if args.output:
+        np.savetxt(args.output, projected, fmt='%.15g', delimiter=', ')
+    if args.compare:
+        reference = read_coordinates(args.compare)
+        count = min(len(reference), len(projected))
+        distances = np.linalg.norm((projected[:count] - reference[:count]) * transform.scale, axis=1)
+        print('Distance to {} over {} points: mean {:.2f} m, max {:.2f} m'.format(
+            args.compare, count, distances.mean(), distances.max()))
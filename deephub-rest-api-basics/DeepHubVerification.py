@@ -0,0 +1,153 @@
+import bisect
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+import requests as rest
+
+# The upper bounds of the buckets of the latency histogram, in seconds.
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, float('inf'))
+
+
+# Published and received locations are matched by provider and position, rounded to about a centimeter.
+def _key(provider_id: str, coordinates) -> tuple:
+    return (provider_id, round(coordinates[0], 7), round(coordinates[1], 7))
+
+
+#
+# Measures the write-to-visible latency of location updates, from publishing a location until the DeepHub
+# reports it, off the hot path of the publisher.
+#
+# published() samples one in sample_every locations and only records the time and key of the sample, which is
+# cheap enough to call for every update. Samples are then matched by provider and position, either with the
+# location_updates of a StreamConsumer, by adding the monitor as a sink, or, if a url is given and the monitor is
+# started, by polling the latest locations of all providers from a background thread over the monitor's session.
+# Samples not seen within timeout seconds are counted as lost. Polling only sees the latest location of each
+# provider, so it loses the samples that are superseded, e.g. within the same batch, before the next poll.
+#
+# The latencies of the last window samples are kept for percentiles, and all of them in a fixed histogram.
+#
+class PropagationMonitor(object):
+    def __init__(self, url: str = None, sample_every: int = 10, window: int = 10000, timeout: float = 5.0,
+                 poll_interval: float = 0.01):
+        self.url = url
+        self.sample_every = sample_every
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.session = rest.Session()
+        self.latencies = deque(maxlen=window)
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+        self._published = itertools.count(1)
+        self.sampled = 0
+        self.matched = 0
+        self.lost = 0
+        # As a sink of a StreamConsumer, the monitor never drops events.
+        self.dropped = 0
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    #
+    # Record a location just handed to the publisher. Only every sample_every-th call takes a sample.
+    #
+    def published(self, location):
+        if next(self._published) % self.sample_every:
+            return
+        key = _key(location.provider_id, location.position.coordinates)
+        now = time.monotonic()
+        with self._lock:
+            self.sampled += 1
+            self._pending[key] = now
+            self._expire(now)
+
+    #
+    # Handle a batch of (topic, payload) events of a StreamConsumer.
+    #
+    def handle(self, batch: list):
+        now = time.monotonic()
+        with self._lock:
+            if not self._pending:
+                return
+            for topic, location in batch:
+                if topic != 'location_updates':
+                    continue
+                try:
+                    key = _key(location['provider_id'], location['position']['coordinates'])
+                except (KeyError, TypeError, IndexError):
+                    continue
+                self._match(key, now)
+
+    #
+    # Start polling the DeepHub for the sampled locations, for when no WebSocket connection is available.
+    #
+    def start(self):
+        self._running.set()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running.clear()
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies)
+            histogram = list(self.histogram)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+
+        return {'sampled': self.sampled, 'matched': self.matched, 'lost': self.lost, 'pending': len(self._pending),
+                'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99),
+                'max': latencies[-1] if latencies else 0.0,
+                'histogram': dict(zip(LATENCY_BUCKETS, histogram))}
+
+    def print_stats(self):
+        stats = self.stats()
+        print('Write-to-visible latency of {} samples ({} lost): p50 {:.1f} ms, p90 {:.1f} ms, p99 {:.1f} ms, '
+              'max {:.1f} ms'.format(stats['matched'], stats['lost'], stats['p50'] * 1000, stats['p90'] * 1000,
+                                     stats['p99'] * 1000, stats['max'] * 1000))
+        print('  ' + ', '.join('<{:g} ms: {}'.format(bound * 1000, count)
+                               for bound, count in stats['histogram'].items() if count))
+
+    # Must be called while holding self._lock.
+    def _match(self, key: tuple, now: float) -> bool:
+        published = self._pending.pop(key, None)
+        if published is None:
+            return False
+        latency = now - published
+        self.matched += 1
+        self.latencies.append(latency)
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+        return True
+
+    # Must be called while holding self._lock. Samples are pending in the order they were taken.
+    def _expire(self, now: float):
+        pending = self._pending
+        while pending:
+            key, published = next(iter(pending.items()))
+            if now - published < self.timeout:
+                break
+            del pending[key]
+            self.lost += 1
+
+    # Poll the latest locations of all providers with one request, while samples are pending.
+    def _poll(self):
+        while self._running.is_set():
+            with self._lock:
+                self._expire(time.monotonic())
+                pending = bool(self._pending)
+            if pending:
+                try:
+                    locations = self.session.get(self.url + '/providers/locations').json()
+                except (rest.RequestException, ValueError):
+                    locations = []
+                self.handle([('location_updates', location) for location in locations])
+            self._stopped.wait(self.poll_interval)
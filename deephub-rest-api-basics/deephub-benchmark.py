@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import datetime
+import importlib.util
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import DeepHubClasses as dh
+from DeepHubMock import MockDeepHub
+from DeepHubFilter import DeadbandFilter
+from DeepHubPublisher import LocationPublisher, WriteBehindPublisher
+from DeepHubReplay import ReplayScheduler
+from DeepHubVerification import PropagationMonitor
+
+
+#
+# Import deephub-rest-api-basics.py as a module, to benchmark its functions unchanged.
+#
+def load_example():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deephub-rest-api-basics.py')
+    spec = importlib.util.spec_from_file_location('deephub_rest_api_basics', path)
+    example = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(example)
+    return example
+
+
+#
+# Run the mock DeepHub in a separate process, so that its CPU time is not accounted to the client.
+#
+def _serve_mock(delay: float, urls):
+    hub = MockDeepHub(delay=delay)
+    urls.put((hub.url, hub.ws_url))
+    hub.server.serve_forever()
+
+
+@contextlib.contextmanager
+def mock_deephub(delay: float):
+    urls = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve_mock, args=(delay, urls), daemon=True)
+    process.start()
+    try:
+        yield urls.get(timeout=10)
+    finally:
+        process.terminate()
+        process.join()
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+#
+# Counts the location updates received over the WebSocket API and their delivery lag, using the StreamConsumer
+# like websocket_client.py.
+#
+class WebSocketCounter(object):
+    def __init__(self, ws_url: str):
+        from DeepHubStream import StreamConsumer
+        self.events = 0
+        self.lags = []
+        self.consumer = StreamConsumer(ws_url, topics=['location_updates'])
+        self.consumer.add_sink(self._handle)
+
+    def start(self):
+        self.consumer.start()
+        # Wait for the subscription to be in place before publishing.
+        time.sleep(0.5)
+
+    def stop(self):
+        self.consumer.stop()
+
+    def _handle(self, batch: list):
+        now = datetime.datetime.utcnow()
+        for _, location in batch:
+            self.events += 1
+            sent = datetime.datetime.strptime(location['timestamp_sent'], '%Y-%m-%dT%H:%M:%S.%fZ')
+            self.lags.append((now - sent).total_seconds())
+
+
+#
+# Run send_location_updates, or send_location_updates_fakedata, for the given number of providers against the
+# mock DeepHub, and report the achieved throughput, request latency, CPU time and memory use of the client.
+#
+def benchmark_publish(providers: int, rate: float, file: str, fakedata: bool, websocket: bool, delay: float,
+                      speed: float = 1.0, max_throughput: bool = False, verify: str = None, sample_every: int = 10,
+                      deadband: float = 0.0, max_silence: float = 5.0):
+    example = load_example()
+    with mock_deephub(delay) as (url, ws_url):
+        example.url = url
+        example.scheduler = ReplayScheduler(rate=rate, speed=speed, max_throughput=max_throughput)
+        publisher = LocationPublisher(url, pool_size=providers)
+        example.publisher = DeadbandFilter(publisher, deadband, max_silence=max_silence) if deadband else publisher
+        counter = WebSocketCounter(ws_url) if websocket or verify == 'websocket' else None
+        if verify:
+            example.monitor = PropagationMonitor(url, sample_every=sample_every)
+            if deadband:
+                example.publisher.monitor = example.monitor
+            if verify == 'websocket':
+                counter.consumer.add_sink(example.monitor)
+            else:
+                example.monitor.start()
+        if counter:
+            counter.start()
+
+        if fakedata:
+            threads = [threading.Thread(target=example.send_location_updates_fakedata,
+                                        args=['BENCHMARK_PROVIDER_' + str(i), 'gps'])
+                       for i in range(providers)]
+        else:
+            threads = [threading.Thread(target=example.send_location_updates,
+                                        args=['BENCHMARK_PROVIDER_' + str(i), 'gps', file])
+                       for i in range(providers)]
+
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        example.publisher.close()
+        elapsed = time.monotonic() - start
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        if counter or verify:
+            # Give the mock a moment to deliver the last updates.
+            time.sleep(0.5)
+        if counter:
+            counter.stop()
+        if verify == 'poll':
+            example.monitor.stop()
+
+    stats = publisher.stats()
+    latencies = list(publisher.latencies)
+    cpu = (usage.ru_utime - usage_before.ru_utime) + (usage.ru_stime - usage_before.ru_stime)
+    schedule = example.scheduler.stats().values()
+    print('Providers: {}, rate: {}, source: {}'.format(
+        providers, 'max throughput' if max_throughput else '{:.1f} Hz x {:g}'.format(rate, speed),
+        'fake data' if fakedata else file))
+    print('Updates: {} in {:.1f} s, {:.1f} updates/s, {} requests ({} failed), {:.1f} kB'.format(
+        stats['updates'], elapsed, stats['updates'] / elapsed, stats['requests'], stats['failed'],
+        stats['bytes'] / 1024))
+    if deadband:
+        filtered = example.publisher.stats()
+        print('Dead-band: {forwarded} of {received} updates forwarded, {suppressed} suppressed, {coalesced} '
+              'coalesced, about {bytes_saved} bytes saved'.format(**filtered))
+    print('Request latency: p50 {:.1f} ms, p99 {:.1f} ms'.format(
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000))
+    print('Schedule lag: mean {:.1f} ms, max {:.1f} ms'.format(
+        sum(stats['mean_lag'] for stats in schedule) / max(len(schedule), 1) * 1000,
+        max((stats['max_lag'] for stats in schedule), default=0.0) * 1000))
+    print('CPU: {:.2f} s ({:.0f}% of one core), peak RSS: {:.1f} MB'.format(
+        cpu, cpu / elapsed * 100, usage.ru_maxrss / 1024))
+    if counter:
+        print('WebSocket: {} events, {:.1f} events/s, delivery lag p50 {:.1f} ms, p99 {:.1f} ms'.format(
+            counter.events, counter.events / elapsed,
+            percentile(counter.lags, 0.5) * 1000, percentile(counter.lags, 0.99) * 1000))
+    if verify:
+        example.monitor.print_stats()
+
+
+#
+# Publish location updates to an in-process mock DeepHub while it repeatedly drops all WebSocket connections and
+# refuses new ones for a while. Reports how the StreamConsumer reconnects and how well it estimates the gaps.
+#
+def benchmark_reconnect(providers: int, rate: float, duration: float, every: float, outage: float):
+    from DeepHubStream import StreamConsumer
+    with MockDeepHub() as hub:
+        consumer = StreamConsumer(hub.ws_url, topics=['location_updates'], min_backoff=0.1, max_backoff=outage)
+        consumer.start()
+        time.sleep(0.5)
+        publisher = LocationPublisher(hub.url, pool_size=1)
+        locations = [dh.Location(provider_id='BENCHMARK_PROVIDER_' + str(i), provider_type='gps')
+                     for i in range(providers)]
+        published, tick = 0, 0
+        start = time.monotonic()
+        next_outage = start + every
+        while time.monotonic() - start < duration:
+            for location in locations:
+                location.position = dh.Point(coordinates=[8.675 + tick * 1e-6, 49.416])
+                publisher.publish(location)
+                published += 1
+            tick += 1
+            if time.monotonic() >= next_outage:
+                publisher.flush()
+                hub.outage(outage, websocket_only=True)
+                next_outage += every
+            time.sleep(max(0.0, start + tick / rate - time.monotonic()))
+        publisher.close()
+        time.sleep(1)
+        counters = consumer.counters()
+        consumer.stop()
+
+    print('Published: {}, received: {}, missed: {}'.format(
+        published, counters['events'], published - counters['events']))
+    print('Reconnects: {}, downtime: {:.1f} s, estimated missed: {:.0f}'.format(
+        counters['reconnects'], counters['downtime'], counters['missed_estimate']))
+    for outage in consumer.outages:
+        print('  outage from {:%H:%M:%S.%f} to {:%H:%M:%S.%f}: {:.2f} s, about {:.0f} events missed'.format(
+            outage['start'], outage['end'], outage['duration'], outage['missed_estimate']))
+
+
+#
+# Sweep a mock DeepHub with many providers, of which the given fraction has not sent a location for longer than
+# the expiration time, and report the requests and time needed to find and delete them.
+#
+def benchmark_expire(providers: int, expired: float, expiration: float):
+    from DeepHubExpiry import ProviderSweeper
+    now = time.time()
+    with MockDeepHub() as hub:
+        locations = []
+        for i in range(providers):
+            provider_id = 'BENCHMARK_PROVIDER_' + str(i)
+            age = expiration * 2 if i < providers * expired else expiration / 2
+            hub.collections['providers'][provider_id] = {'id': provider_id, 'type': 'gps'}
+            locations.append({'provider_id': provider_id, 'provider_type': 'gps',
+                              'position': {'type': 'Point', 'coordinates': [8.675, 49.416]},
+                              'timestamp_generated': datetime.datetime.utcfromtimestamp(now - age).strftime(
+                                  '%Y-%m-%dT%H:%M:%S.%fZ')})
+        hub.update_locations(locations)
+
+        requests = hub.requests
+        start = time.perf_counter()
+        sweeper = ProviderSweeper(hub.url, expiration).load()
+        loaded = time.perf_counter()
+        deleted = sweeper.sweep()
+        swept = time.perf_counter()
+        # Sweeps without expirations only look at the top of the heap.
+        for _ in range(1000):
+            sweeper.sweep()
+        idle = (time.perf_counter() - swept) / 1000
+        requests = hub.requests - requests
+        remaining = len(hub.collections['providers'])
+
+    print('Providers: {}, expired: {}, deleted: {} ({} failed), remaining: {}'.format(
+        providers, int(providers * expired), len(deleted), sweeper.failed, remaining))
+    print('Requests: {} (checking every provider would take {} per sweep)'.format(requests, providers))
+    print('Load: {:.1f} ms, sweep: {:.1f} ms, idle sweep: {:.1f} us'.format(
+        (loaded - start) * 1000, (swept - loaded) * 1000, idle * 1e6))
+
+
+#
+# Publish location updates to an in-process mock DeepHub that refuses all requests for a while, once with the
+# LocationPublisher and once with the WriteBehindPublisher, and report how long the providers were blocked, how
+# many updates were lost, and how deep the write-behind queue grew.
+#
+def benchmark_stall(providers: int, rate: float, duration: float, outage: float, policy: str, max_queue: int,
+                    limit: float):
+    for name in ('LocationPublisher', 'WriteBehindPublisher'):
+        with MockDeepHub() as hub:
+            if name == 'LocationPublisher':
+                publisher = LocationPublisher(hub.url, pool_size=1)
+            else:
+                publisher = WriteBehindPublisher(hub.url, max_queue=max_queue, policy=policy, rate=limit)
+            locations = [dh.Location(provider_id='BENCHMARK_PROVIDER_' + str(i), provider_type='gps')
+                         for i in range(providers)]
+            published, tick, blocked = 0, 0, 0.0
+            start = time.monotonic()
+            hub.outage(outage)
+            while time.monotonic() - start < duration:
+                for location in locations:
+                    location.position = dh.Point(coordinates=[8.675 + tick * 1e-6, 49.416])
+                    before = time.monotonic()
+                    publisher.publish(location)
+                    blocked = max(blocked, time.monotonic() - before)
+                    published += 1
+                tick += 1
+                time.sleep(max(0.0, start + tick / rate - time.monotonic()))
+            publisher.close()
+        stats = publisher.stats()
+        print('{}: {} published, {} sent, {} not sent, {} requests ({} failed), longest publish {:.1f} ms'.format(
+            name, published, stats['updates'], published - stats['updates'], stats['requests'], stats['failed'],
+            blocked * 1000))
+        if name == 'WriteBehindPublisher':
+            print('Write-behind queue: max depth {max_queue_depth}, {dropped} dropped, {superseded} superseded, '
+                  '{retries} retries'.format(**stats))
+
+
+#
+# Track a synthetic fleet with the ProximityEngine, and report the time per tick and the distance checks made,
+# compared to checking all pairs of the last tick with NumPy, which also verifies the pairs found.
+#
+def benchmark_proximity(vehicles: int, ticks: int, interval: float, near_distance: float, radius: float,
+                        spread: float):
+    import numpy as np
+    from DeepHubFleet import Fleet
+    from DeepHubProximity import ProximityEngine
+    fleet = Fleet(seed=0).add_circles(vehicles, spread=spread)
+    engine = ProximityEngine(near_distance=near_distance, default_radius=radius)
+    ids = fleet.ids
+    durations, events = [], 0
+    for _, positions in fleet.ticks(interval, (ticks - 1) * interval):
+        start = time.perf_counter()
+        for trackable_id, coordinates in zip(ids, positions.tolist()):
+            engine.update(trackable_id, coordinates)
+        events += len(engine.evaluate())
+        durations.append(time.perf_counter() - start)
+
+    # All pairs closer than near_distance, in chunks of rows to bound the memory used.
+    start = time.perf_counter()
+    meters = np.array([engine.positions[trackable_id][:2] for trackable_id in ids])
+    expected = set()
+    for first in range(0, len(meters), 1000):
+        distances = np.linalg.norm(meters[first:first + 1000, np.newaxis] - meters[np.newaxis], axis=2)
+        for row, column in zip(*np.nonzero(distances - 2 * radius <= near_distance)):
+            if first + row < column:
+                expected.add((min(ids[first + row], ids[column]), max(ids[first + row], ids[column])))
+    brute_force = time.perf_counter() - start
+
+    stats = engine.stats()
+    print('Vehicles: {}, ticks: {}, cells: {}, collisions: {}, near misses: {}, events: {}'.format(
+        vehicles, len(durations), stats['cells'], stats['collisions'], stats['near_misses'], events))
+    print('Spatial hash: {:.1f} ms per tick, p99 {:.1f} ms, {:.0f} checks per tick'.format(
+        sum(durations) / len(durations) * 1000, percentile(durations, 0.99) * 1000, stats['checks'] / len(durations)))
+    print('All pairs with NumPy: {:.1f} ms for one tick, {} checks, {}'.format(
+        brute_force * 1000, vehicles * (vehicles - 1) // 2,
+        'same pairs' if expected == set(engine.pairs) else 'DIFFERENT PAIRS'))
+
+
+#
+# Measure the wall-clock startup time of short commands of deephub-rest-api-basics.py against a mock DeepHub,
+# compared to starting a bare interpreter, and check which heavy modules importing the example loads.
+#
+def benchmark_startup(repeat: int):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deephub-rest-api-basics.py')
+    heavy = ('numpy', 'websocket', 'matplotlib', 'pyproj')
+    with MockDeepHub() as hub:
+        for name, command in (('python', [sys.executable, '-c', 'pass']),
+                              ('--help', [sys.executable, script, '--help']),
+                              ('health', [sys.executable, script, '--url', hub.url, 'health'])):
+            durations = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+                durations.append(time.perf_counter() - start)
+            print('{:<8} min {:6.1f} ms, mean {:6.1f} ms'.format(
+                name, min(durations) * 1000, sum(durations) / len(durations) * 1000))
+    loaded = subprocess.run([sys.executable, '-c', 'import sys; '
+                             'import importlib.util as u; spec = u.spec_from_file_location("example", {!r}); '
+                             'spec.loader.exec_module(u.module_from_spec(spec)); '
+                             'print(" ".join(name for name in {!r} if name in sys.modules))'.format(script, heavy)],
+                            stdout=subprocess.PIPE, text=True, check=True).stdout.split()
+    print('Heavy modules imported at startup:', ', '.join(loaded) or 'none')
+
+
+#
+# Fuse a simulated GPS and UWB provider of one vehicle following a lane, and report the error of the raw and the
+# fused positions against the true positions, and the time per location fused.
+#
+def benchmark_fusion(rate: float, output_rate: float, duration: float, acceleration: float):
+    import numpy as np
+    from DeepHubClasses import ACCURACY
+    from DeepHubFleet import Fleet
+    from DeepHubFusion import TrackFusion
+    fleet = Fleet(seed=0).add_lanes(1, files=['forkliftGpsCoordinates.txt'], speed=(1.5, 1.5), provider_type='truth')
+    rng = np.random.default_rng(0)
+    start_time = time.time()
+    updates = []
+    for t, positions in fleet.ticks(1.0 / rate, duration):
+        for provider_type in ('gps', 'uwb'):
+            noise = rng.normal(0.0, ACCURACY[provider_type], 2)
+            updates.append((t, positions[0], provider_type, fleet.to_wgs84(fleet.to_meters(positions[0]) + noise)))
+
+    def run(provider_types):
+        fusion = TrackFusion({'vehicle': ['GPS', 'UWB']}, output_rate, acceleration)
+        errors, raw = [], {provider_type: [] for provider_type in provider_types}
+        started = time.perf_counter()
+        for t, truth, provider_type, measured in updates:
+            if provider_type not in provider_types:
+                continue
+            location = {'provider_id': provider_type.upper(), 'provider_type': provider_type, 'crs': 'EPSG:4326',
+                        'position': {'type': 'Point', 'coordinates': measured.tolist()},
+                        'timestamp_generated': datetime.datetime.utcfromtimestamp(start_time + t).strftime(
+                            '%Y-%m-%dT%H:%M:%S.%fZ')}
+            raw[provider_type].append(np.linalg.norm(fleet.to_meters(measured) - fleet.to_meters(truth)))
+            fused = fusion.update(location)
+            if fused is not None:
+                errors.append(np.linalg.norm(fleet.to_meters(fused.position.coordinates) - fleet.to_meters(truth)))
+        elapsed = time.perf_counter() - started
+
+        def rms(values):
+            return float(np.sqrt(np.mean(np.square(values)))) if values else 0.0
+
+        print('{:<10} raw RMS error {}, fused RMS error {:.2f} m, {} of {} locations emitted, {:.1f} us per location'
+              .format('+'.join(provider_types), ', '.join('{} {:.2f} m'.format(provider_type, rms(values))
+                                                          for provider_type, values in raw.items()),
+                      rms(errors), len(errors), fusion.fused, elapsed / max(fusion.fused, 1) * 1e6))
+
+    print('Rate: {:g} Hz per provider, output: {:g} Hz, duration: {:g} s'.format(rate, output_rate, duration))
+    run(['gps'])
+    run(['uwb'])
+    run(['gps', 'uwb'])
+
+
+#
+# Compare the generic to_json path with the LocationEncoder for a batch of location updates.
+#
+def benchmark_serialization(count: int, repeat: int):
+    locations = []
+    for i in range(count):
+        location = dh.Location(provider_id='PROVIDER_' + str(i % 100), provider_type='gps')
+        location.crs = 'EPSG:4326'
+        location.position = dh.Point(coordinates=[8.675237346279264 + i * 1e-7, 49.4159479971782])
+        locations.append(location)
+
+    def generic():
+        return '[' + ','.join(location.to_json() for location in locations) + ']'
+
+    encoder = dh.LocationEncoder()
+    buffer = bytearray()
+
+    def encoded():
+        return encoder.encode_list(locations, buffer)
+
+    results = {}
+    for name, function in [('to_json', generic), ('LocationEncoder', encoded)]:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - start)
+        results[name] = best
+        print('{:<16} {:8.1f} ms per {} locations, {:10.0f} locations/s'.format(
+            name, best * 1000, count, count / best))
+    print('Speedup: {:.2f}x'.format(results['to_json'] / results['LocationEncoder']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the DeepHub example client.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    serialization = subparsers.add_parser('serialization', help='serialization of location updates')
+    serialization.add_argument('--count', type=int, default=10000, help='locations per batch (default: 10000)')
+    serialization.add_argument('--repeat', type=int, default=10, help='number of runs (default: 10)')
+
+    publish = subparsers.add_parser('publish', help='publishing location updates to a mock DeepHub')
+    publish.add_argument('--providers', type=int, default=10, help='number of providers (default: 10)')
+    publish.add_argument('--rate', type=float, default=20, help='updates per second per provider (default: 20)')
+    publish.add_argument('--speed', type=float, default=1,
+                         help='speed multiplier of the replay, e.g. 10 or 100 (default: 1)')
+    publish.add_argument('--max-throughput', action='store_true', help='send updates without pacing')
+    publish.add_argument('--file', default='truckGpsCoordinates.txt',
+                         help='coordinate file to replay (default: truckGpsCoordinates.txt)')
+    publish.add_argument('--fakedata', action='store_true', help='use the fake-data generator instead of a file')
+    publish.add_argument('--websocket', action='store_true',
+                         help='also consume the location updates over the WebSocket API')
+    publish.add_argument('--deadband', type=float, default=0,
+                         help='only send updates of providers that moved this many meters (default: off)')
+    publish.add_argument('--max-silence', type=float, default=5,
+                         help='seconds after which a stationary provider is sent again (default: 5)')
+    publish.add_argument('--verify', choices=['websocket', 'poll'],
+                         help='measure the write-to-visible latency of sampled updates over the WebSocket API, '
+                              'or by polling the locations of the providers')
+    publish.add_argument('--sample-every', type=int, default=10,
+                         help='sample one in this many updates for --verify (default: 10)')
+    publish.add_argument('--delay', type=float, default=0.0,
+                         help='seconds the mock DeepHub delays every response (default: 0)')
+
+    reconnect = subparsers.add_parser('reconnect', help='WebSocket reconnects while the mock DeepHub fails')
+    reconnect.add_argument('--providers', type=int, default=10, help='number of providers (default: 10)')
+    reconnect.add_argument('--rate', type=float, default=20, help='updates per second per provider (default: 20)')
+    reconnect.add_argument('--duration', type=float, default=10, help='seconds to run (default: 10)')
+    reconnect.add_argument('--every', type=float, default=3, help='seconds between two outages (default: 3)')
+    reconnect.add_argument('--outage', type=float, default=1, help='seconds each outage lasts (default: 1)')
+
+    expire = subparsers.add_parser('expire', help='sweeping expired providers from a mock DeepHub')
+    expire.add_argument('--providers', type=int, default=10000, help='number of providers (default: 10000)')
+    expire.add_argument('--expired', type=float, default=0.01,
+                        help='fraction of the providers that has expired (default: 0.01)')
+    expire.add_argument('--expiration', type=float, default=60,
+                        help='seconds until a provider expires (default: 60)')
+
+    stall = subparsers.add_parser('stall', help='publishing location updates while the mock DeepHub fails')
+    stall.add_argument('--providers', type=int, default=100, help='number of providers (default: 100)')
+    stall.add_argument('--rate', type=float, default=20, help='updates per second per provider (default: 20)')
+    stall.add_argument('--duration', type=float, default=5, help='seconds to run (default: 5)')
+    stall.add_argument('--outage', type=float, default=2,
+                       help='seconds the mock DeepHub refuses requests at the start (default: 2)')
+    stall.add_argument('--policy', choices=['oldest', 'latest'], default='latest',
+                       help='drop policy of the write-behind queue (default: latest)')
+    stall.add_argument('--max-queue', type=int, default=10000,
+                       help='locations the write-behind queue holds (default: 10000)')
+    stall.add_argument('--limit', type=float, help='updates per second the write-behind queue sends at most')
+
+    proximity = subparsers.add_parser('proximity', help='collision and near-miss detection in a synthetic fleet')
+    proximity.add_argument('--vehicles', type=int, default=5000, help='number of vehicles (default: 5000)')
+    proximity.add_argument('--ticks', type=int, default=20, help='number of ticks (default: 20)')
+    proximity.add_argument('--interval', type=float, default=0.5, help='seconds between two ticks (default: 0.5)')
+    proximity.add_argument('--near-distance', type=float, default=2,
+                           help='meters between two vehicles that are a near miss (default: 2)')
+    proximity.add_argument('--radius', type=float, default=0.5, help='radius of the vehicles (default: 0.5)')
+    proximity.add_argument('--spread', type=float, default=500,
+                           help='meters around the origin in which the vehicles drive circles (default: 500)')
+
+    startup = subparsers.add_parser('startup', help='startup time of the commands of the example')
+    startup.add_argument('--repeat', type=int, default=10, help='number of runs (default: 10)')
+
+    fusion = subparsers.add_parser('fusion', help='fusion of a simulated GPS and UWB provider')
+    fusion.add_argument('--rate', type=float, default=20, help='updates per second per provider (default: 20)')
+    fusion.add_argument('--output-rate', type=float, default=2, help='fused locations per second (default: 2)')
+    fusion.add_argument('--duration', type=float, default=120, help='seconds to simulate (default: 120)')
+    fusion.add_argument('--acceleration', type=float, default=1,
+                        help='standard deviation of the acceleration of the model, in m/s^2 (default: 1)')
+
+    args = parser.parse_args()
+    if args.benchmark == 'serialization':
+        benchmark_serialization(args.count, args.repeat)
+    elif args.benchmark == 'publish':
+        benchmark_publish(args.providers, args.rate, args.file, args.fakedata, args.websocket, args.delay,
+                          args.speed, args.max_throughput, args.verify, args.sample_every, args.deadband,
+                          args.max_silence)
+    elif args.benchmark == 'expire':
+        benchmark_expire(args.providers, args.expired, args.expiration)
+    elif args.benchmark == 'reconnect':
+        benchmark_reconnect(args.providers, args.rate, args.duration, args.every, args.outage)
+    elif args.benchmark == 'stall':
+        benchmark_stall(args.providers, args.rate, args.duration, args.outage, args.policy, args.max_queue,
+                        args.limit)
+    elif args.benchmark == 'proximity':
+        benchmark_proximity(args.vehicles, args.ticks, args.interval, args.near_distance, args.radius, args.spread)
+    elif args.benchmark == 'startup':
+        benchmark_startup(args.repeat)
+    elif args.benchmark == 'fusion':
+        benchmark_fusion(args.rate, args.output_rate, args.duration, args.acceleration)
@@ -1,18 +1,34 @@
 #!/usr/bin/env python3
+import argparse
+import sys
 import time
 import threading
 import requests as rest
 import DeepHubClasses as dh
+from DeepHubPublisher import LocationPublisher, WriteBehindPublisher
+from DeepHubRegistry import EntityRegistry
+from DeepHubReplay import ReplayScheduler, read_points
+from DeepHubVerification import PropagationMonitor
+from DeepHubExpiry import ProviderSweeper, run as expire_providers
+from DeepHubFilter import DeadbandFilter
+from DeepHubMetrics import Metrics
 import random
 import math
 import datetime
-import pyproj
-import matplotlib.pyplot as plt
-import websocket
+# The WebSocket client and NumPy are only imported by the functions using them, so that short commands
+# like health and setup start quickly.
 
 # The URL at which the DeepHub is running. Adjust this accordingly if running the DeepHub at some other URL.
 url = 'http://localhost:8081/deephub/v1'
 
+# The latency, status codes and payload sizes of all requests to the DeepHub, recorded from the sessions
+# instrumented by metrics. They are served at http://localhost:<metrics_port>/metrics, unless metrics_port is 0,
+# and printed every minute.
+metrics = Metrics()
+session = metrics.instrument(rest.Session())
+metrics_port = 9108
+metrics_summary_interval = 60
+
 # A constant to improve readability of the code
 REVERSE = True
 
@@ -27,14 +43,58 @@ provider_id_truck2 = 'ACCURO_THEIA_HARDWARE_ID'
 provider_id_forklift_gps = 'FORKLIFT_GPS_HARDWARE_ID'
 provider_id_forklift_uwb = 'FORKLIFT_UWB_TAG_ID'
 
+# The id of the virtual provider of the fused track of the forklift, see fusion_output_rate.
+provider_id_fused_forklift = 'FUSED_FORKLIFT'
+
 # The URL to access the example's trackable. This requires the UUID of the trackable found in the DeepHub and is set during setup.
 trackable_url: str
+trackable_id_pallet: str
+
+# The cache of the DeepHub's entities, which is loaded in main and kept in sync via the WebSocket API.
+registry: EntityRegistry
+
+# The number of providers sending location updates concurrently in the example.
+provider_thread_count = 4
+
+# Paces the location updates of all providers: 20 updates per second, or the original timing of recorded
+# trajectories, accelerated by speed, e.g. 10 or 100.
+scheduler = ReplayScheduler(rate=20.0, speed=1.0)
+
+# The publisher batching the location updates of all providers. This is created in main.
+publisher: LocationPublisher
+
+# Measures how long sampled location updates take to become visible over the WebSocket API, or None.
+monitor: PropagationMonitor = None
+
+# One in this many location updates of the fake-data generator is sampled by the monitor.
+verification_sample_every = 10
+
+# The seconds after its last location until the fake-data provider is deleted.
+expiration_time = 60
+
+# If positive, location updates of providers that moved less than this many meters are not sent, except for one
+# every max_silence seconds.
+deadband_distance = 0.0
+max_silence = 5.0
+
+# If positive, location updates are queued in a write-behind queue of this many locations, so that the providers
+# never wait for a slow or failing DeepHub. With the 'latest' policy, only the latest location of each provider is
+# queued; with 'oldest', the oldest location is dropped when the queue is full. The queue sends at most
+# publish_rate_limit location updates per second, if set, and retries failed requests.
+write_behind_queue = 0
+write_behind_policy = 'latest'
+publish_rate_limit = None
+
+# The GPS and UWB locations of the forklift are fused into one track, which is published at this many locations per
+# second as the provider provider_id_fused_forklift.
+fusion_output_rate = 2.0
 
 
 #
 # The main function running the example.
 #
 def main():
+    global publisher, registry, monitor
     stored_coordinates = []  # To store the result from the thread
 
     def thread_function():
@@ -44,16 +104,60 @@ def main():
     # Confirm that the DeepHub can be contacted.
     if not is_healthy():
         return
+    print('Connected to the DeepHub at', url)
+    if metrics_port:
+        try:
+            metrics.serve(metrics_port)
+        except OSError as error:
+            print('The metrics cannot be served on port', metrics_port, '-', error)
+    metrics.start_summary(metrics_summary_interval)
+
+    # Load the DeepHub's entities once, and keep them up to date with the changes made by other clients.
+    # The location updates are matched with the sampled updates of the fake-data generator.
+    from DeepHubStream import StreamConsumer
+    print('Loading the entities of the DeepHub.')
+    registry = EntityRegistry(url, session).load()
+    monitor = PropagationMonitor(sample_every=verification_sample_every)
+    metrics.instrument(monitor.session)
+    consumer = StreamConsumer(url.replace('http', 'ws', 1) + '/ws/socket',
+                              topics=['metadata_changes', 'location_updates'])
+    consumer.add_sink(registry)
+    consumer.add_sink(monitor)
+    # Delete the fake-data provider once it has expired, tracking its last location in the background.
+    sweeper = ProviderSweeper(url, expiration_time, registry=registry, provider_ids=[provider_id_truck2]).load()
+    consumer.add_sink(sweeper)
+    sweeper.start()
+    consumer.start()
 
     # Setup the example environment.
     print('Setting up the example.')
     setup()
+    if write_behind_queue > 0:
+        publisher = WriteBehindPublisher(url, write_behind_queue, write_behind_policy, rate=publish_rate_limit,
+                                         metrics=metrics)
+    else:
+        publisher = LocationPublisher(url, pool_size=provider_thread_count)
+    metrics.instrument(publisher.session)
+    if deadband_distance > 0:
+        # Updates entering or exiting the example's fences are always forwarded.
+        from DeepHubFences import FenceEngine
+        fences = FenceEngine([registry.get('fences', fence_id) for fence_id in registry.ids('fences')])
+        publisher = DeadbandFilter(publisher, deadband_distance, max_silence=max_silence, fences=fences,
+                                   monitor=monitor)
+    from DeepHubFusion import TrackFusion
+    from DeepHubTransform import TransformCache
+    # The track of the trackable FORKLIFT is published as the provider FUSED_FORKLIFT created in setup.
+    fusion = TrackFusion({'FORKLIFT': [provider_id_forklift_gps, provider_id_forklift_uwb]}, fusion_output_rate,
+                         transforms=TransformCache(registry),
+                         callback=lambda locations: [publisher.publish(location) for location in locations])
+    consumer.add_sink(fusion)
 
     # Run the example in a loop.
     print('Running the example loop.')
     while True:
 
         # The pallet is loaded onto the truck, which then drives off.
+        print('The truck drives off with the pallet, the forklift drives to the delivery area.')
         attach_trackable_to_provider(provider_id_truck)
         time.sleep(1)
         truck_thread = threading.Thread(target=send_location_updates,
@@ -85,8 +189,10 @@ def main():
         fork_uwb_thread.join()
         truck_thread.join()
         truck_thread2.join()
+        publisher.flush()
 
         # ### Plot for debug ###
+        # import matplotlib.pyplot as plt
         # # Extract longitude and latitude values from stored_coordinates
         # longitudes, latitudes = zip(*stored_coordinates)
         #
@@ -100,6 +206,7 @@ def main():
         # plt.show()
 
         # The forklift loads the pallet and drives to the drop off point.
+        print('The forklift takes the pallet to the drop off point, the truck drives back.')
         attach_trackable_to_provider(provider_id_forklift_uwb)
         time.sleep(1)
         fork_gps_thread = threading.Thread(target=send_location_updates,
@@ -124,18 +231,16 @@ def main():
         truck_thread.start()
         # truck_thread2.start()
 
-
-        expiration_time = 60
-        response = get_provider_location(url, provider_id_truck2)
-        tf = check_expiration(response, expiration_time)
-        if tf:
-            delete_provider(url, provider_id_truck2)
-
         # Wait for both vehicles to finish their current movement.
         fork_gps_thread.join()
         fork_uwb_thread.join()
         truck_thread.join()
         # truck_thread2.join()
+        publisher.flush()
+        publisher.print_stats()
+        scheduler.print_stats()
+        monitor.print_stats()
+        fusion.print_stats()
 
         setup()
 
@@ -144,22 +249,26 @@ def main():
 #
 def is_healthy():
     try:
-        return rest.get(url + "/health").status_code == 200
-    except:
+        status = session.get(url + "/health", timeout=5).status_code
+    except rest.RequestException:
         print('Could not find a DeepHub instance running at', url)
-        False
+        return False
+    if status != 200:
+        print('The DeepHub at', url, 'is not healthy, /health answered with status', status)
+        return False
+    return True
 
 
 #
 # Initialize all the example entities in the DeepHub.
 #
 def setup():
-    global trackable_url
+    global trackable_url, trackable_id_pallet
 
-    # Check whether the example's entities exist already.
-    if len(rest.get(url + '/zones' + '?foreign_id=' + zone_foreign_id).json()) > 0:
+    # Check whether the example's entities exist already. The registry answers this from its cache.
+    if len(registry.find('zones', foreign_id=zone_foreign_id)) > 0:
         print('Found an example zone. Using existing setup.')
-        trackable_id_pallet = rest.get(url + '/trackables').json()[0]
+        trackable_id_pallet = registry.ids('trackables')[0]
         trackable_url = url + '/trackables/' + trackable_id_pallet
         return
 
@@ -167,57 +276,63 @@ def setup():
     zone = dh.Zone()
     zone.name = 'Area'
     zone.foreign_id = zone_foreign_id
-    rest.post(url + '/zones', zone.to_json())
+    registry.create('zones', zone)
 
     # Setup the example's fences.
     delivery_fence = dh.Fence(region=dh.Polygon())
     delivery_fence.name = 'Delivery'
-    rest.post(url + '/fences', delivery_fence.to_json())
+    registry.create('fences', delivery_fence)
 
     print('Making a new fence')
     new_fence = dh.Fence(region=dh.Polygon1())
     new_fence.name = 'NewFence'
-    rest.post(url + '/fences', new_fence.to_json())
+    registry.create('fences', new_fence)
 
     drop_fence = dh.Fence(region=dh.Point())
     drop_fence.name = 'Drop'
     drop_fence.radius = 2
-    rest.post(url + '/fences', drop_fence.to_json())
+    registry.create('fences', drop_fence)
 
     # Setup the example's providers for the truck and forklift.
     provider_truck_gps = dh.LocationProvider(id=provider_id_truck)
     provider_truck_gps.name = 'Truck GPS'
     provider_truck_gps.type = 'gps'
-    rest.post(url + '/providers', provider_truck_gps.to_json())
+    registry.ensure('providers', provider_truck_gps)
 
     provider_truck_gps2 = dh.LocationProvider(id=provider_id_truck2)
     provider_truck_gps2.name = 'Accuro'
     provider_truck_gps2.type = 'gps'
-    rest.post(url + '/providers', provider_truck_gps2.to_json())
+    registry.ensure('providers', provider_truck_gps2)
 
     provider_forklift_gps = dh.LocationProvider(id=provider_id_forklift_gps)
     provider_forklift_gps.name = 'Forklift GPS'
     provider_forklift_gps.type = 'gps'
-    rest.post(url + '/providers', provider_forklift_gps.to_json())
+    registry.ensure('providers', provider_forklift_gps)
 
     provider_forklift_uwb = dh.LocationProvider(id=provider_id_forklift_uwb)
     provider_forklift_uwb.name = 'Forklift UWB'
     provider_forklift_uwb.type = 'uwb'
-    rest.post(url + '/providers', provider_forklift_uwb.to_json())
+    registry.ensure('providers', provider_forklift_uwb)
+
+    provider_fused_forklift = dh.LocationProvider(id=provider_id_fused_forklift)
+    provider_fused_forklift.name = 'Forklift'
+    provider_fused_forklift.type = 'virtual'
+    registry.ensure('providers', provider_fused_forklift)
 
     # Setup the example's trackable.
     trackable_pallet = dh.Trackable()
     trackable_pallet.name = 'Pallet'
     trackable_pallet.radius = 1
-    response = rest.post(url + '/trackables', trackable_pallet.to_json())
+    response = registry.create('trackables', trackable_pallet)
     # Obtain the trackables UUID from the response.
-    trackable_id_pallet = response.json()['id']
+    trackable_id_pallet = response['id']
     trackable_url = url + '/trackables/' + trackable_id_pallet
 
 
 
 #
 # Send location updates for the provider with the given id from the given file.
+# Binary trajectory files (see DeepHubTrajectory.py) are memory-mapped instead of being read into memory.
 #
 def send_location_updates(provider_id: str, provider_type: str, file: str, reverse: bool = False):
     location = dh.Location(provider_id=provider_id,
@@ -227,13 +342,13 @@ def send_location_updates(provider_id: str, provider_type: str, file: str, rever
     else:
         location.source = zone_foreign_id
 
-    with open(file) as input:
-        if reverse:
-            input = reversed(list(input))
-        for coordinates in [list(map(float, line.split(sep=','))) for line in input]:
-            location.position = dh.Point(coordinates=coordinates)
-            rest.put(url + '/providers/locations', location.to_json_list())
-            time.sleep(0.05)
+    # A directory of recorded chunk files, as written by DeepHubRecorder.py, replays the provider's recording.
+    for coordinates in scheduler.pace(provider_id, read_points(file, provider_id, reverse)):
+        location.position = dh.Point(coordinates=coordinates)
+        publisher.publish(location)
+        # A dead-band filter samples only the updates it forwards.
+        if monitor is not None and not isinstance(publisher, DeadbandFilter):
+            monitor.published(location)
 
 
 def generate_coordinates():
@@ -330,19 +445,20 @@ def send_location_updates_fakedata(provider_id: str, provider_type: str):
     else:
         location.source = zone_foreign_id
 
+    from DeepHubGeometry import calculate_coordinates_array, convert_locations_in_wgs
     n = 250
     r = 10
-    stored_coordinates = []
-    for i in range(n):
+    # Compute the whole circle at once instead of calling calculate_coordinates and convert_location_in_wgs per point.
+    x, y = calculate_coordinates_array(r, n)
+    stored_coordinates = convert_locations_in_wgs(-84.389556, 33.778000, x, y).tolist()
+    for coordinates in scheduler.pace(provider_id, ((None, coordinates) for coordinates in stored_coordinates)):
         # coordinates = generate_coordinates()
-        x, y = calculate_coordinates(r, n, i)
-        coordinates = convert_location_in_wgs(-84.389556, 33.778000, x, y)
-        stored_coordinates.append(coordinates)  # Store the coordinates
         location.position = dh.Point(coordinates=coordinates)
-        rest.put(url + '/providers/locations', location.to_json_list())
-        time.sleep(0.05)
-        response = get_provider_location(url, provider_id)
-        print_coordinate(response)
+        publisher.publish(location)
+        # The location is verified off the hot path, instead of reading it back after every update. A dead-band
+        # filter samples only the updates it forwards.
+        if monitor is not None and not isinstance(publisher, DeadbandFilter):
+            monitor.published(location)
 
     return stored_coordinates
 
@@ -350,13 +466,13 @@ def delete_provider(url: str, provider_id: str):
     endpoint = '/providers/' + provider_id
     # print('url to delete', url + endpoint)
     print('delete', provider_id)
-    response = rest.delete(url + endpoint)
+    response = session.delete(url + endpoint)
 
 
 def get_provider_location(url: str, provider_id: str):
     endpoint = '/providers/' + provider_id + '/location/'
     print('get the location of:', provider_id)
-    response = rest.get(url + endpoint)
+    response = session.get(url + endpoint)
     return response
 
 
@@ -372,11 +488,10 @@ def print_coordinate(response):
 
 #
 # Update the pallet trackable such that it is attached to the provider with the given id.
+# The trackable is taken from the registry, so this only sends a PUT request, and only if the provider changes.
 #
 def attach_trackable_to_provider(provider_id: str):
-    trackable_pallet = dh.Trackable(rest.get(trackable_url).json())
-    trackable_pallet.location_providers = [provider_id]
-    rest.put(trackable_url, trackable_pallet.to_json())
+    registry.attach_trackable(trackable_id_pallet, provider_id)
 
 
 # define a function that takes r, cx, cy, and n as input and returns x and y as output
@@ -415,8 +530,110 @@ def check_expiration(response, expiration_time):
         # return False otherwise
         return False
 
+#
+# The commands of the command line interface. Each returns the exit status of the process.
+#
+def health_command(args) -> int:
+    if not is_healthy():
+        return 1
+    print('The DeepHub at', url, 'is healthy.')
+    return 0
+
+
+def setup_command(args) -> int:
+    global registry
+    if not is_healthy():
+        return 1
+    registry = EntityRegistry(url, session).load()
+    setup()
+    print('The pallet trackable is', trackable_id_pallet)
+    return 0
+
+
+def replay_command(args) -> int:
+    global publisher, scheduler
+    if not is_healthy():
+        return 1
+    scheduler = ReplayScheduler(rate=args.rate, speed=args.speed, max_throughput=args.max_throughput)
+    publisher = LocationPublisher(url)
+    metrics.instrument(publisher.session)
+    try:
+        send_location_updates(args.provider_id, args.type, args.file, args.reverse)
+    finally:
+        publisher.close()
+    publisher.print_stats()
+    print(metrics.summary())
+    return 0
+
+
+def fake_fleet_command(args) -> int:
+    import DeepHubFleet
+    if not is_healthy():
+        return 1
+    fleet = DeepHubFleet.Fleet(seed=args.seed).add_circles(args.circles).add_random_walks(args.walks) \
+        .add_lanes(args.lanes)
+    DeepHubFleet.publish(fleet, url, args.interval, args.duration).print_stats()
+    return 0
+
+
+def expire_command(args) -> int:
+    if not is_healthy():
+        return 1
+    expire_providers(url, args.expiration, args.once)
+    return 0
+
+
+def run_command(args) -> int:
+    main()
+    return 0
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='The DeepHub REST API example. Without a command, the example '
+                                                 'loop is run.')
+    parser.add_argument('--url', default=url, help='the url of the DeepHub (default: {})'.format(url))
+    parser.add_argument('--metrics-port', type=int, default=metrics_port,
+                        help='the port to serve the metrics on, or 0 to not serve them (default: {})'.format(
+                            metrics_port))
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('run', help='set up the example and run its loop (default)')
+    subparsers.add_parser('health', help='check whether the DeepHub is available')
+    subparsers.add_parser('setup', help='create the entities of the example, unless they exist')
+
+    replay = subparsers.add_parser('replay', help='send the locations of a provider from a file or recording')
+    replay.add_argument('provider_id', help='the id of the provider')
+    replay.add_argument('file', help='a coordinate file, trajectory file or directory of recorded chunk files')
+    replay.add_argument('--type', default='gps', help='the type of the provider (default: gps)')
+    replay.add_argument('--rate', type=float, default=20,
+                        help='updates per second of untimed coordinates (default: 20)')
+    replay.add_argument('--speed', type=float, default=1,
+                        help='speed multiplier of the replay, e.g. 10 or 100 (default: 1)')
+    replay.add_argument('--max-throughput', action='store_true', help='send the locations without pacing')
+    replay.add_argument('--reverse', action='store_true', help='replay the locations in reverse order')
+
+    fake_fleet = subparsers.add_parser('fake-fleet', help='send the locations of a synthetic fleet')
+    fake_fleet.add_argument('--circles', type=int, default=100, help='vehicles driving circles (default: 100)')
+    fake_fleet.add_argument('--walks', type=int, default=100,
+                            help='vehicles walking randomly inside the example fence (default: 100)')
+    fake_fleet.add_argument('--lanes', type=int, default=100,
+                            help='vehicles following the example coordinate files (default: 100)')
+    fake_fleet.add_argument('--seed', type=int, default=0, help='the seed of the fleet (default: 0)')
+    fake_fleet.add_argument('--interval', type=float, default=0.5,
+                            help='seconds between two updates (default: 0.5)')
+    fake_fleet.add_argument('--duration', type=float, default=60, help='seconds to run (default: 60)')
+
+    expire = subparsers.add_parser('expire', help='delete the providers that have not sent a location for a while')
+    expire.add_argument('--expiration', type=float, default=expiration_time,
+                        help='seconds after the last location until a provider expires '
+                             '(default: {:g})'.format(expiration_time))
+    expire.add_argument('--once', action='store_true', help='sweep once instead of following the WebSocket API')
+
+    args = parser.parse_args()
+    url = args.url
+    metrics_port = args.metrics_port
+    commands = {'run': run_command, 'health': health_command, 'setup': setup_command, 'replay': replay_command,
+                'fake-fleet': fake_fleet_command, 'expire': expire_command}
     try:
-        main()
+        sys.exit(commands[args.command or 'run'](args))
     except KeyboardInterrupt:
         print('\nStopped')
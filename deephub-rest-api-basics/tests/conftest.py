@@ -0,0 +1,26 @@
+import os
+import sys
+import time
+
+import pytest
+
+# The modules are imported from the directory of the example, like websocket_client.py does.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from DeepHubMock import MockDeepHub  # noqa: E402
+
+
+@pytest.fixture
+def hub():
+    with MockDeepHub() as hub:
+        yield hub
+
+
+# Wait until the condition holds, and return whether it does.
+def wait_until(condition, timeout: float = 5.0, interval: float = 0.01) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(interval)
+    return condition()
@@ -0,0 +1,55 @@
+import pytest
+import ujson as json
+
+import DeepHubClasses as dh
+
+
+def gps_location() -> dh.Location:
+    location = dh.Location(provider_id='TEST_PROVIDER', provider_type='gps')
+    location.crs = 'EPSG:4326'
+    location.accuracy = 2.5
+    location.position = dh.Point(coordinates=[8.675, 49.416])
+    return location
+
+
+def annotated_location() -> dh.Location:
+    location = gps_location()
+    location.note = 'added by an example'
+    return location
+
+
+def custom_properties() -> dh.Location:
+    location = gps_location()
+    location.properties = {'battery': 0.5}
+    return location
+
+
+@pytest.mark.parametrize('location', [
+    dh.Location(),
+    dh.Location(provider_id='TEST_PROVIDER', position=None),
+    gps_location(),
+    annotated_location(),
+    custom_properties(),
+    dh.Location({'provider_id': 'TEST_PROVIDER', 'position': {'coordinates': [1.0, 2.0]}}),
+    dh.Location({'provider_id': 'TEST_PROVIDER', 'id': 'stored',
+                 'position': {'type': 'Point', 'coordinates': [1.0, 2.0], 'bbox': [1.0, 2.0, 1.0, 2.0]}}),
+])
+def test_encoder_matches_to_json(location):
+    encoder = dh.LocationEncoder()
+    for _ in range(2):
+        # The second time, the properties come from the cache.
+        buffer = bytearray()
+        encoder.encode_into(location, buffer)
+        assert json.loads(bytes(buffer)) == json.loads(location.to_json())
+
+
+def test_encode_list_matches_to_json():
+    locations = [gps_location(), annotated_location(), dh.Location()]
+    encoded = dh.LocationEncoder().encode_list(locations)
+    assert json.loads(bytes(encoded)) == [json.loads(location.to_json()) for location in locations]
+    assert bytes(dh.LocationEncoder().encode_list([])) == b'[]'
+
+
+def test_point_without_type_is_a_point():
+    point = dh.Point({'coordinates': [1.0, 2.0]})
+    assert json.loads(point.to_json()) == {'type': 'Point', 'coordinates': [1.0, 2.0]}
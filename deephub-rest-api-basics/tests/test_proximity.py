@@ -0,0 +1,122 @@
+import pytest
+
+from DeepHubProximity import ProximityEngine
+
+
+# The collision types of the events of one tick, for the pair of trackables A and B.
+def tick(engine, **positions) -> list:
+    for trackable_id, coordinates in positions.items():
+        engine.update(trackable_id, coordinates, crs='local')
+    events = engine.evaluate('2024-01-01T00:00:00.000000Z')
+    for event in events:
+        assert [trackable['trackable_id'] for trackable in event['collisions']] == ['A', 'B']
+    return [event['collision_type'] for event in events]
+
+
+@pytest.fixture
+def engine():
+    # Circles with a radius of 0.5 m, in cells of 3 m.
+    return ProximityEngine(near_distance=2.0, default_radius=0.5)
+
+
+@pytest.mark.parametrize('a, b', [
+    ([2.9, 1.0], [3.1, 1.0]),
+    ([1.0, 2.9], [1.0, 3.1]),
+    ([2.9, 2.9], [3.1, 3.1]),
+    ([-0.1, -0.1], [0.1, 0.1]),
+])
+def test_collision_across_cell_boundaries(engine, a, b):
+    assert tick(engine, A=a, B=b) == ['collision_start']
+    assert engine.positions['A'][2] != engine.positions['B'][2]
+
+
+def test_near_miss_several_cells_apart():
+    # The large radius of A reaches two cells beyond its own.
+    engine = ProximityEngine(near_distance=2.0, default_radius=0.5, radii={'A': 5.0})
+    assert tick(engine, A=[0.0, 0.0], B=[7.4, 0.0]) == ['near_miss_start']
+    assert engine.positions['B'][2][0] - engine.positions['A'][2][0] == 2
+
+
+def test_exact_thresholds(engine):
+    # A clearance of exactly near_distance is a near miss, and one of exactly zero, touching circles, a collision.
+    assert tick(engine, A=[0.0, 0.0], B=[3.0, 0.0]) == ['near_miss_start']
+    assert tick(engine, B=[1.0, 0.0]) == ['near_miss_end', 'collision_start']
+    assert tick(engine, B=[3.0, 0.0]) == ['collision_end', 'near_miss_start']
+    assert tick(engine, B=[3.25, 0.0]) == ['near_miss_end']
+    assert engine.pairs == {}
+
+
+def test_events_on_leaving(engine):
+    assert tick(engine, A=[0.0, 0.0], B=[0.5, 0.0]) == ['collision_start']
+    # Moving within the same state starts nothing new.
+    assert tick(engine, B=[0.75, 0.0]) == []
+    assert tick(engine, B=[10.0, 0.0]) == ['collision_end']
+    assert tick(engine, B=[20.0, 0.0]) == []
+    assert engine.stats()['collisions'] == 0
+
+
+def test_hysteresis_on_leaving():
+    engine = ProximityEngine(near_distance=2.0, default_radius=0.5, hysteresis=0.5)
+    assert tick(engine, A=[0.0, 0.0], B=[3.0, 0.0]) == ['near_miss_start']
+    # Within the hysteresis, the near miss continues instead of ending.
+    assert tick(engine, B=[3.4, 0.0]) == []
+    assert tick(engine, B=[2.9, 0.0]) == []
+    assert tick(engine, B=[3.6, 0.0]) == ['near_miss_end']
+    # Starting again needs the original threshold.
+    assert tick(engine, B=[3.4, 0.0]) == []
+    assert tick(engine, B=[3.0, 0.0]) == ['near_miss_start']
+
+    assert tick(engine, B=[1.0, 0.0]) == ['near_miss_end', 'collision_start']
+    assert tick(engine, B=[1.4, 0.0]) == []
+    assert tick(engine, B=[1.6, 0.0]) == ['collision_end', 'near_miss_start']
+
+
+def test_forget_ends_collisions(engine):
+    assert tick(engine, A=[0.0, 0.0], B=[0.5, 0.0]) == ['collision_start']
+    events = engine.forget('B')
+    assert [event['collision_type'] for event in events] == ['collision_end']
+    assert tick(engine, A=[0.1, 0.0]) == []
+
+
+class Registry(object):
+    def __init__(self, **radii):
+        self.trackables = {trackable_id: {'id': trackable_id, 'radius': radius}
+                           for trackable_id, radius in radii.items()}
+
+    def get(self, collection: str, trackable_id: str):
+        return self.trackables.get(trackable_id)
+
+
+def motion(trackable_id: str, x: float) -> tuple:
+    location = {'crs': 'local', 'position': {'type': 'Point', 'coordinates': [x, 0.0]}}
+    return 'trackable_motions', {'id': trackable_id, 'location': location}
+
+
+def change(trackable_id: str) -> tuple:
+    return 'metadata_changes', {'id': trackable_id, 'type': 'trackable', 'operation': 'update'}
+
+
+def test_metadata_change_then_motion():
+    registry = Registry(A=0.5, B=0.5)
+    events = []
+    engine = ProximityEngine(near_distance=2.0, registry=registry, callback=events.extend)
+    engine.handle([motion('A', 0.0), motion('B', 5.0)])
+    assert events == []
+
+    # B grows, and is checked again with its new radius right away, and whenever A moves.
+    registry.trackables['B']['radius'] = 3.0
+    engine.handle([change('B')])
+    assert [event['collision_type'] for event in events] == ['near_miss_start']
+    engine.handle([motion('A', 2.0)])
+    assert [event['collision_type'] for event in events] == ['near_miss_start', 'near_miss_end', 'collision_start']
+
+
+def test_metadata_change_and_motion_in_one_batch():
+    registry = Registry(A=0.5, B=0.5)
+    events = []
+    engine = ProximityEngine(near_distance=2.0, registry=registry, callback=events.extend)
+    engine.handle([motion('A', 0.0), motion('B', 5.0)])
+    registry.trackables['A']['radius'] = 2.0
+    engine.handle([change('A'), motion('B', 4.0), change('B')])
+    assert [event['collision_type'] for event in events] == ['near_miss_start']
+    assert engine.stats()['near_misses'] == 1
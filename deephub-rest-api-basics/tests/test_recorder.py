@@ -0,0 +1,27 @@
+from conftest import wait_until
+from DeepHubRecorder import TrajectoryRecorder
+from DeepHubTrajectory import Trajectory, chunk_files
+
+
+def location(provider_id: str, number: int) -> tuple:
+    return 'location_updates', {'provider_id': provider_id, 'provider_type': 'gps', 'crs': 'EPSG:4326',
+                                'position': {'type': 'Point', 'coordinates': [8.675 + number * 1e-6, 49.416]}}
+
+
+def counts(directory: str, provider_id: str) -> list:
+    return [Trajectory(file).count for file in chunk_files(directory, provider_id)]
+
+
+def test_reopened_chunks_stay_within_chunk_points(tmp_path):
+    # With one open file, the writers of the two providers are closed and reopened on every location.
+    with TrajectoryRecorder(str(tmp_path), chunk_points=3, max_open_files=1) as recorder:
+        for number in range(7):
+            recorder.handle([location('A', number), location('B', number)])
+    assert counts(str(tmp_path), 'A') == [3, 3, 1]
+    assert counts(str(tmp_path), 'B') == [3, 3, 1]
+
+
+def test_syncs_while_idle(tmp_path):
+    with TrajectoryRecorder(str(tmp_path), sync_interval=0.05) as recorder:
+        recorder.handle([location('A', 0)])
+        assert wait_until(lambda: counts(str(tmp_path), 'A') == [1], timeout=2)
@@ -0,0 +1,48 @@
+import pytest
+import requests as rest
+
+from conftest import wait_until
+from DeepHubRegistry import EntityRegistry
+from DeepHubStream import StreamConsumer
+
+
+@pytest.fixture
+def registry(hub):
+    registry = EntityRegistry(hub.url).load()
+    consumer = StreamConsumer(hub.ws_url, topics=['metadata_changes'], batch_delay=0.01)
+    consumer.add_sink(registry)
+    consumer.changes = []
+    consumer.add_sink(consumer.changes.extend)
+    consumer.start()
+    assert wait_until(lambda: consumer.connected and hub.subscribers and hub.subscribers[0].topics)
+    registry.consumer = consumer
+    yield registry
+    consumer.stop()
+
+
+def test_own_writes_are_not_reloaded(registry):
+    trackable = registry.create('trackables', {'name': 'forklift', 'location_providers': []})
+    registry.attach_trackable(trackable['id'], 'TEST_PROVIDER')
+    assert wait_until(lambda: len(registry.consumer.changes) == 2)
+
+    reads = registry.reads
+    assert registry.get('trackables', trackable['id'])['location_providers'] == ['TEST_PROVIDER']
+    assert registry.reads == reads
+
+
+def test_changes_of_other_clients_are_reloaded(hub, registry):
+    trackable = registry.create('trackables', {'name': 'forklift'})
+    assert wait_until(lambda: len(registry.consumer.changes) == 1)
+    rest.put(hub.url + '/trackables/' + trackable['id'], json=dict(trackable, name='truck'))
+    assert wait_until(lambda: len(registry.consumer.changes) == 2)
+
+    reads = registry.reads
+    assert registry.get('trackables', trackable['id'])['name'] == 'truck'
+    assert registry.reads == reads + 1
+
+
+def test_deleting_a_missing_entity_succeeds(hub, registry):
+    provider = registry.create('providers', {'id': 'TEST_PROVIDER', 'type': 'gps'})
+    rest.delete(hub.url + '/providers/' + provider['id'])
+    registry.delete('providers', provider['id'])
+    assert registry.get('providers', provider['id']) is None
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import time
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'deephub-rest-api-basics.py')
+
+# The modules that short commands must not import at startup.
+HEAVY_MODULES = ('websocket', 'numpy', 'matplotlib', 'pyproj')
+
+# The startup time allowed on top of that of a bare interpreter, in seconds. Importing matplotlib alone, as the
+# commented-out debug plot of the example loop would, takes longer.
+STARTUP_BUDGET = 0.4
+
+
+def startup_time(command: list, runs: int = 3) -> float:
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def test_help_imports_no_heavy_modules():
+    # Runs the script as __main__ like the command line does, and reports the heavy modules it imported.
+    code = ('import runpy, sys\n'
+            'sys.argv = [{script!r}, "--help"]\n'
+            'try:\n'
+            '    runpy.run_path({script!r}, run_name="__main__")\n'
+            'except SystemExit:\n'
+            '    pass\n'
+            'print("MODULES", " ".join(name for name in {heavy!r} if name in sys.modules), file=sys.stderr)\n'
+            ).format(script=SCRIPT, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(SCRIPT),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    line = [line for line in result.stderr.splitlines() if line.startswith('MODULES')][-1]
+    assert line.split()[1:] == []
+
+
+def test_help_starts_within_budget():
+    bare = startup_time([sys.executable, '-c', 'pass'])
+    example = startup_time([sys.executable, SCRIPT, '--help'])
+    assert example - bare < STARTUP_BUDGET
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+
+from conftest import wait_until
+from DeepHubStream import StreamConsumer
+
+TOPICS = ['location_updates', 'fence_events']
+
+
+def location(number: int) -> dict:
+    return {'provider_id': 'TEST_PROVIDER', 'provider_type': 'gps', 'crs': 'EPSG:4326',
+            'position': {'type': 'Point', 'coordinates': [8.675 + number * 1e-6, 49.416]}}
+
+
+def subscribed(hub) -> bool:
+    with hub.lock:
+        return len(hub.subscribers) == 1 and set(hub.subscribers[0].topics) == set(TOPICS)
+
+
+@pytest.fixture
+def consumer(hub):
+    consumer = StreamConsumer(hub.ws_url, topics=TOPICS, batch_delay=0.01, ping_interval=1,
+                              min_backoff=0.05, max_backoff=0.2)
+    consumer.events_seen = []
+    consumer.add_sink(consumer.events_seen.extend)
+    consumer.start()
+    assert wait_until(lambda: subscribed(hub))
+    yield consumer
+    consumer.stop()
+
+
+# Send location updates at a steady rate from a background thread, until the returned event is set.
+def send_steadily(hub, rate: float = 200):
+    stop = threading.Event()
+
+    def run():
+        number = 0
+        while not stop.wait(1.0 / rate):
+            hub.update_locations([location(number)])
+            number += 1
+
+    threading.Thread(target=run, daemon=True).start()
+    return stop
+
+
+def test_reconnects_and_resubscribes_after_dropped_connections(hub, consumer):
+    hub.update_locations([location(0)])
+    assert wait_until(lambda: len(consumer.events_seen) == 1)
+
+    hub.drop_connections()
+    assert wait_until(lambda: consumer.counters()['reconnects'] == 1)
+    assert wait_until(lambda: subscribed(hub))
+
+    hub.update_locations([location(1)])
+    assert wait_until(lambda: len(consumer.events_seen) == 2)
+    counters = consumer.counters()
+    assert counters['connected']
+    assert consumer.disconnects == 1
+    assert len(consumer.outages) == 1
+
+
+def test_records_outage_with_missed_estimate(hub, consumer):
+    stop = send_steadily(hub)
+    try:
+        # Let the consumer measure the event rate before the outage.
+        assert wait_until(lambda: len(consumer.events_seen) >= 100)
+        time.sleep(0.2)
+        hub.outage(0.5, websocket_only=True)
+        assert wait_until(lambda: not consumer.connected, timeout=2)
+        assert wait_until(lambda: consumer.counters()['reconnects'] == 1)
+        assert wait_until(lambda: subscribed(hub))
+        received = len(consumer.events_seen)
+        assert wait_until(lambda: len(consumer.events_seen) > received)
+    finally:
+        stop.set()
+
+    outage = consumer.outages[0]
+    assert 0.4 <= outage['duration'] < 2.0
+    assert outage['end'] > outage['start']
+    # About 200 events per second were missed for about half a second.
+    assert 20 < outage['missed_estimate'] < 400
+    counters = consumer.counters()
+    assert counters['downtime'] == pytest.approx(outage['duration'])
+    assert counters['missed_estimate'] == pytest.approx(outage['missed_estimate'])
+
+
+def test_keeps_dispatching_when_a_sink_fails(hub, consumer):
+    class FailingSink(object):
+        def handle(self, batch):
+            raise RuntimeError('failing on purpose')
+
+    consumer.sinks.insert(0, FailingSink())
+    hub.update_locations([location(0)])
+    hub.update_locations([location(1)])
+    assert wait_until(lambda: len(consumer.events_seen) == 2)
+    assert consumer.counters()['sink_errors'] >= 1
+
+
+def test_counts_messages_that_are_no_json_objects(hub, consumer):
+    for message in ('[]', '"x"', '1', '{'):
+        hub.subscribers[0].send(message)
+    hub.update_locations([location(0)])
+    assert wait_until(lambda: len(consumer.events_seen) == 1)
+    assert consumer.counters()['errors'] == 4
+
+
+def test_counts_error_messages_of_the_hub(hub, consumer):
+    hub.subscribers[0].send('{"event": "error", "code": 10000, "description": "unknown topic"}')
+    hub.update_locations([location(0)])
+    assert wait_until(lambda: len(consumer.events_seen) == 1)
+    counters = consumer.counters()
+    assert counters['hub_errors'] == 1
+    assert counters['errors'] == 0
@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+import DeepHubClasses as dh
+from DeepHubPublisher import WriteBehindPublisher
+
+
+def location(number: int) -> dh.Location:
+    location = dh.Location(provider_id='TEST_PROVIDER_' + str(number), provider_type='gps')
+    location.crs = 'EPSG:4326'
+    location.position = dh.Point(coordinates=[8.675 + number * 1e-6, 49.416])
+    return location
+
+
+@pytest.fixture
+def make_publisher(hub):
+    publishers = []
+
+    def make(**options):
+        options.setdefault('min_backoff', 0.01)
+        options.setdefault('max_backoff', 0.02)
+        publisher = WriteBehindPublisher(hub.url, **options)
+        publishers.append(publisher)
+        return publisher
+
+    yield make
+    for publisher in publishers:
+        publisher.close()
+
+
+# Flush the publisher from another thread, and return whether it finished within the timeout.
+def flush(publisher, timeout: float = 5.0) -> bool:
+    thread = threading.Thread(target=publisher.flush, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_retries_rejected_batches(hub, make_publisher, status):
+    publisher = make_publisher()
+    hub.fail(status, 2)
+    for number in range(10):
+        publisher.publish(location(number))
+    assert flush(publisher)
+
+    assert len(hub.locations) == 10
+    stats = publisher.stats()
+    assert stats['retries'] == 2
+    assert stats['failed'] == 0
+    assert stats['updates'] == 10
+
+
+@pytest.mark.parametrize('retry_after, wait', [('0.3', 0.3), ('60', 0.5)])
+def test_honors_retry_after_up_to_max_backoff(hub, make_publisher, retry_after, wait):
+    publisher = make_publisher(max_backoff=0.5)
+    hub.fail(429, 1, retry_after=retry_after)
+    publisher.publish(location(0))
+    start = time.monotonic()
+    assert flush(publisher)
+
+    assert wait <= time.monotonic() - start < wait + 0.5
+    assert publisher.stats()['retries'] == 1
+    assert len(hub.locations) == 1
+
+
+def test_gives_up_after_max_retries(hub, make_publisher):
+    publisher = make_publisher(max_retries=2)
+    hub.fail(500, 3)
+    publisher.publish(location(0))
+    assert flush(publisher)
+
+    assert not hub.locations
+    stats = publisher.stats()
+    assert stats['retries'] == 2
+    assert stats['failed'] == 1
+    assert stats['updates'] == 0
+
+
+def test_full_queue_drops_oldest(hub, make_publisher):
+    # Nothing is sent before the flush, as batches neither fill up nor time out.
+    publisher = make_publisher(max_queue=5, max_batch_size=100, max_delay=60)
+    for number in range(8):
+        publisher.publish(location(number))
+    assert publisher.queue_depth == 5
+    assert flush(publisher)
+
+    assert sorted(hub.locations) == ['TEST_PROVIDER_' + str(number) for number in range(3, 8)]
+    stats = publisher.stats()
+    assert stats['dropped'] == 3
+    assert stats['max_queue_depth'] == 5
+
+
+def test_full_queue_keeps_latest_per_provider(hub, make_publisher):
+    publisher = make_publisher(max_queue=3, policy='latest', max_batch_size=100, max_delay=60)
+    for number in (0, 1, 0, 2, 3):
+        publisher.publish(location(number))
+    assert flush(publisher)
+
+    # Provider 0 was superseded by its second location, and then dropped as the oldest for provider 3.
+    assert sorted(hub.locations) == ['TEST_PROVIDER_1', 'TEST_PROVIDER_2', 'TEST_PROVIDER_3']
+    stats = publisher.stats()
+    assert stats['superseded'] == 1
+    assert stats['dropped'] == 1
+
+
+def test_flush_drains_the_whole_queue(hub, make_publisher):
+    # While the first batch is in flight, the queue grows beyond one batch, so the flush takes several batches.
+    hub.delay = 0.2
+    publisher = make_publisher(max_batch_size=10, max_delay=60)
+    for number in range(25):
+        publisher.publish(location(number))
+    assert flush(publisher)
+
+    assert len(hub.locations) == 25
+    assert publisher.queue_depth == 0
@@ -1,55 +1,33 @@
+import os
+import sys
 
-print ("abc")
-from email import message
-#from ossaudiodev import SNDCTL_DSP_BIND_CHANNEL
+# The consumer library is shared with the REST API example.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'deephub-rest-api-basics'))
+from DeepHubStream import DEFAULT_TOPICS, StreamConsumer
+from DeepHubProximity import ProximityEngine
 
 
-def callback_on_open (ws):
-  body = '{"event": "subscribe", "topic" : "location_updates"}'
-  ws.send (body)
-  body = '{"event": "subscribe", "topic" : "fence_events"}'
-  ws.send (body)
-  body = '{"event": "subscribe", "topic" : "trackable_motions"}'
-  ws.send (body)
-  body = '{"event": "subscribe", "topic" : "collision_events"}'
-  ws.send (body)
-
-def callback_on_close (ws):
-  print ("### Connection to " + ws.url + " was closed.")
-
-def callback_on_message (ws, message):
-  import json
-  messageAsJson = json.loads (message)
-  print (messageAsJson)
-
-
-def callback_on_error (ws, error):
-  if error:
-    print (error)
+def print_events (batch):
+  for topic, payload in batch:
+    print (topic, payload)
 
 
 #
 # MAIN
 #
 
-# subscribe to location updates and wait for events
-  # Import WebSocket client library
-
-  # Connect to WebSocket with no timeout
+# subscribe to location updates, fence events, trackable motions and collision events and print them.
+# The socket is read in a dedicated thread, and the events are decoded and printed in batches.
 deephub_ws_url   = 'ws://localhost:8081/deephub'
 
-import websocket
-ws = websocket.WebSocketApp(deephub_ws_url + "/v1/ws/socket",
-                              on_message = callback_on_message, 
-                              on_error   = callback_on_error, 
-                              on_open    = callback_on_open,
-                              on_close   = callback_on_close)
-
-ws.run_forever (ping_interval = 30)
-
-
-  # Infinite loop waiting and dumping for WebSocket data
-while True:
-    print (ws.recv())
+consumer = StreamConsumer (deephub_ws_url + "/v1/ws/socket", topics = DEFAULT_TOPICS, ping_interval = 30)
+consumer.add_sink (print_events)
 
+# detect collisions and near misses of trackables closer than 2 meters locally, from their trackable motions.
+consumer.add_sink (ProximityEngine (near_distance = 2, callback = lambda events: print_events (
+  [('proximity_events', event) for event in events])))
 
+try:
+  consumer.run_forever ()
+except KeyboardInterrupt:
+  print ('\nStopped')